@@ -0,0 +1,84 @@
+#! /usr/bin/python3
+"""Generator of synthetic transaction files for the benchmarks.
+
+Files are generated from a seeded random number generator, so the same
+arguments always produce the same file.
+"""
+import random
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from typing import Iterator
+
+HEADER = "id,date,transaction"
+
+
+def generate_rows(
+    rows: int,
+    duplicate_ratio: float = 0.0,
+    start: date = date(2000, 1, 1),
+    years: int = 10,
+    credit_ratio: float = 0.5,
+    accounts: int = 0,
+    seed: int = 0,
+) -> Iterator[str]:
+    """Yields the lines of a transactions csv file, starting with its header.
+
+    :param rows: the number of transactions
+    :param duplicate_ratio: the share of rows repeating the id of an earlier row
+    :param start: the date of the earliest transactions
+    :param years: the number of years the dates span
+    :param credit_ratio: the share of credit (positive) transactions
+    :param accounts: the number of accounts the transactions are spread
+                     over; the file has no account column if 0
+    :param seed: the seed of the random number generator
+
+    """
+    rng = random.Random(seed)
+    dates = [
+        (start + timedelta(days=day)).strftime("%Y/%m/%d") for day in range(years * 365)
+    ]
+    yield HEADER + (",account\n" if accounts else "\n")
+    next_id = 1
+    for _ in range(rows):
+        if next_id > 1 and rng.random() < duplicate_ratio:
+            id = rng.randrange(1, next_id)
+        else:
+            id = next_id
+            next_id += 1
+        sign = "+" if rng.random() < credit_ratio else "-"
+        line = f"{id},{rng.choice(dates)},{sign}{rng.randrange(1, 100000) / 100}"
+        if accounts:
+            line += f",account-{rng.randrange(accounts)}"
+        yield line + "\n"
+
+
+def write_file(path: str, rows: int, **options) -> None:
+    """Writes a transactions csv file generated by generate_rows to the path."""
+    with open(path, "w", buffering=1024 * 1024) as file:
+        file.writelines(generate_rows(rows, **options))
+
+
+def cli():
+    parser = ArgumentParser(description="Generate a synthetic transactions file")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--credit-ratio", type=float, default=0.5)
+    parser.add_argument("--accounts", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_file(
+        args.path,
+        args.rows,
+        duplicate_ratio=args.duplicate_ratio,
+        years=args.years,
+        credit_ratio=args.credit_ratio,
+        accounts=args.accounts,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    cli()
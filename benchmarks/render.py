@@ -0,0 +1,38 @@
+#! /usr/bin/python3
+"""Benchmark of rendering a summary email spanning many years of months."""
+from argparse import ArgumentParser
+from timeit import Timer
+
+from src.summary_renderer import render_summary
+from src.transaction_summarizer import MonthSummary, TransactionSummary
+
+
+def build_summary(years: int) -> TransactionSummary:
+    return TransactionSummary(
+        months=tuple(
+            MonthSummary(1970 + year, month, 100, 5000.5, 60, -2500.25, 40, 2500.25)
+            for year in range(years)
+            for month in range(1, 13)
+        )
+    )
+
+
+def bench_render(years: int = 50, repeat: int = 5) -> float:
+    """Returns the best time, in seconds, to render a summary of ``years`` years."""
+    summary = build_summary(years)
+    timer = Timer(lambda: render_summary(summary))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def cli():
+    parser = ArgumentParser(description="Benchmark the summary email rendering")
+    parser.add_argument("--years", type=int, default=50)
+    args = parser.parse_args()
+
+    seconds = bench_render(args.years)
+    print(f"render {args.years * 12} months: {seconds * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,280 @@
+#! /usr/bin/python3
+"""Benchmark suite for ingesting, summarizing, rendering and sending.
+
+The suite runs offline: transactions are written to a temporary SQLite DB,
+or to the DB at ``--db-url`` (e.g. a local PostgreSQL), and emails are
+sent to a local SMTP stand-in. The send benchmarks require aiosmtpd and
+are skipped without it.
+
+Results are printed and, with ``--output``, written as JSON along with
+the DB's query plan of each summarizer query (printed with ``--plans``).
+Given the JSON of an earlier run as ``--baseline``, every benchmark
+slower than its baseline by more than ``--threshold`` is reported as a
+regression, and the suite exits with a non-zero status.
+"""
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+from argparse import ArgumentParser
+from datetime import date
+from functools import partial
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+from src.config import settings
+
+Results = Dict[str, Dict[str, float]]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def best_of(repeat: int, function: Callable[[], object]) -> float:
+    """Returns the shortest time, in seconds, of ``repeat`` calls to the function."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def record(results: Results, name: str, seconds: float, items: int = 0) -> None:
+    results[name] = {"seconds": seconds}
+    if items:
+        results[name]["per_second"] = items / seconds
+    rate = f" ({items / seconds:,.0f}/s)" if items else ""
+    print(f"{name:<48} {seconds * 1000:>12.3f} ms{rate}")
+
+
+def bench_seeder(
+    db_url: str, workdir: str, sizes: List[int], repeat: int, results: Results
+) -> None:
+    """Measures ingesting generated files into empty tables with each parser.
+
+    The tables are left holding the largest file, for bench_summarizer.
+    """
+    from benchmarks.generate import write_file
+    from src.db.db import DbAPI
+    from src.db.migrations import migrate
+    from src.models import Base
+    from src.transaction_seeder import TransactionSeeder
+
+    db = DbAPI(db_url)
+    for rows in sizes:
+        path = os.path.join(workdir, f"transactions-{rows}.csv")
+        write_file(path, rows, duplicate_ratio=0.1, accounts=100)
+        variants = {"rows": ("rows", None), "columnar": ("columnar", None)}
+        # Parsing and writing in turns, rather than through the seeder's queue
+        variants["rows.sequential"] = ("rows", 0)
+        for name, (parser, queue_size) in variants.items():
+
+            def ingest():
+                Base.metadata.drop_all(db.engine)
+                migrate(db)
+                with open(path, "rb") as file:
+                    seeder = TransactionSeeder(
+                        dbapi=db, parser=parser, queue_size=queue_size
+                    )
+                    seeder.parse_file(iter(partial(file.read, CHUNK_SIZE), b""))
+
+            record(results, f"seeder.{name}.{rows}", best_of(repeat, ingest), rows)
+
+
+def explain(db, statement) -> str:
+    """Returns the DB's query plan for the statement, one step per line."""
+    sql = statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    with db.engine.connect() as connection:
+        if db.engine.dialect.name == "sqlite":
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+        else:
+            rows = connection.exec_driver_sql(f"EXPLAIN {sql}")
+        return "\n".join(row[-1] for row in rows)
+
+
+def bench_summarizer(
+    db_url: str, rows: int, repeat: int, results: Results, plans: Dict[str, str]
+) -> None:
+    """Measures each of the summarizer's queries on ``rows`` ingested transactions.
+
+    The query plan of each one is added to ``plans``.
+    """
+    from src.db.db import DbAPI
+    from src.summary_cache import SummaryCache
+    from src.transaction_summarizer import SummaryWindow, TransactionSummarizer
+
+    db = DbAPI(db_url)
+    # An empty cache, so that settings do not turn the configured one on
+    cache = SummaryCache(max_size=0, ttl=0)
+    summarizer = TransactionSummarizer(db_api=db, use_aggregates=False, cache=cache)
+    aggregates = TransactionSummarizer(db_api=db, use_aggregates=True, cache=cache)
+    # The last year of the generated files, compared with the year before
+    window = SummaryWindow.last_months(12, today=date(2009, 12, 31))
+    queries = {
+        "summary": (
+            lambda: summarizer.summary(use_cache=False),
+            summarizer.summary_statement(),
+        ),
+        "summary.account": (
+            lambda: summarizer.summary("account-0", use_cache=False),
+            summarizer.summary_statement("account-0"),
+        ),
+        "window_summary": (
+            lambda: summarizer.window_summary(window, compare=True),
+            summarizer.window_statement(window, compare=True),
+        ),
+        "summaries_by_account": (
+            lambda: list(summarizer.summaries_by_account()),
+            summarizer.summary_statement(by_account=True),
+        ),
+        "aggregates.summary": (
+            lambda: aggregates.summary(use_cache=False),
+            aggregates.summary_statement(),
+        ),
+        "aggregates.summaries_by_account": (
+            lambda: list(aggregates.summaries_by_account()),
+            aggregates.summary_statement(by_account=True),
+        ),
+    }
+    for name, (query, statement) in queries.items():
+        record(results, f"summarizer.{name}.{rows}", best_of(repeat, query))
+        plans[f"summarizer.{name}"] = explain(db, statement)
+
+
+def bench_render(repeat: int, results: Results) -> None:
+    from benchmarks.render import bench_render as render
+
+    years = 50
+    record(results, f"render.{years * 12}_months", render(years, repeat))
+
+
+def bench_smtp(emails: int, repeat: int, results: Results) -> None:
+    """Measures sending summary emails to a local SMTP stand-in."""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        print("smtp: skipped, aiosmtpd is not installed")
+        return
+    from src.email_gateway import EmailGateway, OutgoingEmail, close_pools
+
+    class DiscardingHandler:
+        async def handle_DATA(self, server, session, envelope):
+            return "250 OK"
+
+    with socket.socket() as free_port:
+        free_port.bind(("127.0.0.1", 0))
+        port = free_port.getsockname()[1]
+    controller = Controller(DiscardingHandler(), hostname="127.0.0.1", port=port)
+    controller.start()
+    settings.set("smtp_server", "127.0.0.1")
+    settings.set("smtp_port", port)
+    settings.set("smtp_ssl", False)
+    settings.set("sender_email_password", "")
+    close_pools()
+    try:
+        gateway = EmailGateway()
+        batch = [
+            OutgoingEmail(f"{i}@example.com", "Summary", "plain", "<p>html</p>")
+            for i in range(emails)
+        ]
+
+        def send_one_by_one():
+            for email in batch:
+                gateway.send_email(*email)
+
+        seconds = best_of(repeat, lambda: gateway.send_many(batch))
+        record(results, f"smtp.send_many.{emails}", seconds, emails)
+        seconds = best_of(repeat, send_one_by_one)
+        record(results, f"smtp.send_email.{emails}", seconds, emails)
+    finally:
+        close_pools()
+        controller.stop()
+
+
+def compare(results: Results, baseline: Results, threshold: float) -> List[str]:
+    """Returns a description of every benchmark slower than its baseline
+    by more than ``threshold`` (e.g. 0.2 for 20%).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["seconds"] / baseline[name]["seconds"] - 1
+        if change > threshold:
+            regressions.append(f"{name}: {change:+.1%} slower than the baseline")
+    return regressions
+
+
+def _configure_db(db_url: Optional[str], workdir: str) -> str:
+    if db_url:
+        return db_url
+    path = os.path.join(workdir, "benchmarks.db")
+    # So that anything using the DB from the settings uses this one too
+    settings.set("db_dialect", "sqlite")
+    settings.set("db_file", path)
+    return f"sqlite:///{path}"
+
+
+def cli():
+    parser = ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[1_000, 100_000],
+        help="the sizes of the ingested files, in rows",
+    )
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db-url", help="a DB to run on instead of SQLite")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="the JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument(
+        "--plans", action="store_true", help="print the query plan of each summary"
+    )
+    args = parser.parse_args()
+
+    results: Results = {}
+    plans: Dict[str, str] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        db_url = _configure_db(args.db_url, workdir)
+        bench_seeder(db_url, workdir, sorted(args.rows), args.repeat, results)
+        bench_summarizer(db_url, max(args.rows), args.repeat, results, plans)
+        bench_render(args.repeat, results)
+        bench_smtp(args.emails, args.repeat, results)
+
+        from src.db.db import dispose_engines
+
+        dispose_engines()
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "db": db_url.split(":", 1)[0],
+        },
+        "results": results,
+        "plans": plans,
+    }
+    if args.plans:
+        for name, plan in plans.items():
+            print(f"\n{name}:\n{plan}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
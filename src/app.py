@@ -1,16 +1,20 @@
 #! /usr/bin/python3
+import base64
+import binascii
 import logging
-import re
 import sys
-from argparse import ArgumentParser, FileType
-
-from requests_toolbelt.multipart import decoder
+from argparse import ArgumentParser, ArgumentTypeError, FileType
+from functools import partial
+from time import perf_counter
+from typing import Iterator, Union
 
+from src import instrumentation
+from src.compression import DecompressionError, decompress_stream, detect_encoding
 from src.config import settings
-from src.db.db import DBClientError
-from src.email_gateway import EmailGatewayError
-from src.transaction_seeder import MalformedInputFileError, TransactionSeeder
-from src.transaction_summarizer import TransactionSummarizer
+from src.multipart import MultipartError, find_part
+
+# The DB and SMTP modules (and with them SQLAlchemy, the DB driver and the
+# SSL context) are imported on first use rather than on a cold start
 
 
 class BadRequestError(Exception):
@@ -23,23 +27,95 @@ BAD_REQUEST_MESSAGE = (
 )
 
 
-def _run_process(file, logger):
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_chunks(
+    content: Union[bytes, memoryview], chunk_size: int = CHUNK_SIZE
+) -> Iterator[memoryview]:
+    """Yields the content in chunks without copying it."""
+    view = memoryview(content)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+def _run_process(file, logger, workers=1, content_hash=None):
+    from src.transaction_seeder import TransactionSeeder
+
     seeder = TransactionSeeder(logger=logger)
-    seeder.parse_file(file)
-    logger.info("CSV file parsed correctly")
+
+    def ingest():
+        with instrumentation.span("ingest"):
+            if workers > 1:
+                return seeder.parse_path(file.name, workers)
+            return seeder.parse_file(file)
+
+    if content_hash is None or not settings.get("ingest_idempotency", True):
+        result = ingest()
+    elif skip_if_ingested(content_hash, logger):
+        return
+    else:
+        from src.ingest_log import IngestLog
+
+        result = IngestLog(logger=logger).run(content_hash, ingest)
+    logger.info(
+        f"CSV file parsed correctly: {result.inserted} transactions inserted, "
+        f"{result.updated} updated"
+    )
+    deliver_summary(logger)
+
+
+def skip_if_ingested(content_hash, logger):
+    """Whether the file was already ingested, and so is to be skipped.
+
+    The summary of a skipped file is delivered again, unless
+    ``ingest_skip_duplicate_email`` is set.
+    """
+    from src.ingest_log import IngestLog
+
+    previous = IngestLog(logger=logger).find_completed(content_hash)
+    if previous is None:
+        return False
+    logger.info(f"CSV file already ingested at {previous.finished_at}, skipped")
+    instrumentation.count("ingest.duplicates")
+    if not settings.get("ingest_skip_duplicate_email", False):
+        deliver_summary(logger)
+    return True
+
+
+def deliver_summary(logger):
+    """Sends the summary email, or enqueues it when delivered by the outbox."""
+    if settings.get("email_delivery", "sync") == "outbox":
+        from src.outbox import EmailOutbox
+
+        EmailOutbox(logger=logger).enqueue(
+            settings.target_email, settings.email_subject
+        )
+        return
+
+    from src.transaction_summarizer import TransactionSummarizer
 
     summarizer = TransactionSummarizer(logger=logger)
-    summarizer.send_summary_email(settings.target_email, settings.email_subject)
+    with instrumentation.span("email"):
+        summarizer.send_summary_email(settings.target_email, settings.email_subject)
     logger.info("Summary email sent successfully")
 
 
 def handle(event, context):
+    with instrumentation.invocation("handle"):
+        return _handle(event, context)
+
+
+def _handle(event, context):
+    from src.db.db import DBClientError
+    from src.email_gateway import EmailGatewayError
+    from src.ingest_log import content_hash
+    from src.transaction_seeder import MalformedInputFileError
+
     logger = logging.getLogger(__name__)
     # TODO: Log level should be setup from env vars for different stages
     logger.setLevel(logging.INFO)
     try:
-        logger.debug(f"File received: {event['body']}")
-
         event_body = event.get("body")
         if not event_body:
             raise BadRequestError(BAD_REQUEST_MESSAGE)
@@ -54,33 +130,34 @@ def handle(event, context):
                 content_key = key
                 break
 
-        multipart_data = decoder.MultipartDecoder(
-            content=event_body.encode(),
-            content_type=event["headers"].get(content_key),
-        )
-        file = None
-
-        # Once the Multipart request has been decoded we need
-        # to iterate over its parts to find the relevant item
-        for part in multipart_data.parts:
-            # MultipartDecoder transforms each of its parts' headers
-            # into bytes. We transform it back into strings for easier
-            # handling
-            clean_headers = {
-                k.decode(): v.decode()
-                for k, v in part.headers.items()
-                if isinstance(k, bytes)
-            }
-            part_found = re.findall('name="file"', clean_headers["Content-Disposition"])
-            if part_found:
-                file = part.text
-        if not file:
+        # API Gateway base64-encodes binary bodies, like compressed files
+        if event.get("isBase64Encoded"):
+            try:
+                content = base64.b64decode(event_body, validate=True)
+            except binascii.Error as e:
+                raise BadRequestError(BAD_REQUEST_MESSAGE) from e
+        else:
+            content = event_body.encode()
+
+        # The file part is a view into the body, so it is never copied
+        # before being parsed
+        try:
+            part = find_part(content, event["headers"].get(content_key), "file")
+        except MultipartError as e:
+            raise BadRequestError(BAD_REQUEST_MESSAGE) from e
+        if part is None or not part.content:
             raise BadRequestError(BAD_REQUEST_MESSAGE)
 
-        file = file.split("\n")
-        _run_process(file, logger)
+        # Compressed files are decompressed as they are parsed, so the
+        # uncompressed file is never held in memory as a whole
+        content_encoding = part.headers.get("content-encoding")
+        _run_process(
+            decompress_stream(_iter_chunks(part.content), content_encoding),
+            logger,
+            content_hash=content_hash(_iter_chunks(part.content)),
+        )
 
-    except (BadRequestError, MalformedInputFileError) as e:
+    except (BadRequestError, MalformedInputFileError, DecompressionError) as e:
         logger.error(str(e))
         status_code = 400
         body = str(e)
@@ -99,9 +176,43 @@ def handle(event, context):
         return {"statusCode": status_code, "body": body}
 
 
+def _run_batch(paths, logger, workers=1, force=False):
+    from src.batch_ingest import BatchIngest
+
+    start = perf_counter()
+    reports = BatchIngest(logger=logger, workers=workers, force=force).run(paths)
+    # As for a single file, a batch of files that were all ingested before
+    # can skip the summary email
+    applied = not all(report.skipped for report in reports)
+    if applied or not settings.get("ingest_skip_duplicate_email", False):
+        deliver_summary(logger)
+    rows = sum(report.rows for report in reports if not report.skipped)
+    logger.info(
+        f"{len(reports)} files, {rows} rows ingested in {perf_counter() - start:.2f}s"
+    )
+
+
 def cli():
     parser = ArgumentParser()
-    parser.add_argument("filename", type=FileType("r", encoding="utf-8"))
+    parser.add_argument(
+        "filenames",
+        nargs="+",
+        metavar="filename",
+        help="a csv file, or - for stdin; several files, directories or glob "
+        "patterns are ingested as a batch, with a single summary email",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="parse the file in parallel with this many processes, or as many "
+        "files at once in a batch",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="ingest the file even if it was already ingested",
+    )
     args = parser.parse_args()
 
     logger = logging.getLogger(__name__)
@@ -109,7 +220,41 @@ def cli():
     logger.setLevel(logging.INFO)
     logger.addHandler(logging.StreamHandler(sys.stdout))
 
-    _run_process(args.filename.readlines(), logger)
+    from src.batch_ingest import expand_paths, is_batch
+
+    if is_batch(args.filenames):
+        if "-" in args.filenames:
+            parser.error("a batch can't include stdin")
+        try:
+            paths = expand_paths(args.filenames)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        with instrumentation.invocation("cli"):
+            _run_batch(paths, logger, workers=args.workers, force=args.force)
+        return
+
+    try:
+        file = FileType("rb")(args.filenames[0])
+    except ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.workers > 1 and file is sys.stdin.buffer:
+        parser.error("--workers requires a file, not stdin")
+    if args.workers > 1 and detect_encoding(file.peek(4)):
+        parser.error("--workers requires an uncompressed file")
+
+    with instrumentation.invocation("cli"), file:
+        file_hash = None
+        # Files are read twice, first to hash them, so stdin is never skipped
+        if not args.force and file.seekable():
+            from src.ingest_log import content_hash
+
+            file_hash = content_hash(iter(partial(file.read, CHUNK_SIZE), b""))
+            file.seek(0)
+        if args.workers > 1:
+            _run_process(file, logger, workers=args.workers, content_hash=file_hash)
+        else:
+            chunks = iter(partial(file.read, CHUNK_SIZE), b"")
+            _run_process(decompress_stream(chunks), logger, content_hash=file_hash)
 
 
 if __name__ == "__main__":
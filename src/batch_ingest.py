@@ -0,0 +1,212 @@
+#! /usr/bin/python3
+"""Ingestion of batches of files, e.g. a month of daily files.
+
+Files are parsed with the columnar parser by a pool of worker processes,
+a bounded number of them at a time, and applied in the order they were
+given, each within its own DB transaction. So later files win on
+conflicting ids, whatever the order in which they are parsed. Each file
+is recorded in the ingest log, so running a batch again after a failure
+skips the files that were already applied.
+"""
+import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from glob import glob
+from logging import Logger
+from time import perf_counter
+from typing import TYPE_CHECKING, Deque, Iterable, List, Optional, Tuple
+
+from src import instrumentation
+from src.compression import decompress_stream
+from src.config import settings
+from src.db.db import DbAPI
+from src.ingest_log import IngestLog, content_hash
+from src.transaction_seeder import (
+    IngestResult,
+    MalformedInputFileError,
+    TransactionSeeder,
+)
+
+if TYPE_CHECKING:
+    from src.columnar import TransactionColumns
+
+_GLOB_CHARACTERS = re.compile(r"[*?[]")
+
+
+@dataclass(frozen=True)
+class FileReport:
+    """How a file of a batch was ingested, and how long it took."""
+
+    path: str
+    rows: int
+    parse_seconds: float
+    write_seconds: float = 0.0
+    result: Optional[IngestResult] = None
+
+    @property
+    def skipped(self) -> bool:
+        return self.result is None
+
+    @property
+    def rows_per_second(self) -> float:
+        seconds = self.parse_seconds + self.write_seconds
+        return self.rows / seconds if seconds else 0.0
+
+
+def is_batch(paths: List[str]) -> bool:
+    """Whether the paths name more than a single file."""
+    if len(paths) != 1:
+        return True
+    path = paths[0]
+    return os.path.isdir(path) or (
+        not os.path.exists(path) and bool(_GLOB_CHARACTERS.search(path))
+    )
+
+
+def expand_paths(paths: Iterable[str]) -> List[str]:
+    """Returns the files named by the paths, directories and glob patterns.
+
+    Files are returned in the order they were named, the files of a
+    directory or a pattern sorted by name. A file named more than once is
+    only returned at its first position.
+
+    :raises FileNotFoundError: if a path does not exist or a pattern does
+                               not match any file
+
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(
+                entry.path for entry in os.scandir(path) if entry.is_file()
+            )
+        elif os.path.exists(path):
+            matches = [path]
+        else:
+            matches = sorted(p for p in glob(path) if os.path.isfile(p))
+        if not matches:
+            raise FileNotFoundError(f"No files match {path}")
+        files.extend(matches)
+    return list(dict.fromkeys(files))
+
+
+def _parse_file(
+    path: str, batch_size: int
+) -> Tuple[str, List["TransactionColumns"], float]:
+    """Worker side: reads, hashes and parses a whole file.
+
+    :returns: the hash of the file, its parsed batches and the seconds taken
+
+    """
+    # Imported here so that NumPy is only loaded by the columnar parser
+    from src.columnar import ColumnarParseError, parse_columns
+
+    start = perf_counter()
+    with open(path, "rb") as file:
+        content = file.read()
+    try:
+        text = b"".join(decompress_stream([content])).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise MalformedInputFileError(
+            f"{path}: The input csv file is not valid UTF-8"
+        ) from None
+    lines = text.split("\n")
+    if not lines[-1]:
+        lines.pop()
+    try:
+        batches = list(parse_columns(lines, batch_size))
+    except ColumnarParseError as e:
+        # Raised as the seeder's error, which survives being pickled
+        raise MalformedInputFileError(f"{path}: {e}") from None
+    return content_hash([content]), batches, perf_counter() - start
+
+
+class BatchIngest:
+    """Class for ingesting many files with bounded parallelism.
+
+    Up to twice ``workers`` files are read and parsed at a time, so memory
+    is bounded by the size of the largest files rather than by the size
+    of the batch. Files are read whole, so large files are better served
+    by the --workers flag of a single file or by src.chunked_ingest.
+    """
+
+    def __init__(
+        self,
+        dbapi: Optional[DbAPI] = None,
+        logger: Optional[Logger] = None,
+        workers: int = 1,
+        force: bool = False,
+    ):
+        self.log = logger or logging.getLogger(__name__)
+        self.seeder = TransactionSeeder(dbapi=dbapi, logger=self.log, parser="columnar")
+        self.workers = max(1, workers)
+        self.ingest_log = None
+        if not force and settings.get("ingest_idempotency", True):
+            self.ingest_log = IngestLog(dbapi=self.seeder.db, logger=self.log)
+
+    def run(self, paths: List[str]) -> List[FileReport]:
+        """Parses the files in parallel and applies them in order.
+
+        :returns: a FileReport for each file
+        :raises MalformedInputFileError: if any row of a file is malformed;
+                                         the files before it stay applied
+
+        """
+        reports = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending: Deque[Tuple[str, Future]] = deque()
+            remaining = iter(paths)
+            while True:
+                while len(pending) < 2 * self.workers:
+                    path = next(remaining, None)
+                    if path is None:
+                        break
+                    future = executor.submit(_parse_file, path, self.seeder.batch_size)
+                    pending.append((path, future))
+                if not pending:
+                    return reports
+                path, future = pending.popleft()
+                try:
+                    file_hash, batches, parse_seconds = future.result()
+                except Exception:
+                    for _, later in pending:
+                        later.cancel()
+                    raise
+                report = self._apply(path, file_hash, batches, parse_seconds)
+                reports.append(report)
+                self._log_report(report)
+
+    def _apply(
+        self,
+        path: str,
+        file_hash: str,
+        batches: List["TransactionColumns"],
+        parse_seconds: float,
+    ) -> FileReport:
+        rows = sum(len(batch) for batch in batches)
+        if self.ingest_log is not None and self.ingest_log.find_completed(file_hash):
+            instrumentation.count("ingest.duplicates")
+            return FileReport(path, rows, parse_seconds)
+
+        start = perf_counter()
+        with instrumentation.span("ingest"):
+            if self.ingest_log is not None:
+                result = self.ingest_log.run(
+                    file_hash, lambda: self.seeder.write_columns(batches)
+                )
+            else:
+                result = self.seeder.write_columns(batches)
+        return FileReport(path, rows, parse_seconds, perf_counter() - start, result)
+
+    def _log_report(self, report: FileReport) -> None:
+        if report.skipped:
+            self.log.info(f"{report.path}: already ingested, skipped")
+            return
+        self.log.info(
+            f"{report.path}: {report.rows} rows, parsed in "
+            f"{report.parse_seconds:.2f}s and written in "
+            f"{report.write_seconds:.2f}s ({report.rows_per_second:,.0f} rows/s)"
+        )
@@ -0,0 +1,559 @@
+#! /usr/bin/python3
+"""Resumable ingestion of large files, in checkpointed chunks.
+
+Files too large to be ingested within a single Lambda invocation are
+split into numbered, newline-aligned byte ranges (chunks) when planned.
+Each chunk is parsed, and its rows staged in file order, within the same
+DB transaction that marks it as committed in the ingest_chunks table. So
+chunks can be processed in parallel by any number of workers, and a
+worker that crashes or times out only loses the chunk it was processing:
+
+    python -m src.chunked_ingest transactions.csv --workers 4
+
+Once every chunk is committed, the job is merged: the last staged row of
+each id is upserted into the transactions table, along with the deltas of
+the monthly aggregates, within a single DB transaction. Then the summary
+email is sent, once. Running the same command again, or invoking the
+Lambda handler again with the same event, resumes an interrupted job.
+"""
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+from logging import Logger
+from math import ceil
+from multiprocessing import get_context
+from time import monotonic
+from typing import Callable, List, Optional
+
+from sqlalchemy import (
+    Integer,
+    Subquery,
+    and_,
+    cast,
+    delete,
+    extract,
+    func,
+    or_,
+    select,
+    update,
+)
+
+from src import instrumentation
+from src.columnar import ColumnarParseError, header_columns
+from src.config import settings
+from src.db.db import DBClientError, DbAPI
+from src.ingest_log import COMPLETED as INGEST_COMPLETED
+from src.ingest_log import content_hash
+from src.models import (
+    IngestChunk,
+    IngestJob,
+    IngestRecord,
+    StagedTransaction,
+    utcnow,
+)
+from src.monthly_aggregates import MonthlyAggregator
+from src.parallel_parsing import parse_range, split_file
+from src.staging import merge_last_rows
+from src.summary_cache import bump_data_version
+from src.transaction_seeder import IngestResult, MalformedInputFileError
+
+# Statuses of a chunk
+PENDING = "pending"
+COMMITTED = "committed"
+FAILED = "failed"
+
+# Statuses of a job
+RUNNING = "running"
+MERGED = "merged"
+COMPLETING = "completing"
+COMPLETED = "completed"
+
+# How long a job's summary email may take to be delivered before another
+# caller may claim the job again
+COMPLETION_LEASE = timedelta(minutes=5)
+
+CHUNK_BYTES = 16 * 1024 * 1024
+
+_READ_BYTES = 1024 * 1024
+
+
+class ChunkedIngestError(Exception):
+    ...
+
+
+def _first_lines(path: str, ranges) -> List[int]:
+    """Returns the line number of the first line of each byte range."""
+    first_lines = []
+    line = 2
+    with open(path, "rb") as file:
+        for start, end in ranges:
+            first_lines.append(line)
+            file.seek(start)
+            remaining = end - start
+            while remaining:
+                block = file.read(min(remaining, _READ_BYTES))
+                if not block:
+                    break
+                line += block.count(b"\n")
+                remaining -= len(block)
+    return first_lines
+
+
+def _last_rows(job_id: int) -> Subquery:
+    """The last staged row of each id of the job, with its year and month."""
+    ranked = (
+        select(
+            StagedTransaction.id,
+            StagedTransaction.date,
+            StagedTransaction.value,
+            StagedTransaction.account_id,
+            func.row_number()
+            .over(
+                partition_by=StagedTransaction.id,
+                order_by=(StagedTransaction.chunk.desc(), StagedTransaction.seq.desc()),
+            )
+            .label("recency"),
+        )
+        .where(StagedTransaction.job_id == job_id)
+        .subquery()
+    )
+    return (
+        select(
+            ranked.c.id,
+            ranked.c.date,
+            ranked.c.value,
+            ranked.c.account_id,
+            cast(extract("year", ranked.c.date), Integer).label("year"),
+            cast(extract("month", ranked.c.date), Integer).label("month"),
+        )
+        .where(ranked.c.recency == 1)
+        .subquery()
+    )
+
+
+def _process_chunk(job_id: int, number: int) -> bool:
+    """Worker side: processes a chunk with a DbAPI of its own."""
+    return ChunkedIngest().process_chunk(job_id, number)
+
+
+class ChunkedIngest:
+    """Class for ingesting files in chunks, tracked in the ingest_chunks table.
+
+    Staged rows are not visible to summaries until their job is merged, so
+    a job is applied as a whole, or not at all, as with TransactionSeeder.
+    The file must stay readable at the job's path until every chunk is
+    committed, by every worker processing them.
+    """
+
+    def __init__(
+        self,
+        dbapi: Optional[DbAPI] = None,
+        logger: Optional[Logger] = None,
+        chunk_bytes: Optional[int] = None,
+    ):
+        self.log = logger or logging.getLogger(__name__)
+        self.db = dbapi or DbAPI()
+        self.aggregator = MonthlyAggregator(dbapi=self.db, logger=self.log)
+        self.chunk_bytes = chunk_bytes or settings.get(
+            "ingest_chunk_bytes", CHUNK_BYTES
+        )
+
+    def plan(self, path: str, file_hash: str) -> IngestJob:
+        """Returns the unfinished job of a file with the hash, or plans a new one.
+
+        :raises MalformedInputFileError: if the file's header is invalid
+
+        """
+        with self.db.session_local() as session:
+            session.expire_on_commit = False
+            job = session.scalars(
+                select(IngestJob)
+                .where(IngestJob.content_hash == file_hash)
+                .where(IngestJob.status != COMPLETED)
+                .order_by(IngestJob.id.desc())
+                .limit(1)
+            ).first()
+            if job is not None:
+                # The same content may have been uploaded again elsewhere
+                job.path = path
+                self.log.info(f"Resuming ingest job {job.id}")
+                return job
+
+        chunks = max(1, ceil(os.path.getsize(path) / self.chunk_bytes))
+        header, ranges = split_file(path, chunks)
+        if header:
+            try:
+                header_columns(header)
+            except ColumnarParseError as e:
+                raise MalformedInputFileError(str(e)) from e
+        job = IngestJob(
+            path=path,
+            content_hash=file_hash,
+            header=header,
+            status=RUNNING,
+            created_at=utcnow(),
+        )
+        with self.db.session_local() as session:
+            session.expire_on_commit = False
+            session.add(job)
+            session.flush()
+            session.add_all(
+                IngestChunk(
+                    job_id=job.id,
+                    number=number,
+                    start_offset=start,
+                    end_offset=end,
+                    first_line=first_line,
+                    status=PENDING,
+                )
+                for number, ((start, end), first_line) in enumerate(
+                    zip(ranges, _first_lines(path, ranges))
+                )
+            )
+        self.log.info(f"Planned ingest job {job.id} in {len(ranges)} chunks")
+        return job
+
+    def pending_chunks(self, job_id: int) -> List[int]:
+        """Returns the numbers of the job's chunks that are not committed yet."""
+        with self.db.session_local() as session:
+            return list(
+                session.scalars(
+                    select(IngestChunk.number)
+                    .where(IngestChunk.job_id == job_id)
+                    .where(IngestChunk.status != COMMITTED)
+                    .order_by(IngestChunk.number)
+                )
+            )
+
+    def process_chunk(self, job_id: int, number: int) -> bool:
+        """Parses the chunk and stages its rows, unless it is already committed.
+
+        :returns: whether the chunk was committed by this call
+        :raises MalformedInputFileError: if any row of the chunk is malformed,
+                                         in which case the chunk is marked as
+                                         failed
+
+        """
+        with self.db.session_local() as session:
+            session.expire_on_commit = False
+            chunk = session.get(IngestChunk, (job_id, number))
+            job = session.get(IngestJob, job_id)
+        if chunk is None or job is None:
+            raise ChunkedIngestError(f"Ingest job {job_id} has no chunk {number}")
+        if chunk.status == COMMITTED:
+            return False
+
+        with instrumentation.span("chunked_ingest.parse"):
+            _, parsed, malformed = parse_range(
+                job.path,
+                (chunk.start_offset, chunk.end_offset),
+                header_columns(job.header),
+            )
+        if malformed:
+            error = str(ColumnarParseError([chunk.first_line + n for n in malformed]))
+            with self.db.session_local() as session:
+                session.execute(
+                    update(IngestChunk)
+                    .where(IngestChunk.job_id == job_id)
+                    .where(IngestChunk.number == number)
+                    .values(status=FAILED, error=error)
+                )
+            raise MalformedInputFileError(error)
+
+        rows = [
+            {
+                "job_id": job_id,
+                "chunk": number,
+                "seq": seq,
+                "id": id,
+                "date": transaction_date,
+                "value": value,
+                "account_id": account_id,
+            }
+            for seq, (id, transaction_date, value, account_id) in enumerate(
+                parsed.rows()
+            )
+        ]
+        with instrumentation.span("chunked_ingest.stage"):
+            with self.db.session_local() as session:
+                chunk = session.get(IngestChunk, (job_id, number), with_for_update=True)
+                # Another worker may have committed it in the meantime
+                if chunk.status == COMMITTED:
+                    return False
+                if rows:
+                    session.execute(StagedTransaction.__table__.insert(), rows)
+                chunk.status = COMMITTED
+                chunk.rows = len(rows)
+                chunk.committed_at = utcnow()
+                chunk.error = None
+        instrumentation.count("chunked_ingest.chunks")
+        self.log.info(f"Chunk {number} of ingest job {job_id} committed")
+        return True
+
+    def run(
+        self, job_id: int, workers: int = 1, deadline: Optional[float] = None
+    ) -> int:
+        """Processes the job's pending chunks, with a pool of ``workers`` processes.
+
+        No chunk is started after the deadline, a time.monotonic() value,
+        so that a Lambda invocation can leave the rest to the next one.
+
+        :returns: the number of chunks left pending
+
+        """
+        numbers = iter(self.pending_chunks(job_id))
+
+        def next_chunk() -> Optional[int]:
+            if deadline is not None and monotonic() >= deadline:
+                return None
+            return next(numbers, None)
+
+        if workers <= 1:
+            for number in iter(next_chunk, None):
+                self.process_chunk(job_id, number)
+            return len(self.pending_chunks(job_id))
+
+        # Workers write to the DB, so they are spawned rather than forked, in
+        # order not to share the connections of this process' engine
+        with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as executor:
+            in_flight = set()
+            while True:
+                while len(in_flight) < workers:
+                    number = next_chunk()
+                    if number is None:
+                        break
+                    in_flight.add(executor.submit(_process_chunk, job_id, number))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        return len(self.pending_chunks(job_id))
+
+    def merge(self, job_id: int) -> IngestResult:
+        """Merges the staged rows of the job, once every chunk is committed.
+
+        The last staged row of each id is upserted and the staged rows are
+        deleted, within a single DB transaction. Merging a merged job does
+        nothing.
+
+        :returns: an IngestResult with the number of inserted and updated rows
+        :raises ChunkedIngestError: if any chunk of the job is not committed
+
+        """
+        with instrumentation.span("chunked_ingest.merge"):
+            with self.db.session_local() as session:
+                job = session.get(IngestJob, job_id, with_for_update=True)
+                if job is None:
+                    raise ChunkedIngestError(f"There is no ingest job {job_id}")
+                if job.status != RUNNING:
+                    return IngestResult(inserted=job.inserted, updated=job.updated)
+                pending = session.scalar(
+                    select(func.count())
+                    .where(IngestChunk.job_id == job_id)
+                    .where(IngestChunk.status != COMMITTED)
+                )
+                if pending:
+                    raise ChunkedIngestError(
+                        f"Ingest job {job_id} has {pending} chunks pending"
+                    )
+
+                inserted, updated = merge_last_rows(
+                    session, self.aggregator, _last_rows(job_id)
+                )
+                session.execute(
+                    delete(StagedTransaction).where(StagedTransaction.job_id == job_id)
+                )
+                if inserted or updated:
+                    bump_data_version(self.db, session)
+                job.status = MERGED
+                job.inserted = inserted
+                job.updated = updated
+        instrumentation.count("seeder.rows_inserted", inserted)
+        instrumentation.count("seeder.rows_updated", updated)
+        self.log.info(
+            f"Ingest job {job_id} merged: {inserted} transactions inserted, "
+            f"{updated} updated"
+        )
+        return IngestResult(inserted=inserted, updated=updated)
+
+    def complete(self, job_id: int, deliver: Callable[[], None]) -> bool:
+        """Completes the merged job, delivering its summary email.
+
+        The job is claimed within a DB transaction of its own, so that
+        concurrent callers deliver the email only once, and the email is
+        delivered outside of any DB transaction, e.g. so that the outbox
+        can record it. A failed delivery gives the claim back, leaving the
+        job merged to be completed again, and so does a claim older than
+        COMPLETION_LEASE, e.g. that of a worker that crashed meanwhile.
+
+        The ingest is only recorded in the ingest log once the email is
+        delivered, so that uploading the file again resumes the job rather
+        than skipping it as a duplicate.
+
+        :returns: whether this call completed the job
+
+        """
+        claimed_at = utcnow()
+        with self.db.session_local() as session:
+            claimed = session.execute(
+                update(IngestJob)
+                .where(IngestJob.id == job_id)
+                .where(
+                    or_(
+                        IngestJob.status == MERGED,
+                        and_(
+                            IngestJob.status == COMPLETING,
+                            IngestJob.finished_at < claimed_at - COMPLETION_LEASE,
+                        ),
+                    )
+                )
+                .values(status=COMPLETING, finished_at=claimed_at)
+            ).rowcount
+        if not claimed:
+            return False
+
+        claim = (
+            update(IngestJob)
+            .where(IngestJob.id == job_id)
+            .where(IngestJob.status == COMPLETING)
+            .where(IngestJob.finished_at == claimed_at)
+        )
+        try:
+            deliver()
+        except Exception:
+            with self.db.session_local() as session:
+                session.execute(claim.values(status=MERGED, finished_at=None))
+            raise
+        finished_at = utcnow()
+        with self.db.session_local() as session:
+            completed = session.execute(
+                claim.values(status=COMPLETED, finished_at=finished_at)
+            ).rowcount
+            if completed:
+                job = session.get(IngestJob, job_id)
+                session.add(
+                    IngestRecord(
+                        content_hash=job.content_hash,
+                        status=INGEST_COMPLETED,
+                        inserted=job.inserted,
+                        updated=job.updated,
+                        duration=(finished_at - job.created_at).total_seconds(),
+                        started_at=job.created_at,
+                        finished_at=finished_at,
+                    )
+                )
+        return bool(completed)
+
+
+def ingest_file(
+    path: str,
+    logger: Logger,
+    workers: int = 1,
+    deadline: Optional[float] = None,
+    force: bool = False,
+) -> int:
+    """Plans or resumes the ingest of the file, completing it if possible.
+
+    :returns: the number of chunks left pending, to be resumed later
+
+    """
+    # Imported here since the app module imports this one's dependencies lazily
+    from src.app import deliver_summary, skip_if_ingested
+
+    with open(path, "rb") as file:
+        file_hash = content_hash(iter(partial(file.read, _READ_BYTES), b""))
+    if not force and settings.get("ingest_idempotency", True):
+        if skip_if_ingested(file_hash, logger):
+            return 0
+
+    ingest = ChunkedIngest(logger=logger)
+    job = ingest.plan(path, file_hash)
+    pending = ingest.run(job.id, workers=workers, deadline=deadline)
+    if pending:
+        logger.info(f"Ingest job {job.id} has {pending} chunks pending")
+        return pending
+    ingest.merge(job.id)
+    ingest.complete(job.id, partial(deliver_summary, logger))
+    return 0
+
+
+def handle(event, context):
+    """Lambda handler ingesting the file at event["path"] in chunks.
+
+    The file must be readable by every invocation, e.g. from an EFS mount.
+    Chunks are processed while more than ``ingest_chunk_seconds`` remain
+    before the invocation times out. The handler answers 202 while chunks
+    are pending, and is to be invoked again with the same event until it
+    answers 200.
+    """
+    with instrumentation.invocation("chunked_ingest"):
+        return _handle(event, context)
+
+
+def _handle(event, context):
+    from src.email_gateway import EmailGatewayError
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    deadline = (
+        monotonic()
+        + context.get_remaining_time_in_millis() / 1000
+        - settings.get("ingest_chunk_seconds", 60)
+    )
+    try:
+        path = event.get("path")
+        if not path:
+            return {"statusCode": 400, "body": "A path to a csv file is required"}
+        pending = ingest_file(path, logger, deadline=deadline)
+    except (MalformedInputFileError, FileNotFoundError) as e:
+        logger.error(str(e))
+        return {"statusCode": 400, "body": str(e)}
+    except (DBClientError, EmailGatewayError) as e:
+        logger.error(str(e))
+        return {"statusCode": 502, "body": str(e)}
+    except Exception as e:
+        logger.error(str(e))
+        return {"statusCode": 500, "body": str(e)}
+    if pending:
+        return {"statusCode": 202, "body": f"{pending} chunks pending"}
+    return {"statusCode": 200, "body": "Input processed successfully"}
+
+
+def cli():
+    parser = ArgumentParser(description="Ingest a large csv file in chunks")
+    parser.add_argument("path")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="process the chunks in parallel with this many processes",
+    )
+    parser.add_argument(
+        "--chunk-bytes",
+        type=int,
+        help="approximate size of the chunks of new jobs, in bytes",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="ingest the file even if it was already ingested",
+    )
+    args = parser.parse_args()
+    if args.chunk_bytes:
+        settings.set("ingest_chunk_bytes", args.chunk_bytes)
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    with instrumentation.invocation("cli"):
+        ingest_file(args.path, logger, workers=args.workers, force=args.force)
+
+
+if __name__ == "__main__":
+    cli()
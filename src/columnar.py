@@ -0,0 +1,302 @@
+#! /usr/bin/python3
+"""Columnar parsing of transaction files into NumPy arrays.
+
+Rows are read in chunks straight into typed arrays (int64 ids,
+datetime64[D] dates, float64 values and, if the file has an account
+column, fixed-width unicode account ids) and validated with vectorized
+operations, so no Python object is created per row until the arrays are
+handed to the DB driver.
+"""
+from dataclasses import dataclass
+from datetime import date
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.models import DEFAULT_ACCOUNT, MAX_ACCOUNT_LENGTH
+
+# Wide enough to tell apart dates that are too long from well-formed ones
+_DATE_WIDTH = 16
+# One more than the longest account id, to tell apart ids that are too long
+_ACCOUNT_WIDTH = MAX_ACCOUNT_LENGTH + 1
+_MAX_REPORTED_LINES = 10
+
+
+class ColumnarParseError(ValueError):
+    """Raised when rows of the file are malformed.
+
+    :param line_numbers: the (1-based) line numbers of the offending rows
+
+    """
+
+    def __init__(self, line_numbers: Sequence[int]) -> None:
+        self.line_numbers = list(line_numbers)
+        reported = ", ".join(str(n) for n in self.line_numbers[:_MAX_REPORTED_LINES])
+        if len(self.line_numbers) > _MAX_REPORTED_LINES:
+            reported += ", ..."
+        super().__init__(f"The input csv file is invalid (lines {reported})")
+
+
+@dataclass(frozen=True)
+class TransactionColumns:
+    """A batch of transactions as parallel typed arrays.
+
+    ``accounts`` is None when every transaction belongs to the default account.
+    """
+
+    ids: np.ndarray
+    dates: np.ndarray
+    values: np.ndarray
+    accounts: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index) -> "TransactionColumns":
+        return TransactionColumns(
+            self.ids[index],
+            self.dates[index],
+            self.values[index],
+            None if self.accounts is None else self.accounts[index],
+        )
+
+    def account_ids(self) -> List[str]:
+        """Returns the account id of each transaction."""
+        if self.accounts is None:
+            return [DEFAULT_ACCOUNT] * len(self.ids)
+        return self.accounts.tolist()
+
+    def rows(self) -> Iterator[Tuple[int, date, float, str]]:
+        """Yields the id, date, value and account id of each transaction."""
+        return zip(
+            self.ids.tolist(),
+            self.dates.astype(object),
+            self.values.tolist(),
+            self.account_ids(),
+        )
+
+    def deduplicated(self) -> "TransactionColumns":
+        """Returns the batch keeping only the last occurrence of each id."""
+        _, reversed_index = np.unique(self.ids[::-1], return_index=True)
+        keep = np.sort(len(self.ids) - 1 - reversed_index)
+        if len(keep) == len(self.ids):
+            return self
+        return self[keep]
+
+    def month_totals(self) -> Iterator[Tuple[str, int, int, List[float]]]:
+        """Yields the account, year, month and aggregate totals of each
+        account month in the batch.
+
+        The totals follow the order of monthly_aggregates.AGGREGATE_COLUMNS.
+        """
+        months = self.dates.astype("datetime64[M]").astype(np.int64)
+        if self.accounts is None:
+            unique_accounts = np.array([DEFAULT_ACCOUNT])
+            account_index = np.zeros(len(months), dtype=np.int64)
+        else:
+            unique_accounts, account_index = np.unique(
+                self.accounts, return_inverse=True
+            )
+        keys = np.stack([account_index.reshape(-1), months], axis=1)
+        unique_keys, month_index = np.unique(keys, axis=0, return_inverse=True)
+        month_index = month_index.reshape(-1)
+        unique_months = unique_keys[:, 1]
+        credit = self.values > 0
+        debit = self.values < 0
+        columns = [
+            np.bincount(month_index, minlength=len(unique_months)),
+            np.bincount(month_index, self.values * credit, len(unique_months)),
+            np.bincount(month_index, credit, len(unique_months)),
+            np.bincount(month_index, self.values * debit, len(unique_months)),
+            np.bincount(month_index, debit, len(unique_months)),
+            np.bincount(month_index, self.values, len(unique_months)),
+        ]
+        accounts = unique_accounts[unique_keys[:, 0]].tolist()
+        for i, month in enumerate(unique_months.tolist()):
+            year, month = divmod(month, 12)
+            totals = [column[i].item() for column in columns]
+            yield accounts[i], 1970 + year, month + 1, totals
+
+
+def parse_columns(
+    lines: Iterable[str], chunk_rows: int, first_line: int = 1
+) -> Iterator[TransactionColumns]:
+    """Parses a transactions csv file into batches of typed arrays.
+
+    :param lines: the lines of the file, starting with its header
+    :param chunk_rows: the number of lines parsed into each batch
+    :param first_line: the line number of the header, used in error reports
+    :raises ColumnarParseError: with the line numbers of the malformed rows
+
+    """
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        return
+    usecols = header_columns(header, first_line)
+
+    line_number = first_line + 1
+    while True:
+        chunk = list(islice(lines, chunk_rows))
+        if not chunk:
+            return
+        batch = parse_chunk(chunk, usecols, line_number)
+        if len(batch):
+            yield batch
+        line_number += len(chunk)
+
+
+def header_columns(header: str, line_number: int = 1) -> Tuple[int, ...]:
+    """Returns the positions of the id, date and transaction columns,
+    followed by that of the account column if the file has one.
+
+    :raises ColumnarParseError: if any of the required columns is missing
+
+    """
+    columns = [c.strip() for c in header.split(",")]
+    try:
+        usecols = tuple(columns.index(c) for c in ("id", "date", "transaction"))
+    except ValueError as e:
+        raise ColumnarParseError([line_number]) from e
+    if "account" in columns:
+        usecols += (columns.index("account"),)
+    return usecols
+
+
+def parse_chunk(
+    chunk: List[str], usecols: Tuple[int, ...], first_line: int
+) -> TransactionColumns:
+    """Parses and validates a chunk of csv rows (without header) into arrays."""
+    try:
+        data = _load(chunk, usecols)
+    except ValueError:
+        # loadtxt skips empty lines but not whitespace-only ones
+        rows = [line for line in chunk if line.strip()]
+        try:
+            data = _load(rows, usecols)
+        except ValueError:
+            raise ColumnarParseError(
+                _find_unparseable_lines(chunk, usecols, first_line)
+            ) from None
+    if not len(data):
+        return _empty_columns(len(usecols) > 3)
+
+    ids = data["id"]
+    values = data["value"]
+    dates = np.ascontiguousarray(np.char.strip(data["date"]), dtype=f"U{_DATE_WIDTH}")
+    year, month, day, well_formed = _split_dates(dates)
+    month_start = (year - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+    month_start = month_start + np.where(well_formed, month - 1, 0)
+    days_in_month = (month_start + 1).astype("datetime64[D]") - month_start.astype(
+        "datetime64[D]"
+    )
+    valid = (
+        well_formed
+        & (day >= 1)
+        & (day <= days_in_month.astype(np.int64))
+        & (ids > 0)
+        & np.isfinite(values)
+    )
+    accounts = None
+    if len(usecols) > 3:
+        accounts = np.char.strip(data["account"])
+        account_lengths = np.char.str_len(accounts)
+        valid &= (account_lengths > 0) & (account_lengths <= MAX_ACCOUNT_LENGTH)
+    if not valid.all():
+        raise ColumnarParseError(
+            _line_numbers(chunk, np.flatnonzero(~valid), first_line)
+        )
+
+    parsed_dates = month_start.astype("datetime64[D]") + (day - 1)
+    return TransactionColumns(ids, parsed_dates, values, accounts)
+
+
+def _split_dates(
+    dates: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Splits Y/M/D dates into their year, month and day, as the row parser does.
+
+    Each part is one or more digits, so months and days need not be
+    zero-padded. Years are checked to be within 1 and 9999, and months
+    within 1 and 12; days are left to the caller.
+
+    :returns: the years, months and days, and which dates are well formed
+
+    """
+    # Each character as its code point, so dates are decoded arithmetically
+    codes = dates.view(np.uint32).reshape(len(dates), _DATE_WIDTH)
+    lengths = np.char.str_len(dates)
+    within = np.arange(_DATE_WIDTH) < lengths[:, None]
+    separators = within & (codes == ord("/"))
+    digits = codes.astype(np.int64) - ord("0")
+    is_digit = within & (digits >= 0) & (digits <= 9)
+    # The part, 0 to 2 for the year, month and day, of each character
+    parts = np.cumsum(separators, axis=1)
+
+    numbers = []
+    # Shorter than the width, so that no digit was cut off, and of at most
+    # 15 digits, whose numbers fit in 64 bits
+    well_formed = (
+        (lengths < _DATE_WIDTH)
+        & (separators.sum(axis=1) == 2)
+        & np.all(is_digit | separators | ~within, axis=1)
+    )
+    for part in range(3):
+        in_part = is_digit & (parts == part)
+        # The number of digits of the part after each one, as its power of ten
+        powers = np.cumsum(in_part[:, ::-1], axis=1)[:, ::-1] - in_part
+        numbers.append(np.where(in_part, digits * 10**powers, 0).sum(axis=1))
+        well_formed &= in_part.any(axis=1)
+    year, month, day = numbers
+    well_formed &= (year >= 1) & (year <= 9999) & (month >= 1) & (month <= 12)
+    return np.where(well_formed, year, 1970), month, day, well_formed
+
+
+def _load(rows: List[str], usecols: Tuple[int, ...]) -> np.ndarray:
+    dtype = [("id", "i8"), ("date", f"U{_DATE_WIDTH}"), ("value", "f8")]
+    if len(usecols) > 3:
+        dtype.append(("account", f"U{_ACCOUNT_WIDTH}"))
+    return np.loadtxt(
+        rows,
+        delimiter=",",
+        dtype=dtype,
+        usecols=usecols,
+        comments=None,
+        ndmin=1,
+    )
+
+
+def _empty_columns(with_accounts: bool = False) -> TransactionColumns:
+    return TransactionColumns(
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype="datetime64[D]"),
+        np.empty(0, dtype=np.float64),
+        np.empty(0, dtype=f"U{_ACCOUNT_WIDTH}") if with_accounts else None,
+    )
+
+
+def _line_numbers(chunk: List[str], row_indexes: Iterable[int], first_line: int):
+    """Maps indexes of non-blank rows within the chunk to file line numbers."""
+    positions = [i for i, line in enumerate(chunk) if line.strip()]
+    return [first_line + positions[i] for i in row_indexes]
+
+
+def _find_unparseable_lines(
+    chunk: List[str], usecols: Tuple[int, ...], first_line: int
+) -> List[int]:
+    # Only reached when loadtxt fails, which does not say which row it was
+    id_column, _, value_column = usecols[:3]
+    line_numbers = []
+    for i, line in enumerate(chunk):
+        if not line.strip():
+            continue
+        fields = line.split(",")
+        try:
+            int(fields[id_column])
+            float(fields[value_column])
+            fields[max(usecols)]
+        except (ValueError, IndexError):
+            line_numbers.append(first_line + i)
+    # loadtxt may still reject a row Python accepts; the chunk is reported then
+    return line_numbers or list(range(first_line, first_line + len(chunk)))
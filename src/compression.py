@@ -0,0 +1,111 @@
+#! /usr/bin/python3
+import zlib
+from itertools import chain
+from typing import Iterable, Iterator, Optional, Union
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Upper bound of the data decompressed out of each input chunk, so that a
+# highly compressed upload is never inflated in memory all at once
+OUTPUT_CHUNK_SIZE = 256 * 1024
+
+Chunk = Union[bytes, bytearray, memoryview]
+
+
+class DecompressionError(Exception):
+    ...
+
+
+def detect_encoding(head: bytes) -> Optional[str]:
+    """Returns the compression format given the first bytes of a file, if any."""
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def decompress_stream(
+    chunks: Iterable[Chunk], content_encoding: Optional[str] = None
+) -> Iterator[Chunk]:
+    """Decompresses a stream of byte chunks, if it is compressed.
+
+    The compression format is taken from the Content-Encoding, when given,
+    or otherwise detected from the magic bytes at the start of the stream.
+    Uncompressed streams are passed through untouched.
+
+    :raises DecompressionError: if the encoding is not supported or the
+                                stream is not valid for it
+
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            # Text lines, which can't be compressed
+            return chain([chunk], chunks)
+        head += chunk
+        if len(head) >= len(ZSTD_MAGIC):
+            break
+    stream = chain([head], chunks)
+
+    encoding = (content_encoding or "").strip().lower()
+    if encoding in ("", "identity"):
+        encoding = detect_encoding(head)
+    if encoding in ("gzip", "x-gzip"):
+        return _gunzip(stream)
+    if encoding == "zstd":
+        return _unzstd(stream)
+    if encoding is None:
+        return stream
+    raise DecompressionError(f"Unsupported content encoding: {content_encoding}")
+
+
+class _ChunkReader:
+    """Read-only file over an iterator of byte chunks, one chunk per read."""
+
+    def __init__(self, chunks: Iterator[Chunk]) -> None:
+        self._chunks = chunks
+
+    def read(self, size: int = -1) -> bytes:
+        for chunk in self._chunks:
+            if chunk:
+                return bytes(chunk)
+        return b""
+
+
+def _gunzip(stream: Iterator[Chunk]) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    try:
+        for chunk in stream:
+            data = chunk
+            while data:
+                yield decompressor.decompress(data, OUTPUT_CHUNK_SIZE)
+                data = decompressor.unconsumed_tail
+                # Concatenated gzip members, as produced by e.g. `cat a.gz b.gz`
+                if decompressor.eof and decompressor.unused_data:
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        yield decompressor.flush()
+    except zlib.error as e:
+        raise DecompressionError("The file is not a valid gzip file") from e
+    if not decompressor.eof:
+        raise DecompressionError("The gzip file is truncated")
+
+
+def _unzstd(stream: Iterator[Chunk]) -> Iterator[bytes]:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise DecompressionError(
+            "zstd compressed files require the zstandard package"
+        ) from e
+
+    decompressor = zstandard.ZstdDecompressor()
+    try:
+        yield from decompressor.read_to_iter(
+            _ChunkReader(stream), write_size=OUTPUT_CHUNK_SIZE
+        )
+    except zstandard.ZstdError as e:
+        raise DecompressionError("The file is not a valid zstd file") from e
@@ -1,9 +1,14 @@
 #! /usr/bin/python3
 from contextlib import contextmanager
-from typing import Iterator
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, Table, create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 from src.config import settings
 
 
@@ -11,20 +16,114 @@ class DBClientError(Exception):
     ...
 
 
+@dataclass
+class PoolStats:
+    """Counters of the connections opened and checked out from an engine's pool."""
+
+    connects: int = 0
+    checkouts: int = 0
+
+
+# Engines are shared by every DbAPI within the process, keyed by DB url, so
+# that a warm Lambda reuses its pooled connections across invocations
+_engines: Dict[str, Engine] = {}
+_pool_stats: Dict[str, PoolStats] = {}
+_engines_lock = Lock()
+# Pool events fire on whichever thread connects or checks out
+_pool_stats_lock = Lock()
+
+
+def _db_url() -> str:
+    if settings.db_dialect == "sqlite":
+        db_url_suffix = f"/{settings.DB_FILE}"
+    else:
+        db_url_suffix = (
+            f"{settings.DB_USER}:{settings.DB_PASSWORD}"
+            f"@{settings.DB_HOST}:{settings.DB_PORT}"
+            f"/{settings.DB_NAME}"
+        )
+    return f"{settings.db_dialect}://{db_url_suffix}"
+
+
+def _engine_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "pool_pre_ping": settings.get("db_pool_pre_ping", True),
+    }
+    if settings.get("db_pool_mode", "queue") == "null":
+        # No connection is kept open between sessions. Meant for Lambdas
+        # behind RDS Proxy, where the proxy does the pooling instead
+        options["poolclass"] = NullPool
+    elif settings.db_dialect != "sqlite":
+        options["pool_size"] = settings.get("db_pool_size", 5)
+        options["max_overflow"] = settings.get("db_max_overflow", 10)
+        options["pool_recycle"] = settings.get("db_pool_recycle", 300)
+    return options
+
+
+def get_engine(db_url: Optional[str] = None) -> Engine:
+    """Returns the process-wide engine for the DB url, creating it if needed.
+
+    :returns: the shared Engine for the DB url from the settings, or the given one
+
+    """
+    db_url = db_url or _db_url()
+    with _engines_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = create_engine(db_url, **_engine_options())
+            stats = PoolStats()
+
+            @event.listens_for(engine, "connect")
+            def _count_connect(*_):
+                with _pool_stats_lock:
+                    stats.connects += 1
+
+            @event.listens_for(engine, "checkout")
+            def _count_checkout(*_):
+                with _pool_stats_lock:
+                    stats.checkouts += 1
+
+            _engines[db_url] = engine
+            _pool_stats[db_url] = stats
+        return engine
+
+
+def dispose_engines() -> None:
+    """Closes every shared engine's pooled connections and forgets the engines."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _pool_stats.clear()
+
+
 class DbAPI:
-    def __init__(self) -> None:
-        if settings.db_dialect == "sqlite":
-            db_url_suffix = f"/{settings.DB_FILE}"
-        else:
-            db_url_suffix = (
-                f"{settings.DB_USER}:{settings.DB_PASSWORD}"
-                f"@{settings.DB_HOST}:{settings.DB_PORT}"
-                f"/{settings.DB_NAME}"
-            )
-        db_url = f"{settings.db_dialect}://{db_url_suffix}"
-        self.engine = create_engine(db_url)
+    def __init__(self, db_url: Optional[str] = None) -> None:
+        self.db_url = db_url or _db_url()
+        self.engine = get_engine(self.db_url)
         self.session_factory = sessionmaker(bind=self.engine)
 
+    @property
+    def pool_stats(self) -> PoolStats:
+        """Connection and checkout counters of the shared engine's pool."""
+        return _pool_stats.get(self.db_url, PoolStats())
+
+    def insert(self, table: Table):
+        """Returns an INSERT construct supporting ON CONFLICT for the engine's dialect.
+
+        Both PostgreSQL and SQLite implement ``INSERT ... ON CONFLICT``, but
+        SQLAlchemy only exposes it through each dialect's own ``insert``.
+
+        :returns: a dialect-specific Insert for the given table
+
+        """
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            return postgresql.insert(table)
+        if dialect == "sqlite":
+            return sqlite.insert(table)
+        raise DBClientError(f"Upserts are not supported for the {dialect} dialect")
+
     @contextmanager
     def session_local(self) -> Iterator[Session]:
         session = self.session_factory()
@@ -32,8 +131,11 @@ class DbAPI:
         try:
             yield session
             session.commit()
-        except Exception as e:
+        except SQLAlchemyError as e:
             session.rollback()
             raise DBClientError("There was a problem connecting to the DB") from e
+        except Exception:
+            session.rollback()
+            raise
         finally:
             session.close()
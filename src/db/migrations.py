@@ -0,0 +1,227 @@
+#! /usr/bin/python3
+"""Versioned migrations of the DB schema.
+
+The schema is not created when the models are imported, so that cold
+starts do not open a DB connection nor issue DDL checks. Instead, the
+migrations are applied by running this module once per deployment, e.g.
+through its Lambda handler:
+
+    python -m src.db.migrations
+
+Every applied migration is recorded in the schema_version table, and
+each one is applied within its own DB transaction. On a new DB the first
+migration already creates the tables as the models define them, so every
+later migration checks what is missing before changing anything: they
+bring the DBs of existing deployments up to date and leave new ones as
+they are.
+"""
+import logging
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from logging import Logger
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import Connection, String, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.db.db import DBClientError, DbAPI
+from src.models import (
+    DEFAULT_ACCOUNT,
+    MAX_ACCOUNT_LENGTH,
+    Base,
+    IngestChunk,
+    IngestJob,
+    IngestRecord,
+    MonthlyAggregate,
+    SchemaVersion,
+    StagedTransaction,
+    Transaction,
+    utcnow,
+)
+
+# Serializes concurrent migrators on PostgreSQL, e.g. overlapping deployments
+_ADVISORY_LOCK_KEY = 7_302_118
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _columns(connection: Connection, table: str) -> Tuple[str, ...]:
+    return tuple(column["name"] for column in inspect(connection).get_columns(table))
+
+
+def _create_tables(connection: Connection) -> None:
+    Base.metadata.create_all(bind=connection)
+
+
+def _add_account_id(connection: Connection) -> None:
+    if "account_id" in _columns(connection, "transactions"):
+        return
+    account_type = String(MAX_ACCOUNT_LENGTH).compile(dialect=connection.dialect)
+    connection.execute(
+        text(
+            f"ALTER TABLE transactions ADD COLUMN account_id {account_type}"
+            f" NOT NULL DEFAULT '{DEFAULT_ACCOUNT}'"
+        )
+    )
+
+
+def _add_year_month(connection: Connection) -> None:
+    # SQLite can only add virtual generated columns, which can be indexed
+    # too; PostgreSQL only has stored ones, and rewrites the table to add them
+    kind = "VIRTUAL" if connection.dialect.name == "sqlite" else "STORED"
+    existing = _columns(connection, "transactions")
+    for name in ("year", "month"):
+        if name in existing:
+            continue
+        expression = Transaction.__table__.c[name].computed.sqltext.compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+        connection.execute(
+            text(
+                f"ALTER TABLE transactions ADD COLUMN {name} INTEGER"
+                f" GENERATED ALWAYS AS ({expression}) {kind}"
+            )
+        )
+
+
+def _key_aggregates_by_account(connection: Connection) -> None:
+    if "account_id" in _columns(connection, "monthly_aggregates"):
+        return
+    # Imported here to avoid circular imports
+    from src.monthly_aggregates import (
+        AGGREGATE_COLUMNS,
+        aggregate_transactions_statement,
+    )
+
+    # The aggregates are derived data, so the table is rebuilt with its new
+    # key rather than converted
+    table = MonthlyAggregate.__table__
+    table.drop(bind=connection)
+    table.create(bind=connection)
+    connection.execute(
+        table.insert().from_select(
+            ["account_id", "year", "month", *AGGREGATE_COLUMNS],
+            aggregate_transactions_statement(by_account=True),
+        )
+    )
+
+
+def _index_transactions(connection: Connection) -> None:
+    # Superseded by the index on (account_id, year, month, value)
+    connection.execute(text("DROP INDEX IF EXISTS ix_transactions_account_id"))
+    for index in Transaction.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+def _create_ingest_log(connection: Connection) -> None:
+    IngestRecord.__table__.create(bind=connection, checkfirst=True)
+
+
+def _create_chunked_ingest_tables(connection: Connection) -> None:
+    for model in (IngestJob, IngestChunk, StagedTransaction):
+        model.__table__.create(bind=connection, checkfirst=True)
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "Create the tables", _create_tables),
+    Migration(2, "Add the account_id column to transactions", _add_account_id),
+    Migration(3, "Store the year and month of transactions", _add_year_month),
+    Migration(4, "Key monthly_aggregates by account", _key_aggregates_by_account),
+    Migration(5, "Index transactions for the summary queries", _index_transactions),
+    Migration(6, "Create the ingest_log table", _create_ingest_log),
+    Migration(7, "Create the chunked ingest tables", _create_chunked_ingest_tables),
+)
+
+
+def applied_versions(dbapi: Optional[DbAPI] = None) -> Tuple[int, ...]:
+    """Returns the versions of the migrations applied to the DB, in order."""
+    db = dbapi or DbAPI()
+    if not inspect(db.engine).has_table(SchemaVersion.__tablename__):
+        return ()
+    with db.session_local() as session:
+        return tuple(session.scalars(select(SchemaVersion.version).order_by("version")))
+
+
+def migrate(dbapi: Optional[DbAPI] = None, logger: Optional[Logger] = None) -> int:
+    """Applies the migrations that were not applied to the DB yet, in order.
+
+    :returns: the version of the DB schema
+
+    """
+    log = logger or logging.getLogger(__name__)
+    db = dbapi or DbAPI()
+    try:
+        SchemaVersion.__table__.create(bind=db.engine, checkfirst=True)
+        for migration in MIGRATIONS:
+            with db.engine.begin() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.execute(
+                        text("SELECT pg_advisory_xact_lock(:key)"),
+                        {"key": _ADVISORY_LOCK_KEY},
+                    )
+                applied = connection.scalar(
+                    select(SchemaVersion.version).where(
+                        SchemaVersion.version == migration.version
+                    )
+                )
+                if applied is not None:
+                    continue
+                log.info(
+                    f"Applying migration {migration.version}: {migration.description}"
+                )
+                migration.upgrade(connection)
+                connection.execute(
+                    SchemaVersion.__table__.insert().values(
+                        version=migration.version,
+                        description=migration.description,
+                        applied_at=utcnow(),
+                    )
+                )
+    except SQLAlchemyError as e:
+        raise DBClientError("There was a problem migrating the DB") from e
+    version = MIGRATIONS[-1].version
+    log.info(f"DB schema is up to date, at version {version}")
+    return version
+
+
+def handle(event, context):
+    """Lambda handler for migrating the DB schema on deployment."""
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    try:
+        version = migrate(logger=logger)
+    except DBClientError as e:
+        logger.error(str(e))
+        return {"statusCode": 502, "body": str(e)}
+    return {"statusCode": 200, "body": f"DB schema is at version {version}"}
+
+
+def cli():
+    parser = ArgumentParser(description="Apply the pending DB migrations")
+    parser.add_argument(
+        "--list", action="store_true", help="list the migrations and exit"
+    )
+    args = parser.parse_args()
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    if args.list:
+        applied = applied_versions()
+        for migration in MIGRATIONS:
+            status = "applied" if migration.version in applied else "pending"
+            logger.info(f"{migration.version:>3} {status:<8} {migration.description}")
+        return
+
+    migrate(logger=logger)
+
+
+if __name__ == "__main__":
+    cli()
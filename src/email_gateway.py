@@ -1,12 +1,28 @@
 #! /usr/bin/python3
 import logging
 import ssl
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from functools import lru_cache
 from logging import Logger
-from smtplib import SMTP_SSL, SMTPException
-from typing import Optional
+from smtplib import SMTP, SMTP_SSL, SMTPException, SMTPServerDisconnected
+from threading import BoundedSemaphore, Lock
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
+from src import instrumentation
 from src.config import settings
 
 
@@ -14,6 +30,129 @@ class EmailGatewayError(Exception):
     ...
 
 
+class OutgoingEmail(NamedTuple):
+    target_email: str
+    subject: str
+    plaintext: str
+    html: str
+
+
+@dataclass
+class SMTPPoolStats:
+    """Counters of the connections opened and reused by an SMTP pool."""
+
+    connects: int = 0
+    reuses: int = 0
+    reconnects: int = 0
+    noops: int = 0
+    expired: int = 0
+
+
+class SMTPConnectionPool:
+    """Bounded pool of authenticated SMTP connections.
+
+    Connections are kept open between sends. A connection idle for longer
+    than ``idle_timeout`` is closed instead of reused, and one idle for
+    longer than ``noop_after`` is checked with a NOOP before being reused.
+    At most ``max_size`` connections are checked out at the same time.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], SMTP],
+        max_size: int,
+        idle_timeout: float,
+        noop_after: float,
+    ) -> None:
+        self._connect = connect
+        self._idle: List[Tuple[SMTP, float]] = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_size)
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self.stats = SMTPPoolStats()
+
+    @contextmanager
+    def connection(self) -> Iterator[SMTP]:
+        """Checks out a connection, returning it to the pool if it is still usable."""
+        with self._slots:
+            server = self._checkout()
+            try:
+                yield server
+            except Exception:
+                # The connection may be in any state after a failure
+                _close(server)
+                raise
+            else:
+                with self._lock:
+                    self._idle.append((server, time.monotonic()))
+
+    def count(self, counter: str) -> None:
+        """Increments one of the stats counters, which threads share."""
+        with self._lock:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
+
+    def close(self) -> None:
+        """Closes every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _close(server)
+
+    def _checkout(self) -> SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, idle_since = self._idle.pop()
+            idle_for = time.monotonic() - idle_since
+            if idle_for > self.idle_timeout:
+                self.count("expired")
+                _close(server)
+                continue
+            if idle_for > self.noop_after and not self._is_alive(server):
+                continue
+            self.count("reuses")
+            return server
+        return self._open()
+
+    def _open(self) -> SMTP:
+        server = self._connect()
+        self.count("connects")
+        instrumentation.count("smtp.connects")
+        return server
+
+    def _is_alive(self, server: SMTP) -> bool:
+        self.count("noops")
+        try:
+            alive = server.noop()[0] == 250
+        except (SMTPException, OSError):
+            alive = False
+        if not alive:
+            _close(server)
+        return alive
+
+
+def _close(server: SMTP) -> None:
+    try:
+        server.quit()
+    except (SMTPException, OSError):
+        server.close()
+
+
+@lru_cache(maxsize=None)
+def _ssl_context() -> ssl.SSLContext:
+    # Loading the CA certificates is slow, so it is only done once, and
+    # only when a connection is opened
+    return ssl.create_default_context()
+
+
+# Pools are shared by every EmailGateway within the process, so that a warm
+# Lambda reuses its SMTP connections across invocations
+_pools: Dict[Tuple[str, int, str], SMTPConnectionPool] = {}
+_pools_lock = Lock()
+
+
 class EmailGateway:
     def __init__(self, logger: Optional[Logger] = None) -> None:
         self.log = logger or logging.getLogger(__name__)
@@ -21,29 +160,129 @@ class EmailGateway:
         self.port = settings.smtp_port
         self.email = settings.sender_email_address
         self.password = settings.sender_email_password
-        self._context = ssl.create_default_context()
+        self.use_ssl = settings.get("smtp_ssl", True)
+        self.pool = self._get_pool()
+
+    @property
+    def pool_stats(self) -> SMTPPoolStats:
+        return self.pool.stats
 
     def send_email(self, target_email, subject, plaintext, html) -> None:
+        failures = self.send_many(
+            [OutgoingEmail(target_email, subject, plaintext, html)]
+        )
+        if failures:
+            raise failures[0][1]
+
+    def send_many(
+        self, emails: Iterable[OutgoingEmail]
+    ) -> List[Tuple[OutgoingEmail, EmailGatewayError]]:
+        """Sends every email over a single pooled connection.
+
+        If the server drops the connection, the remaining emails are sent
+        over a new one. A failure to send one email does not stop the rest
+        from being sent.
+
+        :returns: the emails that could not be sent, along with their errors
+
+        """
+        with instrumentation.span("smtp.send"):
+            failures = self._send_many(emails)
+        instrumentation.count("smtp.failures", len(failures))
+        return failures
+
+    def _send_many(
+        self, emails: Iterable[OutgoingEmail]
+    ) -> List[Tuple[OutgoingEmail, EmailGatewayError]]:
+        pending = deque(emails)
+        failures = []
+        can_reconnect = True
+        while pending:
+            try:
+                with self.pool.connection() as server:
+                    while pending:
+                        email = pending[0]
+                        try:
+                            self.log.debug("Attempting to send email")
+                            server.sendmail(
+                                self.email,
+                                email.target_email,
+                                self._build_message(email),
+                            )
+                            self.log.debug("Email succesfully sent")
+                            instrumentation.count("smtp.emails")
+                            can_reconnect = True
+                        except SMTPServerDisconnected:
+                            raise
+                        except SMTPException as e:
+                            error = EmailGatewayError(
+                                "There was a problem sending the email"
+                            )
+                            error.__cause__ = e
+                            failures.append((email, error))
+                        pending.popleft()
+            except SMTPServerDisconnected as e:
+                # The server dropped the connection since it was last used
+                if not can_reconnect:
+                    raise EmailGatewayError(
+                        "There was a problem connecting to the SMTP server"
+                    ) from e
+                self.log.debug("SMTP connection lost, reconnecting")
+                self.pool.count("reconnects")
+                can_reconnect = False
+            except (SMTPException, OSError) as e:
+                raise EmailGatewayError(
+                    "There was a problem connecting to the SMTP server"
+                ) from e
+        return failures
+
+    def _build_message(self, email: OutgoingEmail) -> str:
         # "alternative" subtype is being used to also send a plain text
         # version since not all email clients support HTML and some
         # people might choose to only receive plain-text emails
         message = MIMEMultipart("alternative")
-        message["Subject"] = subject
+        message["Subject"] = email.subject
         message["From"] = self.email
-        message["To"] = target_email
+        message["To"] = email.target_email
 
-        part1 = MIMEText(plaintext, "plain")
-        part2 = MIMEText(html, "html")
+        part1 = MIMEText(email.plaintext, "plain")
+        part2 = MIMEText(email.html, "html")
 
         message.attach(part1)
         message.attach(part2)
-        with SMTP_SSL(self.smtp_server, self.port, context=self._context) as server:
-            try:
-                self.log.debug("Attempting to connect to SMTP server")
+        return message.as_string()
+
+    def _get_pool(self) -> SMTPConnectionPool:
+        key = (self.smtp_server, self.port, self.email)
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = SMTPConnectionPool(
+                    self._connect,
+                    max_size=settings.get("smtp_pool_size", 4),
+                    idle_timeout=settings.get("smtp_idle_timeout", 60),
+                    noop_after=settings.get("smtp_noop_after", 5),
+                )
+            return _pools[key]
+
+    def _connect(self) -> SMTP:
+        self.log.debug("Attempting to connect to SMTP server")
+        if self.use_ssl:
+            server = SMTP_SSL(self.smtp_server, self.port, context=_ssl_context())
+        else:
+            server = SMTP(self.smtp_server, self.port)
+        try:
+            if self.password:
                 server.login(self.email, self.password)
-                self.log.debug("Connection to SMTP server successfull")
-                self.log.debug("Attempting to send email")
-                server.sendmail(self.email, target_email, message.as_string())
-                self.log.debug("Email succesfully sent")
-            except SMTPException as e:
-                raise EmailGatewayError("There was a problem sending the email") from e
+        except SMTPException:
+            _close(server)
+            raise
+        self.log.debug("Connection to SMTP server successfull")
+        return server
+
+
+def close_pools() -> None:
+    """Closes the idle connections of every shared SMTP pool."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,115 @@
+#! /usr/bin/python3
+"""Log of the ingested files, keyed by the hash of their content.
+
+Retried requests and repeated uploads send files that were already
+ingested; looking their hash up in the log lets them be skipped. Every
+ingest is recorded, with its row counts and duration, whether it
+completes or fails.
+"""
+import hashlib
+import logging
+from logging import Logger
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Union
+
+from sqlalchemy import select, update
+
+from src.db.db import DBClientError, DbAPI
+from src.models import IngestRecord, utcnow
+
+if TYPE_CHECKING:
+    from src.transaction_seeder import IngestResult
+
+STARTED = "started"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def content_hash(chunks: Iterable[Union[bytes, memoryview]]) -> str:
+    """Returns the SHA-256 hex digest of the content given in chunks."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestLog:
+    """Class for recording ingests in the ingest_log table.
+
+    Ingests are recorded as started before the file is parsed, and as
+    completed (with the number of inserted and updated rows) or failed
+    once it is, along with how long it took. Concurrent uploads of the
+    same file are not detected as duplicates, and are all ingested. They
+    are applied one after another, under the MonthlyAggregator's lock, so
+    the later ones only rewrite the same values; their summary emails are
+    all sent.
+    """
+
+    def __init__(self, dbapi: Optional[DbAPI] = None, logger: Optional[Logger] = None):
+        self.log = logger or logging.getLogger(__name__)
+        self.db = dbapi or DbAPI()
+
+    def find_completed(self, content_hash: str) -> Optional[IngestRecord]:
+        """Returns the latest completed ingest of a file with the hash, if any."""
+        statement = (
+            select(IngestRecord)
+            .where(IngestRecord.content_hash == content_hash)
+            .where(IngestRecord.status == COMPLETED)
+            .order_by(IngestRecord.id.desc())
+            .limit(1)
+        )
+        with self.db.session_local() as session:
+            session.expire_on_commit = False
+            return session.scalars(statement).first()
+
+    def run(
+        self, content_hash: str, ingest: Callable[[], "IngestResult"]
+    ) -> "IngestResult":
+        """Runs the ingest of a file with the hash, recording it in the log.
+
+        :returns: the IngestResult of the ingest, whose errors are recorded
+                  and raised again
+
+        """
+        record_id = self._start(content_hash)
+        start = perf_counter()
+        try:
+            result = ingest()
+        except Exception as e:
+            try:
+                self._finish(record_id, perf_counter() - start, FAILED, error=str(e))
+            except DBClientError as log_error:
+                # The ingest's own error is the one worth raising
+                self.log.error(f"The failed ingest could not be recorded: {log_error}")
+            raise
+        self._finish(
+            record_id,
+            perf_counter() - start,
+            COMPLETED,
+            inserted=result.inserted,
+            updated=result.updated,
+        )
+        return result
+
+    def _start(self, content_hash: str) -> int:
+        record = IngestRecord(
+            content_hash=content_hash, status=STARTED, started_at=utcnow()
+        )
+        with self.db.session_local() as session:
+            session.add(record)
+            session.flush()
+            return record.id
+
+    def _finish(self, record_id: int, duration: float, status: str, **values) -> None:
+        with self.db.session_local() as session:
+            session.execute(
+                update(IngestRecord)
+                .where(IngestRecord.id == record_id)
+                .values(
+                    status=status,
+                    duration=duration,
+                    finished_at=utcnow(),
+                    **values,
+                )
+            )
+        self.log.info(f"Ingest {record_id} {status} in {duration:.3f}s")
@@ -0,0 +1,201 @@
+#! /usr/bin/python3
+"""Timing spans, counters and SQL statistics of the pipeline's stages.
+
+Metrics recorded within an ``invocation`` (e.g. a Lambda request) are
+emitted together when it ends, as a single JSON record in CloudWatch
+Embedded Metric Format (EMF), so CloudWatch turns them into metrics when
+they are logged. Spans and counters recorded outside of an invocation are
+emitted right away, one record each; SQL statistics are only collected
+within one.
+
+Instrumentation is enabled by the ``instrumentation`` setting, or with
+``enable``. While disabled, ``span`` returns a shared no-op context
+manager, ``count`` returns immediately and no SQL hook is installed.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from src.config import settings
+
+NAMESPACE = "TransactionSummarizer"
+
+Sink = Callable[[Dict[str, Any]], None]
+
+
+def stdout_sink(record: Dict[str, Any]) -> None:
+    """Writes the record as a JSON line, which CloudWatch picks up from Lambda logs."""
+    sys.stdout.write(json.dumps(record) + "\n")
+
+
+class Metrics:
+    """Metrics of a single invocation, added up by name."""
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self.values: Dict[str, Tuple[float, str]] = {}
+        self._lock = Lock()
+
+    def add(self, name: str, value: float, unit: str) -> None:
+        with self._lock:
+            total, _ = self.values.get(name, (0, unit))
+            self.values[name] = (total + value, unit)
+
+    def emf(self) -> Dict[str, Any]:
+        """Returns the metrics as an EMF record, with the operation as dimension."""
+        with self._lock:
+            values = dict(self.values)
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [["Operation"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit}
+                            for name, (_, unit) in values.items()
+                        ],
+                    }
+                ],
+            },
+            "Operation": self.operation,
+            **{name: value for name, (value, _) in values.items()},
+        }
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = (time.perf_counter() - self.start) * 1000
+        _record(f"{self.name}.duration", elapsed, "Milliseconds")
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        ...
+
+
+_NOOP_SPAN = _NoopSpan()
+_enabled = False
+_sink: Sink = stdout_sink
+_current: ContextVar[Optional[Metrics]] = ContextVar("metrics", default=None)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(sink: Optional[Sink] = None) -> None:
+    """Turns instrumentation on, emitting records to the sink (stdout by default)."""
+    global _enabled, _sink
+    _sink = sink or stdout_sink
+    if not _enabled:
+        _install_sql_hooks()
+        _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    if _enabled:
+        _remove_sql_hooks()
+        _enabled = False
+
+
+def span(name: str):
+    """Returns a context manager recording its duration as ``<name>.duration``."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def count(name: str, value: float = 1, unit: str = "Count") -> None:
+    """Adds the value to the ``name`` metric."""
+    if _enabled:
+        _record(name, value, unit)
+
+
+@contextmanager
+def invocation(operation: str) -> Iterator[Optional[Metrics]]:
+    """Collects the metrics recorded within it and emits them as one record.
+
+    The metrics of threads started within it are only collected if they
+    run in a copy of its context (see contextvars.copy_context).
+    """
+    if not _enabled:
+        yield None
+        return
+    metrics = Metrics(operation)
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add(
+            f"{operation}.duration",
+            (time.perf_counter() - start) * 1000,
+            "Milliseconds",
+        )
+        _current.reset(token)
+        _sink(metrics.emf())
+
+
+def _record(name: str, value: float, unit: str) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(name, value, unit)
+        return
+    metrics = Metrics(name.split(".", 1)[0])
+    metrics.add(name, value, unit)
+    _sink(metrics.emf())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_start", None)
+    if start is None or _current.get() is None:
+        return
+    elapsed = (time.perf_counter() - start) * 1000
+    # Grouped by statement type, so that the number of metrics stays bounded
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement else "unknown"
+    _record(f"sql.{verb}.count", 1, "Count")
+    _record(f"sql.{verb}.duration", elapsed, "Milliseconds")
+
+
+def _install_sql_hooks() -> None:
+    # Imported here so that SQLAlchemy is only loaded when it is used
+    from sqlalchemy import Engine, event
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _remove_sql_hooks() -> None:
+    from sqlalchemy import Engine, event
+
+    event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+if settings.get("instrumentation", False):
+    enable()
@@ -1,21 +1,214 @@
 #! /usr/bin/python3
-from datetime import date
+from datetime import date, datetime, timezone
+from typing import Optional
 
+from sqlalchemy import (
+    BigInteger,
+    Computed,
+    Date,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    cast,
+    column,
+    extract,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
-from src.db.db import DbAPI
+# Transactions from files without an account column belong to this account
+DEFAULT_ACCOUNT = "default"
+MAX_ACCOUNT_LENGTH = 64
+
+
+def utcnow() -> datetime:
+    """The current UTC time, naive as the DateTime columns below store it."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class Base(DeclarativeBase):
     ...
 
 
+def _date_part(field: str) -> Computed:
+    return Computed(cast(extract(field, column("date", Date)), Integer), persisted=True)
+
+
 class Transaction(Base):
+    """A transaction, with its year and month stored alongside its date.
+
+    Summaries group by the stored year and month, so that the indexes
+    below cover them: the summary of every transaction, of an account and
+    of every account are read from an index rather than the table. The
+    date index is a BRIN index on PostgreSQL, which stays small on large
+    tables as long as transactions are mostly ingested in date order.
+    """
+
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_year_month", "year", "month", "value"),
+        Index(
+            "ix_transactions_account_year_month",
+            "account_id",
+            "year",
+            "month",
+            "value",
+        ),
+        Index("ix_transactions_date", "date", postgresql_using="brin"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
+    account_id: Mapped[str] = mapped_column(
+        String(MAX_ACCOUNT_LENGTH),
+        default=DEFAULT_ACCOUNT,
+        server_default=DEFAULT_ACCOUNT,
+    )
     date: Mapped[date]
     value: Mapped[float]
+    year: Mapped[int] = mapped_column(_date_part("year"))
+    month: Mapped[int] = mapped_column(_date_part("month"))
+
+
+class Account(Base):
+    """An account whose summary is emailed to its owner."""
+
+    __tablename__ = "accounts"
+
+    id: Mapped[str] = mapped_column(String(MAX_ACCOUNT_LENGTH), primary_key=True)
+    email: Mapped[str]
+
+
+class MonthlyAggregate(Base):
+    """Per-account and month aggregates of the transactions table.
+
+    Kept up to date by TransactionSeeder as deltas, within the same DB
+    transaction that writes the transactions.
+    """
+
+    __tablename__ = "monthly_aggregates"
+
+    account_id: Mapped[str] = mapped_column(
+        String(MAX_ACCOUNT_LENGTH), primary_key=True, server_default=DEFAULT_ACCOUNT
+    )
+    year: Mapped[int] = mapped_column(primary_key=True)
+    month: Mapped[int] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+    credit_sum: Mapped[float] = mapped_column(default=0)
+    credit_count: Mapped[int] = mapped_column(default=0)
+    debit_sum: Mapped[float] = mapped_column(default=0)
+    debit_count: Mapped[int] = mapped_column(default=0)
+    balance: Mapped[float] = mapped_column(default=0)
+
+
+class DataVersion(Base):
+    """Counter bumped by every committed write to the transactions.
+
+    Cached summaries are keyed on it, so they are invalidated exactly when
+    the data they were computed from changes. The table has a single row.
+    """
+
+    __tablename__ = "data_version"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+class IngestRecord(Base):
+    """An ingest of a file, identified by the SHA-256 hash of its content.
+
+    Only completed ingests count as done: files whose ingest failed, or
+    never finished, are ingested again when uploaded again.
+    """
+
+    __tablename__ = "ingest_log"
+    __table_args__ = (Index("ix_ingest_log_content_hash", "content_hash", "status"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    status: Mapped[str] = mapped_column(default="started")
+    inserted: Mapped[int] = mapped_column(default=0)
+    updated: Mapped[int] = mapped_column(default=0)
+    duration: Mapped[Optional[float]]
+    started_at: Mapped[datetime]
+    finished_at: Mapped[Optional[datetime]]
+    error: Mapped[Optional[str]]
+
+
+class IngestJob(Base):
+    """A file ingested in chunks by src.chunked_ingest.
+
+    The job is merged once every one of its chunks is committed, and
+    completed once its summary email is sent.
+    """
+
+    __tablename__ = "ingest_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    path: Mapped[str]
+    content_hash: Mapped[str] = mapped_column(String(64), index=True)
+    header: Mapped[str]
+    status: Mapped[str] = mapped_column(default="running")
+    inserted: Mapped[int] = mapped_column(default=0)
+    updated: Mapped[int] = mapped_column(default=0)
+    created_at: Mapped[datetime]
+    finished_at: Mapped[Optional[datetime]]
+
+
+class IngestChunk(Base):
+    """The checkpoint of a byte range of an IngestJob's file.
+
+    A chunk is committed in the same DB transaction that stages its rows,
+    so committed chunks are never staged twice.
+    """
+
+    __tablename__ = "ingest_chunks"
+
+    job_id: Mapped[int] = mapped_column(ForeignKey("ingest_jobs.id"), primary_key=True)
+    number: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    start_offset: Mapped[int] = mapped_column(BigInteger)
+    end_offset: Mapped[int] = mapped_column(BigInteger)
+    first_line: Mapped[int]
+    status: Mapped[str] = mapped_column(default="pending")
+    rows: Mapped[int] = mapped_column(default=0)
+    committed_at: Mapped[Optional[datetime]]
+    error: Mapped[Optional[str]]
+
+
+class StagedTransaction(Base):
+    """A row of a committed IngestChunk, pending the merge of its job."""
+
+    __tablename__ = "ingest_staging"
+
+    job_id: Mapped[int] = mapped_column(ForeignKey("ingest_jobs.id"), primary_key=True)
+    chunk: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    seq: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    id: Mapped[int]
+    date: Mapped[date] = mapped_column(Date)
+    value: Mapped[float]
+    account_id: Mapped[str] = mapped_column(String(MAX_ACCOUNT_LENGTH))
+
+
+class SchemaVersion(Base):
+    """A migration applied to the DB by src.db.migrations."""
+
+    __tablename__ = "schema_version"
+
+    version: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    description: Mapped[str]
+    applied_at: Mapped[datetime]
+
+
+class OutboxEmail(Base):
+    """A summary email pending to be sent by the outbox drainer."""
 
+    __tablename__ = "email_outbox"
 
-Base.metadata.create_all(bind=DbAPI().engine)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    recipient: Mapped[str]
+    subject: Mapped[str]
+    status: Mapped[str] = mapped_column(default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(default=0)
+    created_at: Mapped[datetime]
+    next_attempt_at: Mapped[datetime]
+    sent_at: Mapped[Optional[datetime]]
+    last_error: Mapped[Optional[str]]
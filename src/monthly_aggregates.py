@@ -0,0 +1,285 @@
+#! /usr/bin/python3
+import logging
+import math
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import date
+from logging import Logger
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    ColumnElement,
+    FromClause,
+    Select,
+    case,
+    delete,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.orm import Session
+
+from src.db.db import DbAPI
+from src.models import DEFAULT_ACCOUNT, MonthlyAggregate, Transaction
+from src.summary_cache import bump_data_version
+
+AGGREGATE_COLUMNS = (
+    "count",
+    "credit_sum",
+    "credit_count",
+    "debit_sum",
+    "debit_count",
+    "balance",
+)
+
+AccountMonth = Tuple[str, int, int]
+
+# Serializes the writers of the aggregates on PostgreSQL, see MonthlyAggregator.lock
+_ADVISORY_LOCK_KEY = 7_302_119
+
+
+def aggregate_transactions_statement(
+    by_account: bool = False,
+    source: Optional[FromClause] = None,
+    leading_keys: Sequence[ColumnElement] = (),
+) -> Select:
+    """Returns the query aggregating the transactions table by year and month.
+
+    Each row holds the year, the month and then the AGGREGATE_COLUMNS, in
+    that order. Conditional aggregates are used so that the whole table is
+    aggregated in a single pass. With ``by_account``, rows are also grouped
+    by account, and each one starts with the account id. Grouping by the
+    stored year and month lets the query be answered from the covering
+    indexes of the transactions table.
+
+    :param source: a table or subquery with the account_id, year, month and
+                   value columns to aggregate instead of the transactions table
+    :param leading_keys: expressions to group by first, with rows starting
+                         with their values
+
+    """
+    columns = (Transaction.__table__ if source is None else source).c
+    keys = [columns.year, columns.month]
+    if by_account:
+        keys.insert(0, columns.account_id)
+    keys[:0] = leading_keys
+    is_credit = columns.value > 0
+    is_debit = columns.value < 0
+    return (
+        select(
+            *keys,
+            func.count(),
+            func.coalesce(func.sum(case((is_credit, columns.value))), 0),
+            func.count(case((is_credit, 1))),
+            func.coalesce(func.sum(case((is_debit, columns.value))), 0),
+            func.count(case((is_debit, 1))),
+            func.sum(columns.value),
+        )
+        .group_by(*keys)
+        .order_by(*keys)
+    )
+
+
+class MonthlyAggregateDeltas:
+    """Accumulates the changes to apply to the monthly aggregates."""
+
+    def __init__(self) -> None:
+        self.deltas: Dict[AccountMonth, List[float]] = {}
+
+    def add(
+        self,
+        transaction_date: date,
+        value: float,
+        sign: int = 1,
+        account_id: str = DEFAULT_ACCOUNT,
+    ) -> None:
+        """Adds (or with sign=-1, subtracts) a transaction's contribution."""
+        key = (account_id, transaction_date.year, transaction_date.month)
+        delta = self.deltas.setdefault(key, [0] * len(AGGREGATE_COLUMNS))
+        delta[0] += sign
+        if value > 0:
+            delta[1] += sign * value
+            delta[2] += sign
+        elif value < 0:
+            delta[3] += sign * value
+            delta[4] += sign
+        delta[5] += sign * value
+
+    def subtract(
+        self, transaction_date: date, value: float, account_id: str = DEFAULT_ACCOUNT
+    ) -> None:
+        self.add(transaction_date, value, sign=-1, account_id=account_id)
+
+    def add_totals(
+        self,
+        year: int,
+        month: int,
+        totals: List[float],
+        account_id: str = DEFAULT_ACCOUNT,
+    ) -> None:
+        """Adds already aggregated totals, in the order of AGGREGATE_COLUMNS."""
+        delta = self.deltas.setdefault(
+            (account_id, year, month), [0] * len(AGGREGATE_COLUMNS)
+        )
+        for i, total in enumerate(totals):
+            delta[i] += total
+
+    def rows(self) -> List[Dict[str, float]]:
+        """Returns the non-zero deltas as rows for the monthly_aggregates table."""
+        return [
+            {
+                "account_id": account_id,
+                "year": year,
+                "month": month,
+                **dict(zip(AGGREGATE_COLUMNS, delta)),
+            }
+            for (account_id, year, month), delta in sorted(self.deltas.items())
+            if any(delta)
+        ]
+
+
+@dataclass(frozen=True)
+class AggregateMismatch:
+    """A month whose stored aggregates differ from the transactions table."""
+
+    account_id: str
+    year: int
+    month: int
+    expected: Optional[Tuple]
+    actual: Optional[Tuple]
+
+
+class MonthlyAggregator:
+    """Class for maintaining the monthly_aggregates table.
+
+    Applies the deltas computed by TransactionSeeder and provides a full
+    rebuild from, and a consistency check against, the transactions table.
+    """
+
+    def __init__(self, dbapi: Optional[DbAPI] = None, logger: Optional[Logger] = None):
+        self.log = logger or logging.getLogger(__name__)
+        self.db = dbapi or DbAPI()
+
+    def lock(self, session: Session) -> None:
+        """Waits for the DB transactions writing the aggregates to end.
+
+        Deltas subtract the previous values of the rows an ingest replaces,
+        which it reads before upserting them, so concurrent ingests of the
+        same ids would subtract the same values twice. Ingests lock before
+        reading them, and hold the lock until their DB transaction ends.
+        SQLite needs no lock: a transaction writing rows that another one
+        wrote since it read them fails rather than commit.
+        """
+        if self.db.engine.dialect.name == "postgresql":
+            session.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"),
+                {"key": _ADVISORY_LOCK_KEY},
+            )
+
+    def apply(self, session: Session, deltas: MonthlyAggregateDeltas) -> None:
+        """Adds the deltas to the stored aggregates within the given session."""
+        rows = deltas.rows()
+        if not rows:
+            return
+        table = MonthlyAggregate.__table__
+        statement = self.db.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.account_id, table.c.year, table.c.month],
+            set_={
+                column: table.c[column] + statement.excluded[column]
+                for column in AGGREGATE_COLUMNS
+            },
+        )
+        session.execute(statement, rows)
+
+    def rebuild(self) -> None:
+        """Recomputes every monthly aggregate from the transactions table."""
+        with self.db.session_local() as session:
+            self.lock(session)
+            session.execute(delete(MonthlyAggregate))
+            session.execute(
+                MonthlyAggregate.__table__.insert().from_select(
+                    ["account_id", "year", "month", *AGGREGATE_COLUMNS],
+                    aggregate_transactions_statement(by_account=True),
+                )
+            )
+            # Summaries read from the aggregates may change
+            bump_data_version(self.db, session)
+        self.log.info("Monthly aggregates rebuilt")
+
+    def check_consistency(self) -> List[AggregateMismatch]:
+        """Compares the stored aggregates against the transactions table.
+
+        Sums are compared with a small tolerance since they accumulate
+        floating point error as deltas are applied.
+
+        :returns: a list with the account months whose aggregates do not match
+
+        """
+        aggregate_columns = [
+            getattr(MonthlyAggregate, column) for column in AGGREGATE_COLUMNS
+        ]
+        with self.db.session_local() as session:
+            expected = {
+                tuple(row[:3]): tuple(row[3:])
+                for row in session.execute(
+                    aggregate_transactions_statement(by_account=True)
+                )
+            }
+            actual = {
+                tuple(row[:3]): tuple(row[3:])
+                for row in session.execute(
+                    select(
+                        MonthlyAggregate.account_id,
+                        MonthlyAggregate.year,
+                        MonthlyAggregate.month,
+                        *aggregate_columns,
+                    ).where(MonthlyAggregate.count != 0)
+                )
+            }
+
+        mismatches = []
+        for key in sorted(expected.keys() | actual.keys()):
+            expected_row = expected.get(key)
+            actual_row = actual.get(key)
+            if not _rows_match(expected_row, actual_row):
+                mismatches.append(AggregateMismatch(*key, expected_row, actual_row))
+        return mismatches
+
+
+def _rows_match(expected: Optional[Tuple], actual: Optional[Tuple]) -> bool:
+    if expected is None or actual is None:
+        return expected is actual
+    return all(
+        math.isclose(e, a, rel_tol=1e-9, abs_tol=1e-6) for e, a in zip(expected, actual)
+    )
+
+
+def cli():
+    parser = ArgumentParser(description="Maintain the monthly_aggregates table")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args()
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    aggregator = MonthlyAggregator(logger=logger)
+    if args.command == "rebuild":
+        aggregator.rebuild()
+        return
+
+    mismatches = aggregator.check_consistency()
+    for mismatch in mismatches:
+        logger.info(
+            f"{mismatch.account_id} {mismatch.year}/{mismatch.month:02}: expected {mismatch.expected}, "
+            f"found {mismatch.actual}"
+        )
+    if mismatches:
+        sys.exit(1)
+    logger.info("Monthly aggregates are consistent")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,80 @@
+#! /usr/bin/python3
+"""Minimal multipart/form-data reader working on a view of the request body.
+
+Only what handle() needs is supported: finding a part by its form field
+name. The body is scanned for boundaries with bytes.find and the part's
+content is returned as a memoryview into the body, so no part is copied.
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional
+
+_BOUNDARY_PATTERN = re.compile(r'boundary=(?:"([^"]+)"|([^;\s]+))', re.IGNORECASE)
+_NAME_PATTERN = re.compile(r';\s*name="?([^";]*)"?', re.IGNORECASE)
+
+
+class MultipartError(Exception):
+    ...
+
+
+@dataclass(frozen=True)
+class Part:
+    """A part of a multipart body, with lower-cased header names."""
+
+    headers: Dict[str, str]
+    content: memoryview
+
+    @property
+    def name(self) -> Optional[str]:
+        """The form field name from the part's Content-Disposition, if any."""
+        match = _NAME_PATTERN.search(self.headers.get("content-disposition", ""))
+        return match.group(1) if match else None
+
+
+def iter_parts(body: bytes, content_type: Optional[str]) -> Iterator[Part]:
+    """Yields the parts of a multipart body, in order.
+
+    :raises MultipartError: if the content type has no boundary or the body
+                            does not follow it
+
+    """
+    match = _BOUNDARY_PATTERN.search(content_type or "")
+    if not match:
+        raise MultipartError("The request is not multipart/form-data")
+    delimiter = b"--" + (match.group(1) or match.group(2)).encode()
+    view = memoryview(body)
+
+    position = body.find(delimiter)
+    if position < 0:
+        raise MultipartError("The multipart body has no parts")
+    while True:
+        position += len(delimiter)
+        if body.startswith(b"--", position):
+            return
+        headers_start = body.find(b"\r\n", position) + 2
+        headers_end = body.find(b"\r\n\r\n", headers_start - 2)
+        content_end = body.find(b"\r\n" + delimiter, headers_end)
+        if headers_start < 2 or headers_end < 0 or content_end < 0:
+            raise MultipartError("The multipart body is truncated")
+        yield Part(
+            headers=_parse_headers(view[headers_start:headers_end]),
+            content=view[headers_end + 4 : content_end],
+        )
+        position = content_end + 2
+
+
+def find_part(body: bytes, content_type: Optional[str], name: str) -> Optional[Part]:
+    """Returns the first part for the form field with the given name, if any."""
+    for part in iter_parts(body, content_type):
+        if part.name == name:
+            return part
+    return None
+
+
+def _parse_headers(raw_headers: memoryview) -> Dict[str, str]:
+    headers = {}
+    for line in bytes(raw_headers).decode("utf-8", "replace").split("\r\n"):
+        key, separator, value = line.partition(":")
+        if separator:
+            headers[key.strip().lower()] = value.strip()
+    return headers
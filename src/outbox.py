@@ -0,0 +1,191 @@
+#! /usr/bin/python3
+import logging
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from src import instrumentation
+from src.config import settings
+from src.db.db import DBClientError, DbAPI
+from src.email_gateway import EmailGatewayError
+from src.models import OutboxEmail, utcnow
+from src.transaction_summarizer import TransactionSummarizer
+
+
+@dataclass(frozen=True)
+class DrainResult:
+    """Outcome of a drain: emails sent, retried later and given up on.
+
+    Each email sent may cover several coalesced outbox entries.
+    """
+
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+
+
+class EmailOutbox:
+    """Class for queueing summary emails in the DB and sending them later.
+
+    Uploads only record a pending entry with enqueue, so that composing
+    and sending the email is kept out of the request. drain then sends
+    the pending emails that are due, in batches. Entries for the same
+    recipient and subject are coalesced into a single email, since the
+    summary always reflects every transaction stored when it is sent.
+    Failed sends are retried with exponential backoff up to
+    ``outbox_max_attempts`` times.
+    """
+
+    def __init__(
+        self,
+        dbapi: Optional[DbAPI] = None,
+        logger: Optional[Logger] = None,
+        summarizer: Optional[TransactionSummarizer] = None,
+    ):
+        self.log = logger or logging.getLogger(__name__)
+        self.db = dbapi or DbAPI()
+        self.summarizer = summarizer or TransactionSummarizer(
+            db_api=self.db, logger=self.log
+        )
+        self.batch_size = settings.get("outbox_batch_size", 50)
+        self.max_attempts = settings.get("outbox_max_attempts", 5)
+        self.backoff = timedelta(seconds=settings.get("outbox_backoff_seconds", 60))
+        self.lease = timedelta(seconds=settings.get("outbox_lease_seconds", 300))
+        # Entries wait this long before being sent, so that a burst of
+        # uploads ends up in a single email
+        self.coalesce_window = timedelta(
+            seconds=settings.get("outbox_coalesce_seconds", 60)
+        )
+
+    def enqueue(self, recipient: str, subject: str) -> None:
+        """Records a pending summary email for the recipient."""
+        now = utcnow()
+        with self.db.session_local() as session:
+            session.add(
+                OutboxEmail(
+                    recipient=recipient,
+                    subject=subject,
+                    created_at=now,
+                    next_attempt_at=now + self.coalesce_window,
+                )
+            )
+        self.log.info(f"Summary email to {recipient} queued")
+
+    def drain(self, now: Optional[datetime] = None) -> DrainResult:
+        """Sends the pending emails that are due.
+
+        :returns: a DrainResult with the number of emails sent, retried and failed
+
+        """
+        now = now or utcnow()
+        sent = retried = failed = 0
+        for (recipient, subject), ids in self._claim_due_emails(now).items():
+            try:
+                self.summarizer.send_summary_email(recipient, subject)
+            # The summary is read from the DB before it is sent
+            except (DBClientError, EmailGatewayError, OSError) as e:
+                self.log.error(f"Summary email to {recipient} failed: {e}")
+                if self._record_failure(ids, str(e), now):
+                    failed += 1
+                else:
+                    retried += 1
+            else:
+                self._record_sent(recipient, subject, now)
+                sent += 1
+        self.log.info(
+            f"Outbox drained: {sent} sent, {retried} retried, {failed} failed"
+        )
+        return DrainResult(sent=sent, retried=retried, failed=failed)
+
+    def _claim_due_emails(self, now: datetime) -> Dict[Tuple[str, str], List[int]]:
+        """Leases the due entries, grouped by recipient and subject.
+
+        The lease pushes their next attempt into the future, so concurrent
+        drainers do not pick them up, and a drainer that dies while sending
+        does not hold them forever.
+        """
+        statement = (
+            select(OutboxEmail)
+            .where(OutboxEmail.status == "pending")
+            .where(OutboxEmail.next_attempt_at <= now)
+            .order_by(OutboxEmail.next_attempt_at)
+            .limit(self.batch_size)
+            # Concurrent drainers skip the entries another one is claiming
+            .with_for_update(skip_locked=True)
+        )
+        emails: Dict[Tuple[str, str], List[int]] = {}
+        with self.db.session_local() as session:
+            for email in session.scalars(statement):
+                email.next_attempt_at = now + self.lease
+                emails.setdefault((email.recipient, email.subject), []).append(email.id)
+        return emails
+
+    def _record_sent(self, recipient: str, subject: str, now: datetime) -> None:
+        # Every pending entry created up to now is covered by the email
+        # just sent, including those not due yet
+        with self.db.session_local() as session:
+            session.execute(
+                update(OutboxEmail)
+                .where(OutboxEmail.status == "pending")
+                .where(OutboxEmail.recipient == recipient)
+                .where(OutboxEmail.subject == subject)
+                .where(OutboxEmail.created_at <= now)
+                .values(status="sent", sent_at=now)
+            )
+
+    def _record_failure(self, ids: List[int], error: str, now: datetime) -> bool:
+        """Schedules a retry of the entries, or gives up on them.
+
+        :returns: True if the maximum number of attempts was reached
+
+        """
+        with self.db.session_local() as session:
+            emails = session.scalars(
+                select(OutboxEmail).where(OutboxEmail.id.in_(ids))
+            ).all()
+            for email in emails:
+                email.attempts += 1
+                email.last_error = error
+                if email.attempts >= self.max_attempts:
+                    email.status = "failed"
+                else:
+                    email.next_attempt_at = now + self.backoff * 2 ** (
+                        email.attempts - 1
+                    )
+            return any(email.status == "failed" for email in emails)
+
+
+def handle(event, context):
+    """Lambda handler for draining the outbox, e.g. on a schedule."""
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    try:
+        with instrumentation.invocation("outbox_drain"):
+            result = EmailOutbox(logger=logger).drain()
+    except DBClientError as e:
+        logger.error(str(e))
+        return {"statusCode": 502, "body": str(e)}
+    return {
+        "statusCode": 200,
+        "body": f"{result.sent} sent, {result.retried} retried, {result.failed} failed",
+    }
+
+
+def cli():
+    parser = ArgumentParser(description="Send the pending summary emails")
+    parser.parse_args()
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    EmailOutbox(logger=logger).drain()
+
+
+if __name__ == "__main__":
+    cli()
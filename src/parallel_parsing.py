@@ -0,0 +1,118 @@
+#! /usr/bin/python3
+"""Parallel parsing of large transaction files.
+
+The file is memory-mapped and split at newline-aligned byte offsets after
+its header. Each range is parsed into NumPy arrays by a worker process,
+and the results are yielded in file order so that, when written in that
+order, the last occurrence of a duplicate id still wins.
+"""
+import mmap
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from math import ceil
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from src.columnar import (
+    ColumnarParseError,
+    TransactionColumns,
+    header_columns,
+    parse_chunk,
+)
+
+ByteRange = Tuple[int, int]
+
+RANGE_BYTES = 16 * 1024 * 1024
+
+
+def split_file(path: str, chunks: int) -> Tuple[str, List[ByteRange]]:
+    """Splits the file after its header into newline-aligned byte ranges.
+
+    :returns: the header line and the (start, end) byte offsets of each range
+
+    """
+    with open(path, "rb") as file:
+        if file.seek(0, 2) == 0:
+            return "", []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = mm.find(b"\n") + 1 or len(mm)
+            header = mm[:header_end].decode("utf-8-sig")
+            size = len(mm) - header_end
+            ranges = []
+            start = header_end
+            for i in range(1, chunks + 1):
+                end = len(mm) if i == chunks else header_end + size * i // chunks
+                if end <= start:
+                    continue
+                if end < len(mm):
+                    end = mm.find(b"\n", end - 1) + 1 or len(mm)
+                ranges.append((start, end))
+                start = end
+            return header, ranges
+
+
+def parse_range(
+    path: str, byte_range: ByteRange, usecols: Tuple[int, ...]
+) -> Tuple[int, Optional[TransactionColumns], List[int]]:
+    """Worker side: parses a byte range of the file.
+
+    Line numbers are relative to the start of the range, since the worker
+    does not know how many lines the previous ranges hold.
+
+    :returns: the number of lines in the range, the parsed columns and the
+              relative line numbers of malformed rows, if any
+
+    """
+    start, end = byte_range
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode("utf-8")
+    line_count = text.count("\n")
+    lines = text.split("\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    try:
+        return line_count, parse_chunk(lines, usecols, first_line=0), []
+    except ColumnarParseError as e:
+        return line_count, None, e.line_numbers
+
+
+def parse_file_parallel(
+    path: str, workers: int, batch_size: int, range_bytes: int = RANGE_BYTES
+) -> Iterator[TransactionColumns]:
+    """Parses the file in a process pool, yielding batches in file order.
+
+    The file is split in ranges of about ``range_bytes`` and at most two
+    ranges per worker are in flight at any time, so memory is bounded by
+    the range size rather than by the size of the file.
+
+    :raises ColumnarParseError: with the line numbers of the malformed rows
+                                within the whole file
+
+    """
+    chunks = max(workers, ceil(os.path.getsize(path) / range_bytes))
+    header, ranges = split_file(path, chunks)
+    if not header:
+        return
+    usecols = header_columns(header)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: Deque[Future] = deque()
+        remaining = iter(ranges)
+        line_number = 2
+        while True:
+            while len(pending) < 2 * workers:
+                byte_range = next(remaining, None)
+                if byte_range is None:
+                    break
+                pending.append(executor.submit(parse_range, path, byte_range, usecols))
+            if not pending:
+                return
+            line_count, parsed, malformed = pending.popleft().result()
+            if malformed:
+                for future in pending:
+                    future.cancel()
+                raise ColumnarParseError([line_number + n for n in malformed])
+            line_number += line_count
+            for start in range(0, len(parsed), batch_size):
+                yield parsed[start : start + batch_size]
@@ -0,0 +1,94 @@
+#! /usr/bin/python3
+"""Bounded producer/consumer pipelines between threads.
+
+A producer thread iterates over the items, e.g. parsing a file into
+batches, and feeds them through a bounded queue to a consumer, e.g. a DB
+writer, so that both sides work at the same time. A full queue blocks
+the producer until the consumer catches up, which bounds memory by the
+size of the queue. An error raised by either side stops the other one,
+and is raised again to the caller.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from queue import Empty, Full, Queue
+from threading import Event
+from typing import Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# How often a blocked side checks whether the other one failed
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised within a side when the other one failed."""
+
+
+def run_pipeline(
+    items: Iterable[T], consumer: Callable[[Iterator[T]], R], queue_size: int
+) -> R:
+    """Feeds the items, produced by a thread, to the consumer through a queue.
+
+    The consumer runs in the calling thread, and is given an iterator over
+    the items of the queue, which holds up to ``queue_size`` items.
+
+    :returns: the result of the consumer
+
+    """
+    queue = Queue(maxsize=queue_size)
+    stop = Event()
+    errors: List[BaseException] = []
+
+    def put(item) -> None:
+        while True:
+            if stop.is_set():
+                raise _Stopped
+            try:
+                queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except Full:
+                continue
+
+    def produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                put(item)
+            put(_DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # Closes generators, e.g. to shut down the pool of a parallel parser
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def consume() -> Iterator[T]:
+        while True:
+            if stop.is_set():
+                raise _Stopped
+            try:
+                item = queue.get(timeout=_POLL_SECONDS)
+            except Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(copy_context().run, produce)
+        try:
+            result = consumer(consume())
+        except _Stopped:
+            result = None
+        finally:
+            stop.set()
+    if errors:
+        raise errors[0]
+    return result
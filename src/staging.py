@@ -0,0 +1,81 @@
+#! /usr/bin/python3
+"""Merging of staged transactions into the transactions table.
+
+Bulk ingests stage the parsed rows first, and then merge the last row of
+each id into the transactions table with a single
+``INSERT ... SELECT ... ON CONFLICT (id) DO UPDATE``. The deltas of the
+monthly aggregates are computed by the DB, from the merged rows and from
+the rows they replace, which concurrent ingests are kept from changing
+meanwhile by the aggregator's lock.
+"""
+from typing import Tuple
+
+from sqlalchemy import FromClause, select, true
+from sqlalchemy.orm import Session
+
+from src.models import Transaction
+from src.monthly_aggregates import (
+    MonthlyAggregateDeltas,
+    MonthlyAggregator,
+    aggregate_transactions_statement,
+)
+
+
+def merge_last_rows(
+    session: Session, aggregator: MonthlyAggregator, last_rows: FromClause
+) -> Tuple[int, int]:
+    """Upserts the rows into the transactions table, along with their deltas.
+
+    :param last_rows: a table or subquery with a single row per id, with
+                      the id, date, value, account_id, year and month columns
+    :returns: the number of inserted and of updated transactions
+
+    """
+    aggregator.lock(session)
+    deltas = MonthlyAggregateDeltas()
+    merged = updated = 0
+    for account_id, year, month, *totals in session.execute(
+        aggregate_transactions_statement(by_account=True, source=last_rows)
+    ):
+        deltas.add_totals(year, month, totals, account_id=account_id)
+        merged += totals[0]
+    replaced = (
+        select(
+            Transaction.account_id,
+            Transaction.year,
+            Transaction.month,
+            Transaction.value,
+        )
+        .join(last_rows, last_rows.c.id == Transaction.id)
+        .subquery()
+    )
+    for account_id, year, month, *totals in session.execute(
+        aggregate_transactions_statement(by_account=True, source=replaced)
+    ):
+        negated = [-total for total in totals]
+        deltas.add_totals(year, month, negated, account_id=account_id)
+        updated += totals[0]
+
+    table = Transaction.__table__
+    statement = aggregator.db.insert(table).from_select(
+        ["id", "date", "value", "account_id"],
+        select(
+            last_rows.c.id,
+            last_rows.c.date,
+            last_rows.c.value,
+            last_rows.c.account_id,
+        )
+        # SQLite can't tell the ON CONFLICT clause from a join's ON without it
+        .where(true()),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={
+            "date": statement.excluded.date,
+            "value": statement.excluded.value,
+            "account_id": statement.excluded.account_id,
+        },
+    )
+    session.execute(statement)
+    aggregator.apply(session, deltas)
+    return merged - updated, updated
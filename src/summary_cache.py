@@ -0,0 +1,214 @@
+#! /usr/bin/python3
+"""Cache of transaction summaries, invalidated by the data version.
+
+TransactionSeeder bumps the single row of the data_version table within
+every committed ingest. Summaries are cached under the version they were
+computed at, so an entry is only ever served while the data it was
+computed from is unchanged.
+"""
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import astuple, dataclass
+from threading import Lock
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db.db import DbAPI
+from src.models import DataVersion
+
+if TYPE_CHECKING:
+    from src.transaction_summarizer import TransactionSummary
+
+_DATA_VERSION_ID = 1
+# Stands for "every account", since account ids can't be empty
+_ALL_ACCOUNTS = ""
+
+
+def read_data_version(session: Session) -> int:
+    """Returns the current data version, 0 if nothing was ever written."""
+    version = session.scalar(
+        select(DataVersion.version).where(DataVersion.id == _DATA_VERSION_ID)
+    )
+    return version or 0
+
+
+def bump_data_version(db: DbAPI, session: Session) -> None:
+    """Increments the data version within the session's DB transaction.
+
+    Meant to be called last in the transaction, as the row stays locked
+    until it is committed.
+    """
+    table = DataVersion.__table__
+    statement = db.insert(table).values(id=_DATA_VERSION_ID, version=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id], set_={"version": table.c.version + 1}
+    )
+    session.execute(statement)
+
+
+@dataclass
+class CacheStats:
+    """Counters of a SummaryCache's lookups and dropped entries.
+
+    Evictions are entries dropped because the cache was full or they were
+    too old; invalidations, because the data version changed.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+class SummaryCache:
+    """LRU cache of summaries, optionally backed by a shared SQLite file.
+
+    Up to ``max_size`` summaries are kept in process for ``ttl`` seconds.
+    When a ``path`` is given, summaries are also stored in a SQLite file
+    there, so that every worker process on the host shares them.
+    """
+
+    def __init__(self, max_size: int, ttl: float, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.stats = CacheStats()
+        # (version, account id) -> (expiry time, summary), least recent first
+        self._entries: OrderedDict = OrderedDict()
+        self._version = 0
+        self._lock = Lock()
+        if path:
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS summaries ("
+                    "version INTEGER, account_id TEXT, months TEXT, expires_at REAL,"
+                    " PRIMARY KEY (version, account_id))"
+                )
+
+    def get(
+        self, version: int, account_id: Optional[str] = None
+    ) -> Optional["TransactionSummary"]:
+        """Returns the summary cached for the data version and account, if any."""
+        key = (version, account_id or _ALL_ACCOUNTS)
+        with self._lock:
+            self._invalidate_older(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.stats.evictions += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry[1]
+
+        summary = self._get_shared(key) if self.path else None
+        with self._lock:
+            if summary is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+                self._store(key, summary)
+        return summary
+
+    def set(
+        self,
+        version: int,
+        account_id: Optional[str],
+        summary: "TransactionSummary",
+    ) -> None:
+        """Caches the summary computed at the data version for the account."""
+        key = (version, account_id or _ALL_ACCOUNTS)
+        with self._lock:
+            self._invalidate_older(version)
+            if version < self._version:
+                # Computed from data that has already changed
+                return
+            self._store(key, summary)
+        if self.path:
+            self._set_shared(key, summary)
+
+    def clear(self) -> None:
+        """Drops every cached summary, including the shared ones."""
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM summaries")
+
+    def _store(self, key: Tuple[int, str], summary: "TransactionSummary") -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _invalidate_older(self, version: int) -> None:
+        if version <= self._version:
+            return
+        self._version = version
+        stale = [key for key in self._entries if key[0] < version]
+        for key in stale:
+            del self._entries[key]
+        self.stats.invalidations += len(stale)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            # Commits on success and rolls back on error
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _get_shared(self, key: Tuple[int, str]) -> Optional["TransactionSummary"]:
+        # Imported here to avoid circular imports
+        from src.transaction_summarizer import MonthSummary, TransactionSummary
+
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT months FROM summaries"
+                " WHERE version = ? AND account_id = ? AND expires_at >= ?",
+                (*key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        months = tuple(MonthSummary(*month) for month in json.loads(row[0]))
+        return TransactionSummary(months=months)
+
+    def _set_shared(self, key: Tuple[int, str], summary: "TransactionSummary") -> None:
+        months = json.dumps([astuple(month) for month in summary.months])
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM summaries WHERE version < ? OR expires_at < ?",
+                (key[0], time.time()),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+                (*key, months, time.time() + self.ttl),
+            )
+
+
+# Shared by every TransactionSummarizer within the process
+_cache: Optional[SummaryCache] = None
+_cache_lock = Lock()
+
+
+def get_summary_cache() -> SummaryCache:
+    """Returns the process-wide summary cache, configured from the settings."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SummaryCache(
+                max_size=settings.get("summary_cache_size", 256),
+                ttl=settings.get("summary_cache_ttl", 300),
+                path=settings.get("summary_cache_path") or None,
+            )
+        return _cache
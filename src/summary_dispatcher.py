@@ -0,0 +1,137 @@
+#! /usr/bin/python3
+import logging
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from logging import Logger
+from typing import Dict, Optional, Set
+
+from sqlalchemy import select
+
+from src import instrumentation
+from src.config import settings
+from src.db.db import DbAPI
+from src.email_gateway import EmailGatewayError
+from src.models import Account
+from src.summary_renderer import render_summary
+from src.transaction_summarizer import TransactionSummarizer, TransactionSummary
+
+
+@dataclass(frozen=True)
+class DispatchReport:
+    """Outcome of sending every account its summary.
+
+    ``failed`` maps the id of each account whose email could not be sent
+    to the error. ``skipped`` counts the accounts with transactions but
+    without an email address.
+    """
+
+    sent: int = 0
+    failed: Dict[str, str] = field(default_factory=dict)
+    skipped: int = 0
+
+
+class SummaryDispatcher:
+    """Class for emailing every account the summary of its transactions.
+
+    Summaries are computed by a single query grouped by account (see
+    TransactionSummarizer.summaries_by_account) and the emails are composed
+    and sent by a pool of ``dispatch_workers`` threads, which share the
+    pooled SMTP connections. At most twice as many emails as workers are
+    in flight, so memory does not grow with the number of accounts. An
+    account whose email fails is reported without stopping the rest.
+    """
+
+    def __init__(
+        self,
+        dbapi: Optional[DbAPI] = None,
+        logger: Optional[Logger] = None,
+        summarizer: Optional[TransactionSummarizer] = None,
+        workers: Optional[int] = None,
+    ):
+        self.log = logger or logging.getLogger(__name__)
+        self.db = dbapi or DbAPI()
+        self.summarizer = summarizer or TransactionSummarizer(
+            db_api=self.db, logger=self.log
+        )
+        self.workers = workers or settings.get("dispatch_workers", 4)
+
+    def dispatch(self, subject: str) -> DispatchReport:
+        """Sends each account with an email address the summary of its transactions.
+
+        :returns: a DispatchReport with the emails sent and the accounts that failed
+
+        """
+        recipients = self._recipients()
+        sent = skipped = 0
+        failed: Dict[str, str] = {}
+        in_flight: Dict[Future, str] = {}
+
+        def collect(done: Set[Future]) -> None:
+            nonlocal sent
+            for future in done:
+                account_id = in_flight.pop(future)
+                try:
+                    future.result()
+                except (EmailGatewayError, OSError) as e:
+                    self.log.error(
+                        f"Summary email for account {account_id} failed: {e}"
+                    )
+                    failed[account_id] = str(e)
+                else:
+                    sent += 1
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for account_id, summary in self.summarizer.summaries_by_account():
+                recipient = recipients.get(account_id)
+                if recipient is None:
+                    skipped += 1
+                    continue
+                if len(in_flight) >= 2 * self.workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                # Run in a copy of the context, so metrics go to the invocation
+                future = executor.submit(
+                    copy_context().run, self._send, recipient, subject, summary
+                )
+                in_flight[future] = account_id
+            collect(wait(in_flight).done)
+
+        self.log.info(
+            f"Summaries dispatched: {sent} sent, {len(failed)} failed, "
+            f"{skipped} accounts without email"
+        )
+        return DispatchReport(sent=sent, failed=failed, skipped=skipped)
+
+    def _recipients(self) -> Dict[str, str]:
+        with self.db.session_local() as session:
+            return dict(session.execute(select(Account.id, Account.email)).all())
+
+    def _send(self, recipient: str, subject: str, summary: TransactionSummary) -> None:
+        rendered = render_summary(summary)
+        self.summarizer.email_gateway.send_email(
+            recipient, subject, rendered.plaintext, rendered.html
+        )
+
+
+def cli():
+    parser = ArgumentParser(description="Email every account its summary")
+    parser.add_argument("--subject", default=settings.email_subject)
+    args = parser.parse_args()
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    with instrumentation.invocation("dispatch"):
+        report = SummaryDispatcher(logger=logger).dispatch(args.subject)
+    for account_id, error in report.failed.items():
+        logger.info(f"{account_id}: {error}")
+    if report.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,153 @@
+#! /usr/bin/python3
+"""Rendering of transaction summaries into the summary email's bodies.
+
+Both the HTML and the plaintext bodies are built in a single pass over the
+summary, from templates formatted once per row and joined at the end, so
+no HTML has to be parsed back into text.
+"""
+from calendar import month_name
+from html import escape
+from typing import TYPE_CHECKING, List, NamedTuple, Optional
+
+from src import instrumentation
+
+if TYPE_CHECKING:
+    from src.transaction_summarizer import SummaryWindow, TransactionSummary
+
+# calendar.month_name formats each name on every lookup
+_MONTH_NAMES = tuple(month_name)
+_HTML_MONTH_NAMES = tuple(escape(name) for name in _MONTH_NAMES)
+
+_HTML_HEADER = """\
+<html>
+<body>
+<p>Hi!</p>
+<p>This is your automated transaction summary. Here it is:</p>
+<p>"""
+_HTML_WINDOW = "<p><strong>Transactions from {0} to {1}</strong></p>".format
+_HTML_YEAR = (
+    "<p><strong>Number of transactions in {0}: </strong>{1}"
+    '<table border="1" cellpadding="0" cellspacing="0" style="width:500px">'
+    '<thead><tr><th scope="col">Month</th>'
+    '<th scope="col">Number of transactions</th></tr></thead>'
+    "<tbody>"
+).format
+_HTML_MONTH = (
+    '<tr><td style="text-align:center">{0}</td>'
+    '<td style="text-align:center">{1}</td></tr>'
+).format
+_HTML_YEAR_END = "</tbody></table>"
+_HTML_COMPARISON = """\
+<p><strong>Compared with {0} to {1}:</strong></p>
+<ul>
+<li><strong>Number of transactions: </strong>{2} ({3:+})</li>
+<li><strong>Average credit amount: </strong>{4} ({5:+})</li>
+<li><strong>Average debit amount: </strong>{6} ({7:+})</li>
+<li><strong>Total Balance: </strong>{8} ({9:+})</li>
+</ul>
+""".format
+_HTML_FOOTER = """\
+</p>
+<ul>
+<li><strong>Average credit amount: </strong>{0}</li>
+<li><strong>Average debit amount: </strong>{1}</li>
+<li><strong>Total Balance: </strong>{2}</li>
+</ul>
+<br><br>
+<p>Summarizer Bot&nbsp;<span style="font-size:18px">&nbsp;🤖</span></p>
+<p><a href="https://www.storicard.com/" target="_blank"><img alt="Stori" src="https://s4-recruiting.cdn.greenhouse.io/external_greenhouse_job_boards/logos/400/560/600/original/logo_stori_1_(1).png" style="height:70px; width:100px" /></a></p>
+</body>
+</html>
+""".format
+
+_TEXT_HEADER = """\
+Hi!
+
+This is your automated transaction summary. Here it is:
+
+"""
+_TEXT_WINDOW = "Transactions from {0} to {1}\n\n".format
+_TEXT_YEAR = (
+    "Number of transactions in {0}: {1}\n\n"
+    "Month | Number of transactions\n"
+    "---|---\n"
+).format
+_TEXT_MONTH = "{0} | {1}\n".format
+_TEXT_COMPARISON = """\
+Compared with {0} to {1}:
+  * Number of transactions: {2} ({3:+})
+  * Average credit amount: {4} ({5:+})
+  * Average debit amount: {6} ({7:+})
+  * Total Balance: {8} ({9:+})
+
+""".format
+_TEXT_FOOTER = """\
+  * Average credit amount: {0}
+  * Average debit amount: {1}
+  * Total Balance: {2}
+
+Summarizer Bot 🤖
+""".format
+
+
+class RenderedSummary(NamedTuple):
+    html: str
+    plaintext: str
+
+
+def render_summary(
+    summary: "TransactionSummary",
+    window: Optional["SummaryWindow"] = None,
+    previous: Optional["TransactionSummary"] = None,
+) -> RenderedSummary:
+    """Renders the summary email's HTML and plaintext bodies.
+
+    :param window: the window of dates the summary covers, if any
+    :param previous: the summary of the window's previous window, which the
+                     summary's figures are compared with
+    :returns: a RenderedSummary with both bodies
+
+    """
+    with instrumentation.span("render"):
+        return _render(summary, window, previous)
+
+
+def _render(
+    summary: "TransactionSummary",
+    window: Optional["SummaryWindow"],
+    previous: Optional["TransactionSummary"],
+) -> RenderedSummary:
+    html: List[str] = [_HTML_HEADER]
+    text: List[str] = [_TEXT_HEADER]
+    if window is not None:
+        html.append(_HTML_WINDOW(window.start, window.end))
+        text.append(_TEXT_WINDOW(window.start, window.end))
+    for year, transactions_by_month in summary.transactions_by_year_month.items():
+        transactions_in_year = sum(transactions_by_month.values())
+        html.append(_HTML_YEAR(year, transactions_in_year))
+        text.append(_TEXT_YEAR(year, transactions_in_year))
+        for month, transactions in transactions_by_month.items():
+            html.append(_HTML_MONTH(_HTML_MONTH_NAMES[month], transactions))
+            text.append(_TEXT_MONTH(_MONTH_NAMES[month], transactions))
+        html.append(_HTML_YEAR_END)
+        text.append("\n")
+
+    figures = (summary.average_credit, summary.average_debit, summary.total_balance)
+    if window is not None and previous is not None:
+        previous_window = window.previous()
+        comparison = (previous_window.start, previous_window.end)
+        for figure, previous_figure in zip(
+            (summary.count, *figures),
+            (
+                previous.count,
+                previous.average_credit,
+                previous.average_debit,
+                previous.total_balance,
+            ),
+        ):
+            comparison += (previous_figure, figure - previous_figure)
+        html.append(_HTML_COMPARISON(*comparison))
+        text.append(_TEXT_COMPARISON(*comparison))
+    html.append(_HTML_FOOTER(*figures))
+    text.append(_TEXT_FOOTER(*figures))
+    return RenderedSummary(html="".join(html), plaintext="".join(text))
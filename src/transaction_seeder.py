@@ -1,18 +1,88 @@
 #! /usr/bin/python3
 import logging
-from csv import DictReader
+import math
+from codecs import getincrementaldecoder
+from csv import reader
+from dataclasses import dataclass
 from datetime import date
+from functools import partial
 from logging import Logger
-from typing import List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src import instrumentation
+from src.config import settings
+from src.copy_loader import CopyLoader
 from src.db.db import DbAPI
-from src.models import Transaction
+from src.models import DEFAULT_ACCOUNT, MAX_ACCOUNT_LENGTH, Transaction
+from src.monthly_aggregates import MonthlyAggregateDeltas, MonthlyAggregator
+from src.pipeline import run_pipeline
+from src.summary_cache import bump_data_version
+
+if TYPE_CHECKING:
+    from src.columnar import TransactionColumns
 
 
 class MalformedInputFileError(Exception):
     ...
 
 
+def _iter_lines(source: Iterable[Union[str, bytes]]) -> Iterator[str]:
+    """Yields the text lines of a file given as lines or as byte chunks.
+
+    Text items are assumed to already be lines and are passed through.
+    Byte chunks (bytes, bytearray or memoryview) are decoded as UTF-8
+    incrementally, so neither multi-byte characters nor lines need to be
+    aligned with chunk boundaries.
+
+    :raises MalformedInputFileError: if the bytes are not valid UTF-8
+
+    """
+    decoder = getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    try:
+        for chunk in source:
+            if isinstance(chunk, str):
+                yield chunk
+                continue
+            lines = (pending + decoder.decode(chunk)).split("\n")
+            pending = lines.pop()
+            yield from lines
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError as e:
+        raise MalformedInputFileError("The input csv file is not valid UTF-8") from e
+    if pending:
+        yield pending
+
+
+def _column_rows(
+    batches: Iterable["TransactionColumns"],
+) -> Iterator[Tuple[int, date, float, str]]:
+    for columns in batches:
+        yield from columns.rows()
+
+
+@dataclass(frozen=True)
+class IngestResult:
+    """Number of rows inserted and updated by a single ingest."""
+
+    inserted: int = 0
+    updated: int = 0
+
+
 class TransactionSeeder:
     """Class for the object to parse the transactions file into the DB.
 
@@ -22,38 +92,309 @@ class TransactionSeeder:
     this means that if an existing transaction is already in the DB,
     identified by its id, then the existing row will be updated.
 
+    Rows are parsed either one by one (the default "rows" parser) or, with
+    the "columnar" parser, in chunks of NumPy arrays validated with
+    vectorized operations. The columnar parser requires zero-padded
+    YYYY/MM/DD dates.
+
+    Files may have an optional ``account`` column with the id of the
+    account each transaction belongs to. Transactions from files without
+    it belong to the default account.
+
+    Rows are written in batches of ``batch_size`` using native
+    ``INSERT ... ON CONFLICT (id) DO UPDATE`` statements, all within a
+    single DB transaction. The monthly_aggregates table is updated with
+    the batches' deltas, and the data version bumped so cached summaries
+    are invalidated, within that same transaction, which holds the
+    aggregator's lock so that concurrent ingests are applied one after
+    another. On PostgreSQL (with
+    psycopg2), unless ``seeder_copy`` is disabled, rows are instead
+    loaded with COPY by a CopyLoader, within the same kind of transaction.
+
+    Batches are parsed by a thread while they are written, through a queue
+    of ``queue_size`` batches (``seeder_queue_size``; 0 parses and writes
+    in turns).
+
     """
 
-    def __init__(self, dbapi: Optional[DbAPI] = None, logger: Optional[Logger] = None):
+    def __init__(
+        self,
+        dbapi: Optional[DbAPI] = None,
+        logger: Optional[Logger] = None,
+        batch_size: Optional[int] = None,
+        parser: Optional[str] = None,
+        queue_size: Optional[int] = None,
+    ):
         self.log = logger or logging.getLogger(__name__)
         self.db = dbapi or DbAPI()
+        self.aggregator = MonthlyAggregator(dbapi=self.db, logger=self.log)
+        self.batch_size = batch_size or settings.get("seeder_batch_size", 500)
+        self.parser = parser or settings.get("seeder_parser", "rows")
+        self.queue_size = (
+            settings.get("seeder_queue_size", 4) if queue_size is None else queue_size
+        )
+        self.copy_loader = None
+        if settings.get("seeder_copy", True) and CopyLoader.supports(self.db.engine):
+            self.copy_loader = CopyLoader(self.aggregator, logger=self.log)
+
+    def parse_file(self, csvfile: Iterable[Union[str, bytes]]) -> IngestResult:
+        """Parses the csv file and upserts its transactions into the DB.
+
+        The file can be any iterable of text lines (e.g. a list of strings
+        or a file opened in text mode) or of byte chunks (e.g. a file
+        opened in binary mode or a stream of request body chunks). It is
+        processed as a generator pipeline (decode, parse, validate, batch)
+        so memory usage is bounded by ``batch_size`` rather than by the
+        size of the file.
+
+        Duplicate ids within a batch are collapsed before writing, with the
+        last occurrence winning; since batches are written in file order,
+        this also holds across batches. If any row is malformed the whole
+        DB transaction is rolled back and nothing is written.
+
+        Rows that were already written by an earlier batch of the same
+        file are reported as updated, except when loading with COPY, which
+        deduplicates the whole file before writing it.
+
+        :returns: an IngestResult with the number of inserted and updated rows
+
+        """
+        if self.parser == "columnar":
+            return self.write_columns(self._parse_columns(csvfile))
+        rows = self._validate_rows(reader(_iter_lines(csvfile)))
+        if self.copy_loader is not None:
+            return self._copy_rows(rows)
+        return self._write_batches(self._batch_rows(rows), self._upsert_batch)
+
+    def parse_path(self, path: str, workers: int) -> IngestResult:
+        """Parses the csv file at the path in parallel and upserts its transactions.
+
+        The file is memory-mapped and split in newline-aligned ranges which
+        are parsed by a pool of ``workers`` processes with the columnar
+        parser. Batches are written in file order, within a single DB
+        transaction, so the semantics are the same as parse_file's.
+
+        :returns: an IngestResult with the number of inserted and updated rows
 
-    def parse_file(self, csvfile: List[str]):
-        reader = DictReader(csvfile)
-        for row in reader:
+        """
+        # Imported here so that NumPy is only loaded by the columnar parser
+        from src.columnar import ColumnarParseError
+        from src.parallel_parsing import parse_file_parallel
+
+        def batches():
             try:
-                split_date = [int(arg) for arg in row["date"].split("/")]
-                year, month, day = split_date
-                self.log.debug(f"Row about to be inserted: {row}")
-                self._update_or_insert_transaction(
-                    id=int(row["id"]),
-                    date=date(day=day, month=month, year=year),
-                    value=float(row["transaction"]),
+                yield from parse_file_parallel(path, workers, self.batch_size)
+            except ColumnarParseError as e:
+                raise MalformedInputFileError(str(e)) from e
+            except UnicodeDecodeError as e:
+                raise MalformedInputFileError(
+                    "The input csv file is not valid UTF-8"
+                ) from e
+
+        return self.write_columns(batches())
+
+    def write_columns(self, batches: Iterable["TransactionColumns"]) -> IngestResult:
+        """Upserts batches of parsed columns, e.g. parsed by other processes.
+
+        The batches are written in order within a single DB transaction,
+        so the semantics are the same as parse_file's.
+
+        :returns: an IngestResult with the number of inserted and updated rows
+
+        """
+        if self.copy_loader is not None:
+            return self._copy_rows(_column_rows(batches))
+        return self._write_batches(batches, self._upsert_columns)
+
+    def _copy_rows(self, rows: Iterable[Tuple[int, date, float, str]]) -> IngestResult:
+        with instrumentation.span("seeder.ingest"), self.db.session_local() as session:
+            inserted, updated = self.copy_loader.load(session, rows)
+            if inserted or updated:
+                bump_data_version(self.db, session)
+        return self._ingested(inserted, updated)
+
+    def _write_batches(
+        self,
+        batches: Iterable[Any],
+        upsert: Callable[[Session, Any, MonthlyAggregateDeltas], Tuple[int, int]],
+    ) -> IngestResult:
+        # Batches are parsed as they are consumed, so without a queue the
+        # time spent parsing is that of seeder.ingest minus that of seeder.write
+        with instrumentation.span("seeder.ingest"), self.db.session_local() as session:
+            self.aggregator.lock(session)
+            write = partial(self._write, session, upsert)
+            if self.queue_size > 0:
+                inserted, updated, deltas = run_pipeline(
+                    batches, write, self.queue_size
                 )
-                self.log.debug("Row successfully inserted")
-            except (ValueError, AttributeError, KeyError) as e:
-                raise MalformedInputFileError("The input csv file is invalid") from e
+            else:
+                inserted, updated, deltas = write(batches)
+            self.aggregator.apply(session, deltas)
+            if inserted or updated:
+                bump_data_version(self.db, session)
+        return self._ingested(inserted, updated)
+
+    def _write(
+        self,
+        session: Session,
+        upsert: Callable[[Session, Any, MonthlyAggregateDeltas], Tuple[int, int]],
+        batches: Iterable[Any],
+    ) -> Tuple[int, int, MonthlyAggregateDeltas]:
+        """Writer side: upserts the batches, accumulating their deltas.
+
+        The deltas are applied by the caller once every batch is written,
+        with a single statement rather than one per batch.
+        """
+        inserted = updated = 0
+        deltas = MonthlyAggregateDeltas()
+        for batch in batches:
+            with instrumentation.span("seeder.write"):
+                batch_inserted, batch_updated = upsert(session, batch, deltas)
+            inserted += batch_inserted
+            updated += batch_updated
+            instrumentation.count("seeder.batches")
+        return inserted, updated, deltas
+
+    def _ingested(self, inserted: int, updated: int) -> IngestResult:
+        instrumentation.count("seeder.rows_inserted", inserted)
+        instrumentation.count("seeder.rows_updated", updated)
+        self.log.info(f"{inserted} transactions inserted, {updated} updated")
+        return IngestResult(inserted=inserted, updated=updated)
+
+    def _validate_rows(
+        self, rows: Iterator[List[str]]
+    ) -> Iterator[Tuple[int, date, float, str]]:
+        header = next(rows, None)
+        if header is None:
+            return
+        try:
+            id_column = header.index("id")
+            date_column = header.index("date")
+            value_column = header.index("transaction")
+        except ValueError as e:
+            raise MalformedInputFileError("The input csv file is invalid") from e
+        account_column = header.index("account") if "account" in header else None
 
-    def _update_or_insert_transaction(self, id: int, date: date, value: float):
+        for line_number, row in enumerate(rows, start=2):
+            if not row:
+                continue
+            try:
+                id = int(row[id_column])
+                if id <= 0:
+                    raise ValueError(f"Transaction ids must be positive, got {id}")
+                year, month, day = [int(arg) for arg in row[date_column].split("/")]
+                account_id = DEFAULT_ACCOUNT
+                if account_column is not None:
+                    account_id = row[account_column].strip()
+                    if not 0 < len(account_id) <= MAX_ACCOUNT_LENGTH:
+                        raise ValueError(f"Invalid account id {account_id!r}")
+                value = float(row[value_column])
+                if not math.isfinite(value):
+                    raise ValueError(f"Transaction values must be finite, got {value}")
+                yield (id, date(day=day, month=month, year=year), value, account_id)
+            except (ValueError, IndexError) as e:
+                raise MalformedInputFileError(
+                    f"The input csv file is invalid (line {line_number})"
+                ) from e
+
+    def _batch_rows(
+        self, rows: Iterator[Tuple[int, date, float, str]]
+    ) -> Iterator[Dict[int, Tuple[date, float, str]]]:
+        batch = {}
+        for id, date, value, account_id in rows:
+            batch[id] = (date, value, account_id)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    def _parse_columns(
+        self, csvfile: Iterable[Union[str, bytes]]
+    ) -> Iterator["TransactionColumns"]:
+        # Imported here so that NumPy is only loaded by the columnar parser
+        from src.columnar import ColumnarParseError, parse_columns
+
+        try:
+            yield from parse_columns(_iter_lines(csvfile), self.batch_size)
+        except ColumnarParseError as e:
+            raise MalformedInputFileError(str(e)) from e
+
+    def _upsert_batch(
+        self,
+        session: Session,
+        batch: Dict[int, Tuple[date, float, str]],
+        deltas: MonthlyAggregateDeltas,
+    ) -> Tuple[int, int]:
+        for new_date, new_value, account_id in batch.values():
+            deltas.add(new_date, new_value, account_id=account_id)
+        rows = [
+            {"id": id, "date": date, "value": value, "account_id": account_id}
+            for id, (date, value, account_id) in batch.items()
+        ]
+        return self._write_batch(session, rows, deltas)
+
+    def _upsert_columns(
+        self,
+        session: Session,
+        columns: "TransactionColumns",
+        deltas: MonthlyAggregateDeltas,
+    ) -> Tuple[int, int]:
+        columns = columns.deduplicated()
+        for account_id, year, month, totals in columns.month_totals():
+            deltas.add_totals(year, month, totals, account_id=account_id)
+        rows = [
+            {"id": id, "date": date, "value": value, "account_id": account_id}
+            for id, date, value, account_id in columns.rows()
+        ]
+        return self._write_batch(session, rows, deltas)
+
+    def _write_batch(
+        self,
+        session: Session,
+        rows: List[Dict[str, Any]],
+        deltas: MonthlyAggregateDeltas,
+    ) -> Tuple[int, int]:
+        """Upserts deduplicated rows, accumulating their monthly aggregate deltas.
+
+        The deltas must hold the contribution of the new rows; the previous
+        contribution of the rows that already exist is subtracted here, so
+        that rows moved to another month or account are accounted for. The
+        session must hold the aggregator's lock, so that concurrent ingests
+        do not change those rows meanwhile.
+        """
+        existing = session.execute(
+            select(
+                Transaction.id,
+                Transaction.date,
+                Transaction.value,
+                Transaction.account_id,
+            ).where(Transaction.id.in_([row["id"] for row in rows]))
+        ).all()
+        table = Transaction.__table__
+        statement = self.db.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={
+                "date": statement.excluded.date,
+                "value": statement.excluded.value,
+                "account_id": statement.excluded.account_id,
+            },
+        )
+        session.execute(statement, rows)
+
+        for _, old_date, old_value, old_account_id in existing:
+            deltas.subtract(old_date, old_value, account_id=old_account_id)
+
+        self.log.debug(f"Batch of {len(rows)} transactions upserted")
+        return len(rows) - len(existing), len(existing)
+
+    def _update_or_insert_transaction(
+        self, id: int, date: date, value: float, account_id: str = DEFAULT_ACCOUNT
+    ):
         with self.db.session_local() as session:
-            transaction = session.get(Transaction, id)
-            if transaction:
-                self.log.debug(f"Transaction with id {id} found in DB. Updating...")
-                transaction.date = date
-                transaction.value = value
-            else:
-                self.log.debug(
-                    f"Transaction with id {id} not found in DB. Inserting..."
-                )
-                transaction = Transaction(id=id, date=date, value=value)
-            session.add(transaction)
+            self.aggregator.lock(session)
+            deltas = MonthlyAggregateDeltas()
+            self._upsert_batch(session, {id: (date, value, account_id)}, deltas)
+            self.aggregator.apply(session, deltas)
+            bump_data_version(self.db, session)
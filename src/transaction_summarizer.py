@@ -1,30 +1,384 @@
 #! /usr/bin/python3
 import logging
-from collections import defaultdict
+import re
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import date, timedelta
+from itertools import groupby
 from logging import Logger
-from typing import Any, Optional
+from operator import itemgetter
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Tuple
 
-from html2text import html2text
-from sqlalchemy import func, select
+from sqlalchemy import Select, case, func, or_, select
 
+from src import instrumentation
+from src.config import settings
 from src.db.db import DbAPI
-from src.email_gateway import EmailGateway
-from src.models import Transaction
+from src.models import MonthlyAggregate, Transaction
+from src.monthly_aggregates import (
+    AGGREGATE_COLUMNS,
+    aggregate_transactions_statement,
+)
+from src.summary_cache import SummaryCache, get_summary_cache, read_data_version
+from src.summary_renderer import render_summary
+
+if TYPE_CHECKING:
+    from src.email_gateway import EmailGateway
+
+
+@dataclass(frozen=True)
+class MonthSummary:
+    """Aggregates of the transactions within a single year and month."""
+
+    year: int
+    month: int
+    count: int
+    credit_sum: float
+    credit_count: int
+    debit_sum: float
+    debit_count: int
+    balance: float
+
+
+@dataclass(frozen=True)
+class TransactionSummary:
+    """Immutable summary of a set of transactions, aggregated by month.
+
+    Totals and averages are derived from the monthly aggregates.
+    """
+
+    months: Tuple[MonthSummary, ...] = ()
+
+    @property
+    def transactions_by_year_month(self) -> Dict[int, Dict[int, int]]:
+        transactions = {}
+        for month in self.months:
+            transactions.setdefault(month.year, {})[month.month] = month.count
+        return transactions
+
+    @property
+    def count(self) -> int:
+        return sum(month.count for month in self.months)
+
+    @property
+    def credit_sum(self) -> float:
+        return sum(month.credit_sum for month in self.months)
+
+    @property
+    def credit_count(self) -> int:
+        return sum(month.credit_count for month in self.months)
+
+    @property
+    def debit_sum(self) -> float:
+        return sum(month.debit_sum for month in self.months)
+
+    @property
+    def debit_count(self) -> int:
+        return sum(month.debit_count for month in self.months)
+
+    @property
+    def total_balance(self) -> float:
+        return sum(month.balance for month in self.months)
+
+    @property
+    def average_credit(self) -> float:
+        # if there are no credit transactions, then return 0 as the avg
+        return self.credit_sum / self.credit_count if self.credit_count else 0
+
+    @property
+    def average_debit(self) -> float:
+        # if there are no debit transactions, then return 0 as the avg
+        return self.debit_sum / self.debit_count if self.debit_count else 0
+
+
+def _shift_months(day: date, months: int) -> date:
+    """Returns the same day ``months`` months earlier, or the month's last day."""
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return date(year, month + 1, min(day.day, monthrange(year, month + 1)[1]))
+
+
+_LAST_MONTHS = re.compile(r"last-(\d+)-months?")
+
+
+@dataclass(frozen=True)
+class SummaryWindow:
+    """A range of dates to summarize, both ends included.
+
+    ``months`` is how many months earlier the previous window, which the
+    window is compared with, is; if 0, the previous window is the one of
+    the same length right before it.
+    """
+
+    start: date
+    end: date
+    months: int = 0
+
+    @classmethod
+    def between(cls, start: date, end: date) -> "SummaryWindow":
+        if end < start:
+            raise ValueError(f"The window ends ({end}) before it starts ({start})")
+        return cls(start, end)
+
+    @classmethod
+    def last_months(cls, months: int, today: Optional[date] = None) -> "SummaryWindow":
+        """The current month, up to today, and the ``months - 1`` before it."""
+        if months < 1:
+            raise ValueError(f"A window spans at least one month, got {months}")
+        today = today or date.today()
+        start = _shift_months(today.replace(day=1), months - 1)
+        return cls(start, today, months)
+
+    @classmethod
+    def year_to_date(cls, today: Optional[date] = None) -> "SummaryWindow":
+        """The current year, up to today, compared with the same dates last year."""
+        today = today or date.today()
+        return cls(today.replace(month=1, day=1), today, 12)
+
+    @classmethod
+    def parse(cls, spec: str, today: Optional[date] = None) -> "SummaryWindow":
+        """Parses ``ytd``, ``last-<N>-months`` or ``YYYY-MM-DD..YYYY-MM-DD``."""
+        spec = spec.strip().lower()
+        if spec == "ytd":
+            return cls.year_to_date(today)
+        last_months = _LAST_MONTHS.fullmatch(spec)
+        if last_months:
+            return cls.last_months(int(last_months.group(1)), today)
+        start, separator, end = spec.partition("..")
+        if not separator:
+            raise ValueError(f"Invalid summary window {spec!r}")
+        return cls.between(date.fromisoformat(start), date.fromisoformat(end))
+
+    def previous(self) -> "SummaryWindow":
+        """Returns the window this one is compared with."""
+        if self.months:
+            return SummaryWindow(
+                _shift_months(self.start, self.months),
+                _shift_months(self.end, self.months),
+                self.months,
+            )
+        length = self.end - self.start + timedelta(days=1)
+        return SummaryWindow(self.start - length, self.start - timedelta(days=1))
+
+
+@dataclass(frozen=True)
+class WindowSummary:
+    """Summary of the transactions within a window and, if compared, the previous one."""
+
+    window: SummaryWindow
+    current: TransactionSummary
+    previous: Optional[TransactionSummary] = None
 
 
 class TransactionSummarizer:
     """Class for giving information on the Transactions stored on the DB.
 
     A TransactionSummarizer object will perform queries on the DB to
-    return averages and balances.
+    return averages and balances. All figures come from a single
+    aggregate query, exposed through ``summary``; the ``get_*`` methods
+    are views over it. ``summaries_by_account`` computes the summary of
+    every account in a single query grouped by account, and
+    ``window_summary`` that of a window of dates, optionally compared with
+    the previous one.
     """
 
-    def __init__(self, db_api: Optional[DbAPI] = None, logger: Optional[Logger] = None):
+    def __init__(
+        self,
+        db_api: Optional[DbAPI] = None,
+        logger: Optional[Logger] = None,
+        use_aggregates: Optional[bool] = None,
+        cache: Optional[SummaryCache] = None,
+    ):
         self.log = logger or logging.getLogger(__name__)
-        self.email_gateway = EmailGateway(logger=self.log)
+        self._email_gateway = None
         self.db = db_api or DbAPI()
+        if use_aggregates is None:
+            use_aggregates = settings.get("use_monthly_aggregates", False)
+        self.use_aggregates = use_aggregates
+        self.partition_size = settings.get("summary_partition_size", 10000)
+        if cache is None and settings.get("summary_cache", False):
+            cache = get_summary_cache()
+        self.cache = cache
+        # The window of the summary email, e.g. "ytd"; every transaction if empty
+        self.email_window = settings.get("summary_window", "")
+        self.email_compare = settings.get("summary_compare", False)
+
+    @property
+    def email_gateway(self) -> "EmailGateway":
+        """The gateway for sending the summary, created on first use."""
+        if self._email_gateway is None:
+            # Imported here so that summarizing does not load the SMTP modules
+            from src.email_gateway import EmailGateway
+
+            self._email_gateway = EmailGateway(logger=self.log)
+        return self._email_gateway
+
+    def summary(
+        self, account_id: Optional[str] = None, use_cache: bool = True
+    ) -> "TransactionSummary":
+        """Returns a summary of the transactions stored in the DB.
 
-    def get_transactions_by_year_month(self) -> Any:
+        The number of transactions, the credit and debit sums and counts and
+        the balance are aggregated per year and month by a single query,
+        using conditional aggregates, so no transaction is loaded into
+        Python. If ``use_aggregates`` is set, they are read from the
+        monthly_aggregates table instead, which only has a row per account
+        and month.
+
+        If the summarizer has a cache, summaries are cached under the data
+        version they were computed at, so they are served until the next
+        ingest.
+
+        :param account_id: the account to summarize; all transactions are
+                           summarized if not given
+        :param use_cache: whether to look the summary up in, and store it
+                          into, the cache
+        :returns: a TransactionSummary of the transactions
+
+        """
+        statement = self.summary_statement(account_id)
+        use_cache = use_cache and self.cache is not None
+        with instrumentation.span(
+            "summarizer.summary"
+        ), self.db.session_local() as session:
+            if use_cache:
+                # Read before the summary, so that it is never cached under
+                # a version newer than the data it was computed from
+                version = read_data_version(session)
+                cached = self.cache.get(version, account_id)
+                if cached is not None:
+                    instrumentation.count("summarizer.cache_hits")
+                    return cached
+            months = tuple(MonthSummary(*row) for row in session.execute(statement))
+        summary = TransactionSummary(months=months)
+        if use_cache:
+            self.cache.set(version, account_id, summary)
+        return summary
+
+    def summaries_by_account(self) -> Iterator[Tuple[str, "TransactionSummary"]]:
+        """Yields the id and summary of every account, ordered by account id.
+
+        Every summary comes from a single query grouped by account, year
+        and month. Its rows are streamed in partitions of
+        ``summary_partition_size`` (with a server-side cursor on
+        PostgreSQL), so only the months of the account being yielded are
+        held in memory, however many accounts there are.
+
+        :returns: an iterator of (account id, TransactionSummary) pairs
+
+        """
+        statement = self.summary_statement(by_account=True).execution_options(
+            yield_per=self.partition_size
+        )
+        with self.db.session_local() as session:
+            rows = session.execute(statement)
+            for account_id, account_rows in groupby(rows, key=itemgetter(0)):
+                months = tuple(MonthSummary(*row[1:]) for row in account_rows)
+                instrumentation.count("summarizer.accounts")
+                yield account_id, TransactionSummary(months=months)
+
+    def summary_statement(
+        self, account_id: Optional[str] = None, by_account: bool = False
+    ) -> Select:
+        """Returns the query behind ``summary`` and ``summaries_by_account``.
+
+        :param account_id: the account to restrict the query to, if any
+        :param by_account: whether to also group by account, with rows
+                           starting with the account id
+        :returns: a Select of per month rows, in the order of MonthSummary
+
+        """
+        statement = self._monthly_statement(by_account)
+        if account_id is not None:
+            account_column = (
+                MonthlyAggregate.account_id
+                if self.use_aggregates
+                else Transaction.account_id
+            )
+            statement = statement.where(account_column == account_id)
+        return statement
+
+    def window_summary(
+        self,
+        window: SummaryWindow,
+        account_id: Optional[str] = None,
+        compare: bool = False,
+    ) -> WindowSummary:
+        """Returns a summary of the transactions within the window.
+
+        Transactions are filtered by date in the query, so it is answered
+        with a range scan of the date index and its latency grows with the
+        size of the window rather than that of the table. The summary of
+        the previous window, if compared, comes from the same query. The
+        transactions table is always read, since monthly aggregates can't
+        cover windows ending mid-month.
+
+        :param window: the window of dates to summarize
+        :param account_id: the account to summarize; all transactions are
+                           summarized if not given
+        :param compare: whether to also summarize the previous window
+        :returns: a WindowSummary of the window and, if compared, the previous one
+
+        """
+        statement = self.window_statement(window, account_id, compare)
+        with instrumentation.span(
+            "summarizer.window_summary"
+        ), self.db.session_local() as session:
+            rows = session.execute(statement).all()
+        if not compare:
+            months = tuple(MonthSummary(*row) for row in rows)
+            return WindowSummary(window, TransactionSummary(months=months))
+        periods: Tuple[list, list] = ([], [])
+        for period, *row in rows:
+            periods[period].append(MonthSummary(*row))
+        current, previous = (TransactionSummary(tuple(months)) for months in periods)
+        return WindowSummary(window, current, previous)
+
+    def window_statement(
+        self,
+        window: SummaryWindow,
+        account_id: Optional[str] = None,
+        compare: bool = False,
+    ) -> Select:
+        """Returns the query behind ``window_summary``.
+
+        :returns: a Select of per month rows, in the order of MonthSummary;
+                  if compared, each one starts with 0 for the window's months
+                  and 1 for the previous one's
+
+        """
+        in_window = Transaction.date.between(window.start, window.end)
+        leading_keys = []
+        if compare:
+            previous = window.previous()
+            leading_keys.append(case((Transaction.date >= window.start, 0), else_=1))
+            in_window = or_(
+                in_window, Transaction.date.between(previous.start, previous.end)
+            )
+        statement = aggregate_transactions_statement(leading_keys=leading_keys)
+        statement = statement.where(in_window)
+        if account_id is not None:
+            statement = statement.where(Transaction.account_id == account_id)
+        return statement
+
+    def _monthly_statement(self, by_account: bool) -> Select:
+        if not self.use_aggregates:
+            return aggregate_transactions_statement(by_account=by_account)
+        keys = [MonthlyAggregate.year, MonthlyAggregate.month]
+        if by_account:
+            keys.insert(0, MonthlyAggregate.account_id)
+        aggregate_columns = [
+            func.sum(getattr(MonthlyAggregate, column)) for column in AGGREGATE_COLUMNS
+        ]
+        # Months whose transactions were all moved or deleted keep a row
+        # of zeros, which is skipped
+        return (
+            select(*keys, *aggregate_columns)
+            .group_by(*keys)
+            .having(func.sum(MonthlyAggregate.count) != 0)
+            .order_by(*keys)
+        )
+
+    def get_transactions_by_year_month(self) -> Dict[int, Dict[int, int]]:
         """Returns a dictionary with the number of transactions sorted by year and month.
         For example:
         {
@@ -40,13 +394,7 @@ class TransactionSummarizer:
         :returns: A dictionary with the number transactions sorted by year and month
 
         """
-
-        with self.db.session_local() as session:
-            transactions = session.scalars(select(Transaction)).all()
-            parsed_transactions = defaultdict(lambda: defaultdict(int))
-            for transaction in transactions:
-                parsed_transactions[transaction.date.year][transaction.date.month] += 1
-            return parsed_transactions
+        return self.summary().transactions_by_year_month
 
     def get_total_balance(self) -> float:
         """Returns the total balance of all transactions within the DB
@@ -54,9 +402,7 @@ class TransactionSummarizer:
         :returns: a float of the total balance of all transactions
 
         """
-        with self.db.session_local() as session:
-            total_balance = session.scalars(select(func.sum(Transaction.value))).one()
-            return total_balance
+        return self.summary().total_balance
 
     def get_average_debit(self) -> float:
         """Returns the average value of all debit transactions.
@@ -65,14 +411,7 @@ class TransactionSummarizer:
         :returns: a float of the average of negative-valued transactions
 
         """
-        with self.db.session_local() as session:
-            average_debit = (
-                session.scalars(
-                    select(func.avg(Transaction.value)).where(Transaction.value < 0)
-                ).one()
-                or 0  # if there are no transactions with value < 0, then return 0 as the avg
-            )
-            return average_debit
+        return self.summary().average_debit
 
     def get_average_credit(self) -> float:
         """Returns the average value of all credit transactions.
@@ -81,27 +420,26 @@ class TransactionSummarizer:
         :returns: a float of the average of positive-valued transactions
 
         """
-        with self.db.session_local() as session:
-            average_credit = (
-                session.scalars(
-                    select(func.avg(Transaction.value)).where(Transaction.value > 0)
-                ).one()
-                or 0  # if there are no transactions with value > 0, then return 0 as the avg
-            )
-            return average_credit
+        return self.summary().average_credit
 
     def send_summary_email(self, to, email_subject) -> None:
         """Sends an email with a summary of the transactions stored in DB.
 
+        Only the transactions within the ``summary_window`` setting are
+        summarized if it is set, compared with the previous window if
+        ``summary_compare`` is set too.
+
         :returns: None
 
         """
-
-        # Importing here to avoid circular imports
-        from src.email_composer import EmailComposer
-
-        email_composer = EmailComposer()
-        html = email_composer.compose_html_summary()
-        text = html2text(html)
-
-        self.email_gateway.send_email(to, email_subject, text, html)
+        if self.email_window:
+            window = SummaryWindow.parse(self.email_window)
+            summary = self.window_summary(window, compare=self.email_compare)
+            rendered = render_summary(
+                summary.current, window=window, previous=summary.previous
+            )
+        else:
+            rendered = render_summary(self.summary())
+        self.email_gateway.send_email(
+            to, email_subject, rendered.plaintext, rendered.html
+        )
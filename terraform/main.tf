@@ -106,10 +106,63 @@ resource "aws_lambda_function" "lambda" {
   }
 }
 
+# Applies the DB migrations, once per deployment rather than on cold starts
+resource "aws_lambda_function" "migrations" {
+  function_name    = "transaction-summarizer-migrations"
+  handler          = "src.db.migrations.handle"
+  runtime          = "python3.11"
+  timeout          = 300 # 5 minutes
+  filename         = data.archive_file.code.output_path
+  source_code_hash = data.archive_file.code.output_base64sha256
+  role             = aws_iam_role.lambda_role.arn
+  layers           = [aws_lambda_layer_version.layer.arn]
+}
+
+resource "aws_lambda_invocation" "migrations" {
+  function_name = aws_lambda_function.migrations.function_name
+  input         = jsonencode({})
+  triggers = {
+    code = data.archive_file.code.output_base64sha256
+  }
+}
+
+# Sends the summary emails queued when email_delivery = "outbox"
+resource "aws_lambda_function" "outbox_drainer" {
+  function_name    = "transaction-summarizer-outbox-drainer"
+  handler          = "src.outbox.handle"
+  runtime          = "python3.11"
+  timeout          = 300 # 5 minutes
+  filename         = data.archive_file.code.output_path
+  source_code_hash = data.archive_file.code.output_base64sha256
+  role             = aws_iam_role.lambda_role.arn
+  layers           = [aws_lambda_layer_version.layer.arn]
+}
+
+resource "aws_cloudwatch_event_rule" "outbox_drainer" {
+  name                = "transaction-summarizer-outbox-drainer"
+  schedule_expression = "rate(1 minute)"
+}
+
+resource "aws_cloudwatch_event_target" "outbox_drainer" {
+  rule = aws_cloudwatch_event_rule.outbox_drainer.name
+  arn  = aws_lambda_function.outbox_drainer.arn
+}
+
+resource "aws_lambda_permission" "outbox_drainer" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.outbox_drainer.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.outbox_drainer.arn
+}
+
 # Setup API Gateway
 
 resource "aws_api_gateway_rest_api" "TransactionSummarizerAPI" {
   name = "TransactionSummarizerAPI"
+  # Uploads are passed to the Lambda base64-encoded, so that compressed
+  # files are not mangled by being treated as text
+  binary_media_types = ["multipart/form-data"]
 }
 
 resource "aws_api_gateway_resource" "TransactionSummarizerAPI" {
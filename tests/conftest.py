@@ -1,10 +1,15 @@
 #! /usr/bin/python3
 
+import os
+import socket
 from datetime import date
 from typing import List
 
-from pytest import fixture
+from pytest import fixture, importorskip, skip
+from src.config import settings
 from src.db.db import DbAPI
+from src.db.migrations import migrate
+from src.email_gateway import close_pools
 from src.models import Base, Transaction
 
 
@@ -12,7 +17,19 @@ from src.models import Base, Transaction
 def db():
     db = DbAPI()
     Base.metadata.drop_all(bind=db.engine)
-    Base.metadata.create_all(db.engine)
+    migrate(db)
+    return db
+
+
+@fixture
+def postgres_db():
+    """A DbAPI for the PostgreSQL DB at TEST_POSTGRESQL_URL, skipped without one."""
+    db_url = os.environ.get("TEST_POSTGRESQL_URL")
+    if not db_url:
+        skip("TEST_POSTGRESQL_URL is not set")
+    db = DbAPI(db_url)
+    Base.metadata.drop_all(bind=db.engine)
+    migrate(db)
     return db
 
 
@@ -37,3 +54,44 @@ def seed_db(db: DbAPI, transactions: List[Transaction]):
         session.expire_on_commit = False
         session.add_all(transactions)
         session.commit()
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("rejected@"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+@fixture
+def smtp_server():
+    """A local stand-in SMTP server, without TLS or authentication."""
+    controller_module = importorskip("aiosmtpd.controller")
+    handler = RecordingHandler()
+    with socket.socket() as free_port:
+        free_port.bind(("127.0.0.1", 0))
+        port = free_port.getsockname()[1]
+    controller = controller_module.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    previous = {
+        key: settings.get(key)
+        for key in ("smtp_server", "smtp_port", "smtp_ssl", "sender_email_password")
+    }
+    settings.set("smtp_server", controller.hostname)
+    settings.set("smtp_port", port)
+    settings.set("smtp_ssl", False)
+    settings.set("sender_email_password", "")
+    close_pools()
+    yield controller, handler
+    close_pools()
+    controller.stop()
+    for key, value in previous.items():
+        settings.set(key, value)
@@ -0,0 +1,208 @@
+#! /usr/bin/python3
+import base64
+import gzip
+import subprocess
+import sys
+from pathlib import Path
+
+from pytest import fixture
+from sqlalchemy import select
+from src.app import cli, handle
+from src.config import settings
+from src.models import IngestRecord, Transaction
+from src.transaction_summarizer import TransactionSummarizer
+
+BOUNDARY = "----boundary"
+CSV = b"id,date,transaction\n1,2021/01/01,+10\n2,2021/01/02,-5\n"
+
+
+def multipart_event(content: bytes, part_headers: str = "", base64_encoded=False):
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="input.csv"\r\n'
+        f"{part_headers}\r\n"
+    ).encode()
+    body += content + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return {
+        "headers": {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+        "body": base64.b64encode(body).decode() if base64_encoded else body.decode(),
+        "isBase64Encoded": base64_encoded,
+    }
+
+
+@fixture
+def sent_emails(monkeypatch):
+    sent = []
+    monkeypatch.setattr(
+        TransactionSummarizer,
+        "send_summary_email",
+        lambda self, to, subject: sent.append((to, subject)),
+    )
+    return sent
+
+
+class TestHandle:
+    def test_plain_csv(self, db, sent_emails):
+        # When
+        response = handle(multipart_event(CSV), None)
+
+        # Then
+        assert response["statusCode"] == 200
+        assert len(sent_emails) == 1
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 10
+
+    def test_gzip_csv_base64_encoded(self, db, sent_emails):
+        # Given
+        event = multipart_event(
+            gzip.compress(CSV),
+            "Content-Type: application/gzip\r\n",
+            base64_encoded=True,
+        )
+
+        # When
+        response = handle(event, None)
+
+        # Then
+        assert response["statusCode"] == 200
+        with db.session_local() as session:
+            assert session.get(Transaction, 2).value == -5
+
+    def test_corrupt_gzip_is_a_bad_request(self, db, sent_emails):
+        # Given
+        event = multipart_event(
+            gzip.compress(CSV)[:-20],
+            "Content-Encoding: gzip\r\n",
+            base64_encoded=True,
+        )
+
+        # When
+        response = handle(event, None)
+
+        # Then
+        assert response["statusCode"] == 400
+        assert sent_emails == []
+
+    def test_missing_file_part(self, db, sent_emails):
+        # Given
+        event = multipart_event(CSV)
+        event["body"] = event["body"].replace('name="file"', 'name="other"')
+
+        # When
+        response = handle(event, None)
+
+        # Then
+        assert response["statusCode"] == 400
+
+
+class TestIdempotency:
+    def test_identical_upload_is_skipped(self, db, sent_emails):
+        # Given
+        handle(multipart_event(CSV), None)
+        with db.session_local() as session:
+            session.get(Transaction, 1).value = 99
+
+        # When
+        response = handle(multipart_event(CSV), None)
+
+        # Then
+        assert response["statusCode"] == 200
+        assert len(sent_emails) == 2
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 99
+            records = session.scalars(select(IngestRecord)).all()
+            assert [(r.status, r.inserted) for r in records] == [("completed", 2)]
+
+    def test_identical_upload_can_skip_the_email(self, db, sent_emails):
+        # Given
+        handle(multipart_event(CSV), None)
+        settings.set("ingest_skip_duplicate_email", True)
+
+        # When
+        try:
+            response = handle(multipart_event(CSV), None)
+        finally:
+            settings.set("ingest_skip_duplicate_email", False)
+
+        # Then
+        assert response["statusCode"] == 200
+        assert len(sent_emails) == 1
+
+    def test_failed_ingest_is_not_done(self, db, sent_emails):
+        # Given
+        malformed = CSV + b"3,2021-01-03,+1\n"
+        handle(multipart_event(malformed), None)
+
+        # When
+        response = handle(multipart_event(malformed), None)
+
+        # Then
+        assert response["statusCode"] == 400
+        with db.session_local() as session:
+            records = session.scalars(select(IngestRecord)).all()
+            assert [r.status for r in records] == ["failed", "failed"]
+
+
+class TestCli:
+    def test_batch_sends_a_single_summary(
+        self, db, sent_emails, tmp_path, monkeypatch, capsys
+    ):
+        # Given
+        for day in (1, 2, 3):
+            (tmp_path / f"day-{day}.csv").write_bytes(
+                b"id,date,transaction\n1,2021/01/0%d,+%d\n" % (day, day)
+            )
+        monkeypatch.setattr(sys, "argv", ["app", str(tmp_path / "day-*.csv")])
+
+        # When
+        cli()
+
+        # Then
+        assert len(sent_emails) == 1
+        output = capsys.readouterr().out
+        assert "day-2.csv: 1 rows" in output
+        assert "3 files, 3 rows ingested" in output
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 3
+
+    def test_batch_of_duplicates_can_skip_the_email(
+        self, db, sent_emails, tmp_path, monkeypatch
+    ):
+        # Given
+        (tmp_path / "day-1.csv").write_bytes(CSV)
+        (tmp_path / "day-2.csv").write_bytes(CSV.replace(b"+10", b"+20"))
+        monkeypatch.setattr(sys, "argv", ["app", str(tmp_path)])
+        cli()
+        settings.set("ingest_skip_duplicate_email", True)
+
+        # When
+        try:
+            cli()
+        finally:
+            settings.set("ingest_skip_duplicate_email", False)
+
+        # Then
+        assert len(sent_emails) == 1
+
+
+class TestImportTime:
+    def test_import_does_not_load_db_or_smtp_modules(self):
+        # Given
+        lazy = {"sqlalchemy", "psycopg2", "numpy", "zstandard", "ssl", "smtplib"}
+
+        # When
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import src.app"],
+            cwd=Path(__file__).parents[1],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        # Then
+        # Lines are "import time: self [us] | cumulative | imported package"
+        imports = [line.split("|") for line in process.stderr.splitlines()[1:]]
+        imported = {name.strip().split(".")[0] for _, _, name in imports}
+        slowest = sorted(imports, key=lambda row: int(row[1]), reverse=True)[:10]
+        report = "\n".join("|".join(row) for row in slowest)
+        assert not imported & lazy, f"slowest imports:\n{report}"
@@ -0,0 +1,156 @@
+#! /usr/bin/python3
+import gzip
+import logging
+import shutil
+from datetime import date
+from pathlib import Path
+
+from pytest import fixture, raises
+from sqlalchemy import select
+from src.batch_ingest import BatchIngest, expand_paths, is_batch
+from src.models import Transaction
+from src.monthly_aggregates import MonthlyAggregator
+from src.transaction_seeder import (
+    IngestResult,
+    MalformedInputFileError,
+    TransactionSeeder,
+)
+
+LOGGER = logging.getLogger(__name__)
+HEADER = "id,date,transaction\n"
+# The sample file shipped with the repo, whose days are not zero-padded
+SAMPLE_FILE = Path(__file__).parent.parent / "input.csv"
+
+
+@fixture
+def daily_files(tmp_path):
+    # Every file updates the transaction 1 of the previous one
+    for day in range(1, 6):
+        rows = [f"1,2021/01/{day:02d},{day}", f"{day + 1},2021/01/{day:02d},-1"]
+        (tmp_path / f"2021-01-{day:02d}.csv").write_text(HEADER + "\n".join(rows))
+    return tmp_path
+
+
+class TestExpandPaths:
+    def test_directories_and_patterns_are_sorted(self, daily_files):
+        # Given
+        first = str(daily_files / "2021-01-05.csv")
+
+        # When
+        paths = expand_paths(
+            [first, str(daily_files), str(daily_files / "*-0[12].csv")]
+        )
+
+        # Then
+        names = [path.rsplit("/", 1)[-1] for path in paths]
+        assert names == [f"2021-01-0{day}.csv" for day in (5, 1, 2, 3, 4)]
+
+    def test_unmatched_pattern_raises(self, tmp_path):
+        # When
+        with raises(FileNotFoundError):
+            expand_paths([str(tmp_path / "*.csv")])
+
+    def test_single_file_is_not_a_batch(self, daily_files):
+        assert not is_batch([str(daily_files / "2021-01-01.csv")])
+        assert not is_batch(["-"])
+        assert is_batch([str(daily_files)])
+        assert is_batch([str(daily_files / "*.csv")])
+        assert is_batch(["a.csv", "b.csv"])
+
+
+class TestBatchIngest:
+    def test_later_files_win(self, db, daily_files):
+        # Given
+        paths = expand_paths([str(daily_files)])
+
+        # When
+        reports = BatchIngest(dbapi=db, logger=LOGGER, workers=2).run(paths)
+
+        # Then
+        assert [report.path for report in reports] == paths
+        assert [report.result for report in reports] == [
+            IngestResult(inserted=2, updated=0),
+            *[IngestResult(inserted=1, updated=1)] * 4,
+        ]
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 5
+        assert MonthlyAggregator(dbapi=db).check_consistency() == []
+
+    def test_compressed_files_are_ingested(self, db, tmp_path):
+        # Given
+        path = tmp_path / "input.csv.gz"
+        path.write_bytes(gzip.compress((HEADER + "7,2021/03/04,+12\n").encode()))
+
+        # When
+        reports = BatchIngest(dbapi=db, logger=LOGGER).run([str(path)])
+
+        # Then
+        assert reports[0].rows == 1
+        with db.session_local() as session:
+            assert session.get(Transaction, 7).value == 12
+
+    def test_sample_file_is_ingested_as_in_single_file_mode(self, db, tmp_path):
+        # Given
+        shutil.copy(SAMPLE_FILE, tmp_path / "a.csv")
+        (tmp_path / "b.csv").write_text(HEADER + "100,2022/7/9,+1\n")
+        single = TransactionSeeder(dbapi=db).parse_file(
+            SAMPLE_FILE.read_text().split("\n")
+        )
+        with db.session_local() as session:
+            expected = {
+                t.id: (t.date, t.value) for t in session.scalars(select(Transaction))
+            }
+
+        # When
+        reports = BatchIngest(dbapi=db, logger=LOGGER, force=True).run(
+            expand_paths([str(tmp_path)])
+        )
+
+        # Then
+        assert reports[0].result == IngestResult(inserted=0, updated=single.inserted)
+        with db.session_local() as session:
+            transactions = {
+                t.id: (t.date, t.value) for t in session.scalars(select(Transaction))
+            }
+        assert transactions == {**expected, 100: (date(2022, 7, 9), 1)}
+
+    def test_applied_files_are_skipped_when_run_again(self, db, daily_files):
+        # Given
+        paths = expand_paths([str(daily_files)])
+        BatchIngest(dbapi=db, logger=LOGGER).run(paths[:2])
+
+        # When
+        reports = BatchIngest(dbapi=db, logger=LOGGER).run(paths)
+
+        # Then
+        assert [report.skipped for report in reports] == [True] * 2 + [False] * 3
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 5
+
+    def test_malformed_file_stops_the_batch(self, db, daily_files):
+        # Given
+        (daily_files / "2021-01-03.csv").write_text(HEADER + "9,2021-01-03,+1\n")
+        paths = expand_paths([str(daily_files)])
+
+        # When
+        with raises(MalformedInputFileError) as error:
+            BatchIngest(dbapi=db, logger=LOGGER, workers=2).run(paths)
+
+        # Then
+        assert "2021-01-03.csv" in str(error.value)
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 2
+            assert session.get(Transaction, 6) is None
+
+    def test_file_that_is_not_utf8_stops_the_batch(self, db, daily_files):
+        # Given
+        (daily_files / "2021-01-03.csv").write_bytes(HEADER.encode() + b"9,\xff\n")
+        paths = expand_paths([str(daily_files)])
+
+        # When
+        with raises(MalformedInputFileError) as error:
+            BatchIngest(dbapi=db, logger=LOGGER).run(paths)
+
+        # Then
+        assert "2021-01-03.csv" in str(error.value)
+        assert "UTF-8" in str(error.value)
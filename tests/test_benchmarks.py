@@ -0,0 +1,29 @@
+#! /usr/bin/python3
+from benchmarks.generate import generate_rows
+from benchmarks.run import compare
+
+
+class TestBenchmarks:
+    def test_generate_rows(self):
+        # When
+        lines = list(generate_rows(1000, duplicate_ratio=0.2, accounts=3, seed=1))
+
+        # Then
+        assert lines[0] == "id,date,transaction,account\n"
+        assert len(lines) == 1001
+        ids = [line.split(",")[0] for line in lines[1:]]
+        assert 700 < len(set(ids)) < 900
+        assert lines == list(
+            generate_rows(1000, duplicate_ratio=0.2, accounts=3, seed=1)
+        )
+
+    def test_compare(self):
+        # Given
+        baseline = {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}}
+        results = {"a": {"seconds": 1.1}, "b": {"seconds": 1.5}, "c": {"seconds": 9}}
+
+        # When
+        regressions = compare(results, baseline, threshold=0.2)
+
+        # Then
+        assert regressions == ["b: +50.0% slower than the baseline"]
@@ -0,0 +1,336 @@
+#! /usr/bin/python3
+import logging
+from datetime import date, timedelta
+
+from pytest import fixture, raises
+from sqlalchemy import func, select
+from src import chunked_ingest
+from src.chunked_ingest import (
+    ChunkedIngest,
+    ChunkedIngestError,
+    _first_lines,
+    handle,
+    ingest_file,
+)
+from src.ingest_log import IngestLog, content_hash
+from src.models import (
+    IngestChunk,
+    IngestJob,
+    OutboxEmail,
+    StagedTransaction,
+    Transaction,
+    utcnow,
+)
+from src.monthly_aggregates import MonthlyAggregator
+from src.parallel_parsing import split_file
+from src.transaction_seeder import IngestResult, MalformedInputFileError
+from src.transaction_summarizer import TransactionSummarizer
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _csv_file(tmp_path, rows, header="id,date,transaction"):
+    path = tmp_path / "input.csv"
+    path.write_text("\n".join([header, *rows]) + "\n")
+    return str(path)
+
+
+def _file_hash(path):
+    with open(path, "rb") as file:
+        return content_hash([file.read()])
+
+
+@fixture
+def sent_emails(monkeypatch):
+    sent = []
+    monkeypatch.setattr(
+        TransactionSummarizer,
+        "send_summary_email",
+        lambda self, to, subject: sent.append((to, subject)),
+    )
+    return sent
+
+
+@fixture
+def large_file(tmp_path):
+    # Ids repeat every 100 rows, so later chunks update earlier ones
+    rows = [f"{i % 100 + 1},2021/{i % 12 + 1:02d}/15,{i}" for i in range(1, 401)]
+    return _csv_file(tmp_path, rows)
+
+
+class FakeContext:
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+class TestChunkedIngest:
+    def test_first_lines_of_ranges(self, large_file):
+        # Given
+        header, ranges = split_file(large_file, 4)
+
+        # When
+        first_lines = _first_lines(large_file, ranges)
+
+        # Then
+        with open(large_file) as file:
+            lines = file.read().split("\n")
+        for (start, _), first_line in zip(ranges, first_lines):
+            with open(large_file, "rb") as file:
+                file.seek(start)
+                assert file.readline().decode().rstrip("\n") == lines[first_line - 1]
+
+    def test_file_is_ingested_in_chunks(self, db, large_file):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER, chunk_bytes=1024)
+        job = ingest.plan(large_file, _file_hash(large_file))
+
+        # When
+        pending = ingest.run(job.id)
+        result = ingest.merge(job.id)
+
+        # Then
+        assert pending == 0
+        assert len(ingest.pending_chunks(job.id)) == 0
+        assert result == IngestResult(inserted=100, updated=0)
+        with db.session_local() as session:
+            assert session.scalar(select(func.count(IngestChunk.number))) > 1
+            assert session.get(Transaction, 2).value == 301
+            assert session.get(Transaction, 2).date == date(2021, 2, 15)
+            assert session.scalar(select(func.count(StagedTransaction.id))) == 0
+        assert MonthlyAggregator(dbapi=db).check_consistency() == []
+        assert IngestLog(dbapi=db).find_completed(job.content_hash) is None
+        assert ingest.complete(job.id, lambda: None)
+        assert IngestLog(dbapi=db).find_completed(job.content_hash).inserted == 100
+
+    def test_interrupted_job_resumes_without_redoing_chunks(
+        self, db, large_file, monkeypatch
+    ):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER, chunk_bytes=1024)
+        job = ingest.plan(large_file, _file_hash(large_file))
+        chunks = ingest.pending_chunks(job.id)
+        process_chunk = ChunkedIngest.process_chunk
+        processed = []
+
+        def crashing(self, job_id, number):
+            if number == chunks[2] and not processed.count(number):
+                processed.append(number)
+                raise RuntimeError("Task timed out")
+            processed.append(number)
+            return process_chunk(self, job_id, number)
+
+        monkeypatch.setattr(ChunkedIngest, "process_chunk", crashing)
+        with raises(RuntimeError):
+            ingest.run(job.id)
+
+        # When
+        resumed = ingest.plan(large_file, job.content_hash)
+        pending = ingest.run(resumed.id)
+
+        # Then
+        assert resumed.id == job.id
+        assert pending == 0
+        assert processed == [*chunks[:3], *chunks[2:]]
+        assert ingest.merge(job.id) == IngestResult(inserted=100, updated=0)
+
+    def test_committed_chunk_is_not_staged_twice(self, db, large_file):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER, chunk_bytes=1024)
+        job = ingest.plan(large_file, _file_hash(large_file))
+
+        # When
+        first = ingest.process_chunk(job.id, 0)
+        second = ingest.process_chunk(job.id, 0)
+
+        # Then
+        assert (first, second) == (True, False)
+        with db.session_local() as session:
+            staged = session.scalar(select(func.count(StagedTransaction.id)))
+            assert staged == session.get(IngestChunk, (job.id, 0)).rows
+
+    def test_job_is_not_merged_while_chunks_are_pending(self, db, large_file):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER, chunk_bytes=1024)
+        job = ingest.plan(large_file, _file_hash(large_file))
+        ingest.process_chunk(job.id, 0)
+
+        # When
+        with raises(ChunkedIngestError):
+            ingest.merge(job.id)
+
+        # Then
+        with db.session_local() as session:
+            assert session.scalar(select(func.count(Transaction.id))) == 0
+
+    def test_malformed_chunk_fails_with_file_line_numbers(self, db, tmp_path):
+        # Given
+        rows = [f"{i},2021/01/15,{i}" for i in range(1, 201)]
+        rows[149] = "150,2021-01-15,150"
+        path = _csv_file(tmp_path, rows)
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER, chunk_bytes=1024)
+        job = ingest.plan(path, _file_hash(path))
+
+        # When
+        with raises(MalformedInputFileError) as error:
+            ingest.run(job.id)
+
+        # Then
+        assert "(lines 151)" in str(error.value)
+        with db.session_local() as session:
+            failed = session.scalars(
+                select(IngestChunk).where(IngestChunk.status == "failed")
+            ).all()
+            assert [chunk.error for chunk in failed] == [str(error.value)]
+
+    def test_chunks_are_processed_by_a_process_pool(self, db, large_file):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER, chunk_bytes=2048)
+        job = ingest.plan(large_file, _file_hash(large_file))
+
+        # When
+        pending = ingest.run(job.id, workers=2)
+
+        # Then
+        assert pending == 0
+        assert ingest.merge(job.id) == IngestResult(inserted=100, updated=0)
+        with db.session_local() as session:
+            assert session.get(Transaction, 2).value == 301
+
+
+class TestIngestFile:
+    def test_summary_email_is_sent_once(self, db, large_file, sent_emails):
+        # Given
+        ingest_file(large_file, LOGGER)
+
+        # When
+        ChunkedIngest(dbapi=db).complete(1, lambda: sent_emails.append("again"))
+        ingest_file(large_file, LOGGER)
+
+        # Then
+        # The second upload is a duplicate, whose summary is sent as usual
+        assert len(sent_emails) == 2
+        assert "again" not in sent_emails
+        with db.session_local() as session:
+            assert session.get(IngestJob, 1).status == "completed"
+
+    def test_failed_delivery_leaves_the_job_to_complete(self, db, large_file):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER)
+        job = ingest.plan(large_file, _file_hash(large_file))
+        ingest.run(job.id)
+        ingest.merge(job.id)
+
+        def failing():
+            raise RuntimeError("SMTP is down")
+
+        # When
+        with raises(RuntimeError):
+            ingest.complete(job.id, failing)
+        completed = ingest.complete(job.id, lambda: None)
+
+        # Then
+        assert completed
+        assert not ingest.complete(job.id, lambda: None)
+
+    def test_summary_email_is_sent_by_the_next_run_after_a_failure(
+        self, db, large_file, sent_emails, monkeypatch
+    ):
+        # Given
+        chunked_ingest.settings.set("ingest_skip_duplicate_email", True)
+        send_summary_email = TransactionSummarizer.send_summary_email
+
+        def failing(self, to, subject):
+            raise OSError("SMTP is down")
+
+        monkeypatch.setattr(TransactionSummarizer, "send_summary_email", failing)
+        try:
+            with raises(OSError):
+                ingest_file(large_file, LOGGER)
+            monkeypatch.setattr(
+                TransactionSummarizer, "send_summary_email", send_summary_email
+            )
+
+            # When
+            pending = ingest_file(large_file, LOGGER)
+        finally:
+            chunked_ingest.settings.set("ingest_skip_duplicate_email", False)
+
+        # Then
+        assert pending == 0
+        assert len(sent_emails) == 1
+        with db.session_local() as session:
+            assert session.get(IngestJob, 1).status == "completed"
+        assert IngestLog(dbapi=db).find_completed(_file_hash(large_file)) is not None
+
+    def test_summary_email_is_queued_in_the_outbox(self, db, large_file):
+        # Given
+        chunked_ingest.settings.set("email_delivery", "outbox")
+
+        # When
+        try:
+            ingest_file(large_file, LOGGER)
+        finally:
+            chunked_ingest.settings.set("email_delivery", "sync")
+
+        # Then
+        with db.session_local() as session:
+            assert session.scalar(select(func.count(OutboxEmail.id))) == 1
+            assert session.get(IngestJob, 1).status == "completed"
+
+    def test_stale_claim_is_completed_again(self, db, large_file):
+        # Given
+        ingest = ChunkedIngest(dbapi=db, logger=LOGGER)
+        job = ingest.plan(large_file, _file_hash(large_file))
+        ingest.run(job.id)
+        ingest.merge(job.id)
+
+        # The claim of a worker that died while delivering the email
+        with db.session_local() as session:
+            claimed = session.get(IngestJob, job.id)
+            claimed.status = "completing"
+            claimed.finished_at = utcnow() - timedelta(minutes=1)
+        fresh = ingest.complete(job.id, lambda: None)
+
+        # When
+        with db.session_local() as session:
+            claimed = session.get(IngestJob, job.id)
+            claimed.finished_at -= chunked_ingest.COMPLETION_LEASE
+        completed = ingest.complete(job.id, lambda: None)
+
+        # Then
+        assert not fresh
+        assert completed
+        with db.session_local() as session:
+            assert session.get(IngestJob, job.id).status == "completed"
+
+    def test_handler_stops_at_the_deadline(self, db, large_file, sent_emails):
+        # Given
+        chunked_ingest.settings.set("ingest_chunk_bytes", 1024)
+        event = {"path": large_file}
+
+        # When
+        try:
+            # Less time remains than a chunk is expected to take
+            first = handle(event, FakeContext(remaining_millis=1000))
+            second = handle(event, FakeContext(remaining_millis=120_000))
+        finally:
+            chunked_ingest.settings.set(
+                "ingest_chunk_bytes", chunked_ingest.CHUNK_BYTES
+            )
+
+        # Then
+        assert first["statusCode"] == 202
+        assert second["statusCode"] == 200
+        assert len(sent_emails) == 1
+        with db.session_local() as session:
+            assert session.scalar(select(func.count(Transaction.id))) == 100
+
+    def test_handler_requires_a_path(self, db):
+        # When
+        response = handle({}, FakeContext(remaining_millis=120_000))
+
+        # Then
+        assert response["statusCode"] == 400
@@ -0,0 +1,180 @@
+#! /usr/bin/python3
+from csv import reader
+from datetime import date
+
+import numpy as np
+from pytest import mark, raises
+from src.columnar import ColumnarParseError, parse_columns
+from src.models import Transaction
+from src.monthly_aggregates import MonthlyAggregator
+from src.transaction_seeder import MalformedInputFileError, TransactionSeeder
+
+
+class TestParseColumns:
+    def test_parse_columns(self):
+        # Given
+        lines = [
+            "date,id,transaction\r\n",
+            "2021/07/09,1,-60.5\r\n",
+            "\r\n",
+            "2022/07/10,2,+60.5\r\n",
+            "2023/10/14,1,0\r\n",
+        ]
+
+        # When
+        batches = list(parse_columns(lines, chunk_rows=2))
+
+        # Then
+        assert [len(batch) for batch in batches] == [1, 2]
+        assert batches[1].ids.dtype == np.int64
+        assert batches[1].values.tolist() == [60.5, 0]
+        assert batches[1].dates.astype(object).tolist() == [
+            date(2022, 7, 10),
+            date(2023, 10, 14),
+        ]
+
+    @mark.parametrize(
+        "row",
+        [
+            "0,2021/07/09,1",
+            "-3,2021/07/09,1",
+            "1,2021/7//09,1",
+            "1,2021/007/,1",
+            "1,2021-07-09,1",
+            "1,2021/02/30,1",
+            "1,2021/07/09,abc",
+            "1,2021/07/09,nan",
+            "1.5,2021/07/09,1",
+            "1,2021/07/09",
+        ],
+    )
+    def test_malformed_rows_report_line_numbers(self, row):
+        # Given
+        lines = ["id,date,transaction", "1,2021/07/09,1", "", "2,2021/07/10,2", row]
+
+        # When
+        with raises(ColumnarParseError) as e:
+            list(parse_columns(lines, chunk_rows=3))
+
+        # Then
+        assert e.value.line_numbers == [5]
+
+    @mark.parametrize(
+        "day",
+        [
+            "2022/7/9",
+            "2022/07/9",
+            "2022/007/09",
+            "1/1/1",
+            "2024/2/29",
+            "2023/2/29",
+            "2022/13/1",
+            "2022/0/1",
+            "10000/1/1",
+            "2022/1/1/1",
+            "2022/1/1x",
+        ],
+    )
+    def test_dates_are_parsed_as_by_the_row_parser(self, db, day):
+        # Given
+        lines = ["id,date,transaction", f"1,{day},1"]
+        try:
+            (row,) = TransactionSeeder(parser="rows")._validate_rows(reader(lines))
+        except MalformedInputFileError:
+            row = None
+
+        # When
+        try:
+            (batch,) = parse_columns(lines, chunk_rows=10)
+        except ColumnarParseError:
+            batch = None
+
+        # Then
+        if row is None:
+            assert batch is None
+        else:
+            assert batch.dates.astype(object).tolist() == [row[1]]
+
+    def test_deduplicated_keeps_last_occurrence(self):
+        # Given
+        lines = ["id,date,transaction", "1,2021/07/09,1", "2,2021/07/10,2"]
+        lines += ["1,2021/08/01,3"]
+        batch = next(parse_columns(lines, chunk_rows=10))
+
+        # When
+        deduplicated = batch.deduplicated()
+
+        # Then
+        assert deduplicated.ids.tolist() == [2, 1]
+        assert deduplicated.values.tolist() == [2, 3]
+
+    def test_month_totals_by_account(self):
+        # Given
+        lines = [
+            "id,account,date,transaction",
+            "1,acme,2021/07/09,10",
+            "2,globex,2021/07/10,-2",
+            "3,acme,2021/07/11,-4",
+            "4,acme,2021/08/01,3",
+        ]
+        batch = next(parse_columns(lines, chunk_rows=10))
+
+        # When
+        totals = list(batch.month_totals())
+
+        # Then
+        assert totals == [
+            ("acme", 2021, 7, [2, 10, 1, -4, 1, 6]),
+            ("acme", 2021, 8, [1, 3, 1, 0, 0, 3]),
+            ("globex", 2021, 7, [1, 0, 0, -2, 1, -2]),
+        ]
+
+    @mark.parametrize("account", ["", " ", "a" * 65])
+    def test_invalid_accounts_are_malformed(self, account):
+        # Given
+        lines = ["id,date,transaction,account", "1,2021/07/09,1,acme"]
+        lines += [f"2,2021/07/09,1,{account}"]
+
+        # When
+        with raises(ColumnarParseError) as e:
+            list(parse_columns(lines, chunk_rows=10))
+
+        # Then
+        assert e.value.line_numbers == [3]
+
+
+class TestColumnarSeeder:
+    def test_parse_file(self, seed_db, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=2, parser="columnar")
+        csvfile = [
+            b"id,date,transaction\n1,2024/01/01,+5.5\n9,2024/02/01,-3\n",
+            b"9,2024/03/01,-4\n10,2024/02/02,+7\n",
+        ]
+        MonthlyAggregator().rebuild()
+
+        # When
+        result = seeder.parse_file(csvfile)
+
+        # Then
+        assert result.inserted == 2
+        assert result.updated == 2
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 5.5
+            assert session.get(Transaction, 9).date == date(2024, 3, 1)
+            assert session.get(Transaction, 10).value == 7
+        assert MonthlyAggregator().check_consistency() == []
+
+    def test_malformed_file_writes_nothing(self, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=1, parser="columnar")
+        csvfile = ["id,date,transaction", "1,2024/01/01,+5.5", "2,2024/01/0x,1"]
+
+        # When
+        with raises(MalformedInputFileError) as e:
+            seeder.parse_file(csvfile)
+
+        # Then
+        assert "lines 3" in str(e.value)
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
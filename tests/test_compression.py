@@ -0,0 +1,88 @@
+#! /usr/bin/python3
+import gzip
+
+import zstandard
+from pytest import raises
+from src.compression import OUTPUT_CHUNK_SIZE, DecompressionError, decompress_stream
+
+CSV = b"id,date,transaction\n" + b"1,2021/01/01,+1\n" * 10_000
+
+
+def split(data, size):
+    return (memoryview(data)[i : i + size] for i in range(0, len(data), size))
+
+
+class TestDecompressStream:
+    def test_gzip_detected_by_magic_bytes(self):
+        # Given
+        compressed = gzip.compress(CSV)
+
+        # When
+        decompressed = b"".join(decompress_stream(split(compressed, 3)))
+
+        # Then
+        assert decompressed == CSV
+
+    def test_concatenated_gzip_members(self):
+        # Given
+        compressed = gzip.compress(CSV) + gzip.compress(b"2,2021/01/02,+2\n")
+
+        # When
+        decompressed = b"".join(decompress_stream([compressed]))
+
+        # Then
+        assert decompressed == CSV + b"2,2021/01/02,+2\n"
+
+    def test_zstd_from_content_encoding(self):
+        # Given
+        compressed = zstandard.ZstdCompressor().compress(CSV)
+
+        # When
+        decompressed = b"".join(decompress_stream(split(compressed, 1024), "zstd"))
+
+        # Then
+        assert decompressed == CSV
+
+    def test_gzip_output_is_bounded_for_high_ratios(self):
+        # Given
+        compressed = gzip.compress(b"\n" * (20 * OUTPUT_CHUNK_SIZE))
+
+        # When
+        sizes = [len(chunk) for chunk in decompress_stream([compressed])]
+
+        # Then
+        assert sum(sizes) == 20 * OUTPUT_CHUNK_SIZE
+        assert max(sizes) <= OUTPUT_CHUNK_SIZE
+
+    def test_zstd_output_is_bounded_for_high_ratios(self):
+        # Given
+        content = b"\n" * (20 * OUTPUT_CHUNK_SIZE)
+        compressed = zstandard.ZstdCompressor().compress(content)
+        assert len(compressed) < OUTPUT_CHUNK_SIZE // 100
+
+        # When
+        sizes = [len(chunk) for chunk in decompress_stream([compressed])]
+
+        # Then
+        assert sum(sizes) == 20 * OUTPUT_CHUNK_SIZE
+        assert max(sizes) <= OUTPUT_CHUNK_SIZE
+
+    def test_uncompressed_passthrough(self):
+        # When
+        decompressed = b"".join(decompress_stream(split(CSV, 2)))
+
+        # Then
+        assert decompressed == CSV
+
+    def test_truncated_gzip(self):
+        # Given
+        compressed = gzip.compress(CSV)[:-20]
+
+        # When / Then
+        with raises(DecompressionError):
+            b"".join(decompress_stream([compressed]))
+
+    def test_unsupported_encoding(self):
+        # When / Then
+        with raises(DecompressionError):
+            decompress_stream([CSV], "br")
@@ -0,0 +1,49 @@
+#! /usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+
+from src.db.db import DbAPI
+from src.models import Transaction
+
+
+class TestDbAPI:
+    def test_engine_is_shared_across_instances(self, db):
+        # Given
+        other_db = DbAPI()
+
+        # When
+        same_engine = other_db.engine is db.engine
+
+        # Then
+        assert same_engine
+        assert other_db.pool_stats is db.pool_stats
+
+    def test_connections_are_reused(self, db):
+        # Given
+        with db.session_local() as session:
+            session.get(Transaction, 1)
+        connects = db.pool_stats.connects
+        checkouts = db.pool_stats.checkouts
+
+        # When
+        for _ in range(3):
+            with DbAPI().session_local() as session:
+                session.get(Transaction, 1)
+
+        # Then
+        assert db.pool_stats.connects == connects
+        assert db.pool_stats.checkouts == checkouts + 3
+
+    def test_checkouts_are_counted_across_threads(self, db):
+        # Given
+        checkouts = db.pool_stats.checkouts
+
+        def checkout(_):
+            with db.session_local() as session:
+                session.get(Transaction, 1)
+
+        # When
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(checkout, range(200)))
+
+        # Then
+        assert db.pool_stats.checkouts == checkouts + 200
@@ -0,0 +1,104 @@
+#! /usr/bin/python3
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from src.email_gateway import EmailGateway, OutgoingEmail, SMTPConnectionPool
+
+
+def email(to="a@example.com"):
+    return OutgoingEmail(to, "Summary", "plain", "<p>html</p>")
+
+
+class TestEmailGateway:
+    def test_connections_are_reused_across_gateways(self, smtp_server):
+        # Given
+        _, handler = smtp_server
+        gateway = EmailGateway()
+
+        # When
+        gateway.send_email(*email())
+        EmailGateway().send_email(*email("b@example.com"))
+
+        # Then
+        assert [m.rcpt_tos for m in handler.messages] == [
+            ["a@example.com"],
+            ["b@example.com"],
+        ]
+        assert gateway.pool_stats.connects == 1
+        assert gateway.pool_stats.reuses == 1
+
+    def test_send_many(self, smtp_server):
+        # Given
+        _, handler = smtp_server
+        gateway = EmailGateway()
+        emails = [email(f"{i}@example.com") for i in range(5)]
+
+        # When
+        failures = gateway.send_many(emails)
+
+        # Then
+        assert failures == []
+        assert len(handler.messages) == 5
+        assert gateway.pool_stats.connects == 1
+
+    def test_reconnects_when_server_drops_the_connection(self, smtp_server):
+        # Given
+        _, handler = smtp_server
+        gateway = EmailGateway()
+        gateway.send_email(*email())
+        # Simulates the server closing the idle connection on its side
+        with gateway.pool.connection() as server:
+            server.sock.shutdown(socket.SHUT_RDWR)
+
+        # When
+        gateway.send_email(*email("b@example.com"))
+
+        # Then
+        assert len(handler.messages) == 2
+        assert gateway.pool_stats.reconnects == 1
+        assert gateway.pool_stats.connects == 2
+
+    def test_idle_connections_are_checked_with_noop(self, smtp_server):
+        # Given
+        gateway = EmailGateway()
+        gateway.pool.noop_after = 0
+        gateway.send_email(*email())
+
+        # When
+        gateway.send_email(*email("b@example.com"))
+
+        # Then
+        assert gateway.pool_stats.noops == 1
+        assert gateway.pool_stats.connects == 1
+
+    def test_expired_connections_are_replaced(self, smtp_server):
+        # Given
+        gateway = EmailGateway()
+        gateway.pool.idle_timeout = 0
+        gateway.send_email(*email())
+
+        # When
+        gateway.send_email(*email("b@example.com"))
+
+        # Then
+        assert gateway.pool_stats.expired == 1
+        assert gateway.pool_stats.connects == 2
+
+
+class TestSMTPConnectionPool:
+    def test_stats_are_counted_across_threads(self):
+        # Given
+        pool = SMTPConnectionPool(
+            lambda: object(), max_size=4, idle_timeout=60, noop_after=60
+        )
+
+        def checkout(_):
+            with pool.connection():
+                pass
+
+        # When
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(checkout, range(2000)))
+
+        # Then
+        assert pool.stats.connects + pool.stats.reuses == 2000
@@ -0,0 +1,47 @@
+#! /usr/bin/python3
+from pytest import raises
+from src.ingest_log import IngestLog, content_hash
+from src.transaction_seeder import IngestResult
+
+
+class TestIngestLog:
+    def test_content_hash_does_not_depend_on_chunking(self):
+        # Given
+        content = b"id,date,transaction\n1,2021/01/01,+10\n"
+
+        # When
+        whole = content_hash([content])
+        chunked = content_hash([content[:7], memoryview(content)[7:]])
+
+        # Then
+        assert whole == chunked
+        assert whole != content_hash([content + b"\n"])
+
+    def test_completed_ingest_is_found(self, db):
+        # Given
+        ingest_log = IngestLog(dbapi=db)
+
+        # When
+        result = ingest_log.run("abc", lambda: IngestResult(inserted=3, updated=1))
+
+        # Then
+        assert result == IngestResult(inserted=3, updated=1)
+        record = ingest_log.find_completed("abc")
+        assert (record.status, record.inserted, record.updated) == ("completed", 3, 1)
+        assert record.duration >= 0
+        assert record.finished_at >= record.started_at
+        assert ingest_log.find_completed("other") is None
+
+    def test_failed_ingest_is_recorded_but_not_found(self, db):
+        # Given
+        ingest_log = IngestLog(dbapi=db)
+
+        def ingest():
+            raise ValueError("malformed")
+
+        # When
+        with raises(ValueError):
+            ingest_log.run("abc", ingest)
+
+        # Then
+        assert ingest_log.find_completed("abc") is None
@@ -0,0 +1,67 @@
+#! /usr/bin/python3
+from pytest import fixture
+from src import instrumentation
+from src.summary_renderer import render_summary
+from src.transaction_seeder import TransactionSeeder
+from src.transaction_summarizer import TransactionSummarizer
+
+
+@fixture
+def records():
+    records = []
+    instrumentation.enable(sink=records.append)
+    yield records
+    instrumentation.disable()
+
+
+class TestInstrumentation:
+    def test_invocation_emits_one_emf_record(self, db, records):
+        # Given
+        csvfile = ["id,date,transaction", "1,2024/01/01,+5", "2,2024/01/02,-1"]
+
+        # When
+        with instrumentation.invocation("upload"):
+            TransactionSeeder(batch_size=1).parse_file(csvfile)
+            render_summary(TransactionSummarizer().summary())
+
+        # Then
+        assert len(records) == 1
+        record = records[0]
+        assert record["Operation"] == "upload"
+        assert record["seeder.rows_inserted"] == 2
+        assert record["seeder.batches"] == 2
+        assert record["sql.insert.count"] >= 2
+        assert record["sql.select.count"] >= 1
+        for stage in ("upload", "seeder.ingest", "seeder.write", "render"):
+            assert record[f"{stage}.duration"] > 0
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Dimensions"] == [["Operation"]]
+        assert {metric["Name"] for metric in directive["Metrics"]} == (
+            record.keys() - {"_aws", "Operation"}
+        )
+
+    def test_spans_outside_invocations_are_emitted_right_away(self, records):
+        # When
+        with instrumentation.span("render"):
+            ...
+
+        # Then
+        assert [record["Operation"] for record in records] == ["render"]
+        assert records[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [
+            {"Name": "render.duration", "Unit": "Milliseconds"}
+        ]
+
+    def test_disabled(self, db):
+        # Given
+        records = []
+        instrumentation.enable(sink=records.append)
+        instrumentation.disable()
+
+        # When
+        with instrumentation.invocation("upload") as metrics:
+            TransactionSeeder().parse_file(["id,date,transaction", "1,2024/01/01,+5"])
+
+        # Then
+        assert metrics is None
+        assert records == []
+        assert instrumentation.span("a") is instrumentation.span("b")
@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+from datetime import date
+
+from sqlalchemy import inspect, text
+from src.db.migrations import MIGRATIONS, applied_versions, migrate
+from src.models import Base, Transaction
+from src.monthly_aggregates import MonthlyAggregator
+from src.transaction_summarizer import TransactionSummarizer
+
+
+def _create_legacy_schema(db):
+    """Creates the tables as they were before accounts and migrations existed."""
+    with db.engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE transactions"
+                " (id INTEGER PRIMARY KEY, date DATE NOT NULL, value FLOAT NOT NULL)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE monthly_aggregates (year INTEGER, month INTEGER,"
+                " count INTEGER, credit_sum FLOAT, credit_count INTEGER,"
+                " debit_sum FLOAT, debit_count INTEGER, balance FLOAT,"
+                " PRIMARY KEY (year, month))"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO transactions VALUES"
+                " (1, '2021-01-01', 10), (2, '2021-01-05', -20), (3, '2022-04-19', 30)"
+            )
+        )
+
+
+class TestMigrate:
+    def test_migrate_creates_the_schema(self, db):
+        # Given
+        Base.metadata.drop_all(bind=db.engine)
+
+        # When
+        migrate(db)
+        version = migrate(db)
+
+        # Then
+        tables = set(inspect(db.engine).get_table_names())
+        assert set(Base.metadata.tables) <= tables
+        assert version == MIGRATIONS[-1].version
+        assert applied_versions(db) == tuple(m.version for m in MIGRATIONS)
+
+    def test_migrate_upgrades_an_existing_schema(self, db):
+        # Given
+        Base.metadata.drop_all(bind=db.engine)
+        _create_legacy_schema(db)
+
+        # When
+        migrate(db)
+
+        # Then
+        inspector = inspect(db.engine)
+        columns = {column["name"] for column in inspector.get_columns("transactions")}
+        assert {"account_id", "year", "month"} <= columns
+        indexes = {index["name"] for index in inspector.get_indexes("transactions")}
+        assert {index.name for index in Transaction.__table__.indexes} <= indexes
+        summarizer = TransactionSummarizer(db_api=db, use_aggregates=True)
+        assert summarizer.summary().transactions_by_year_month == {
+            2021: {1: 2},
+            2022: {4: 1},
+        }
+        assert summarizer.summary("default").total_balance == 20
+        assert MonthlyAggregator(dbapi=db).check_consistency() == []
+
+    def test_migrated_transactions_store_their_year_and_month(self, db):
+        # Given
+        Base.metadata.drop_all(bind=db.engine)
+        _create_legacy_schema(db)
+        migrate(db)
+
+        # When
+        with db.session_local() as session:
+            session.add(Transaction(id=4, date=date(2023, 7, 9), value=5))
+        with db.session_local() as session:
+            transaction = session.get(Transaction, 4)
+            year, month = transaction.year, transaction.month
+
+        # Then
+        assert (year, month) == (2023, 7)
+
+
+class TestQueryPlans:
+    def test_summaries_are_read_in_index_order(self, db, seed_db):
+        # Given
+        summarizer = TransactionSummarizer(db_api=db, use_aggregates=False)
+        statements = {
+            "ix_transactions_year_month": summarizer.summary_statement(),
+            "ix_transactions_account_year_month": summarizer.summary_statement(
+                "default"
+            ),
+        }
+
+        for index, statement in statements.items():
+            # When
+            sql = statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+            with db.engine.connect() as connection:
+                plan = " ".join(
+                    row[-1]
+                    for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+                )
+
+            # Then
+            # SQLite reads generated columns from the table, so it scans the
+            # index in order rather than as a covering index, as PostgreSQL does
+            assert f"USING INDEX {index}" in plan
@@ -0,0 +1,48 @@
+#! /usr/bin/python3
+from src.monthly_aggregates import MonthlyAggregator
+from src.transaction_seeder import TransactionSeeder
+from src.transaction_summarizer import TransactionSummarizer
+
+
+class TestMonthlyAggregator:
+    def test_seeder_keeps_aggregates_consistent(self, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=2)
+        aggregator = MonthlyAggregator()
+        first_file = [
+            "id,date,transaction",
+            "1,2024/01/01,+10",
+            "2,2024/01/15,-5",
+            "3,2024/02/01,+7",
+        ]
+        # Moves id 1 to another month and turns id 3 into a debit
+        second_file = [
+            "id,date,transaction",
+            "1,2024/03/01,+10",
+            "3,2024/02/01,-7",
+            "4,2024/03/02,0",
+        ]
+
+        # When
+        seeder.parse_file(first_file)
+        seeder.parse_file(second_file)
+
+        # Then
+        assert aggregator.check_consistency() == []
+        summary = TransactionSummarizer(use_aggregates=True).summary()
+        assert summary == TransactionSummarizer(use_aggregates=False).summary()
+        assert summary.transactions_by_year_month == {2024: {1: 1, 2: 1, 3: 2}}
+
+    def test_rebuild(self, seed_db):
+        # Given
+        aggregator = MonthlyAggregator()
+        mismatches = aggregator.check_consistency()
+
+        # When
+        aggregator.rebuild()
+
+        # Then
+        assert len(mismatches) == 4
+        assert aggregator.check_consistency() == []
+        summary = TransactionSummarizer(use_aggregates=True).summary()
+        assert summary == TransactionSummarizer(use_aggregates=False).summary()
@@ -0,0 +1,75 @@
+#! /usr/bin/python3
+import tracemalloc
+
+from pytest import raises
+from src.multipart import MultipartError, find_part, iter_parts
+
+CONTENT_TYPE = 'multipart/form-data; boundary="abc"'
+
+
+def multipart_body(*parts):
+    body = b""
+    for headers, content in parts:
+        body += b"--abc\r\n" + headers + b"\r\n\r\n" + content + b"\r\n"
+    return body + b"--abc--\r\n"
+
+
+class TestMultipart:
+    def test_find_part_by_name(self):
+        # Given
+        body = multipart_body(
+            (b'Content-Disposition: form-data; name="other"', b"ignored"),
+            (
+                b'Content-Disposition: form-data; name="file"; filename="file"\r\n'
+                b"Content-Encoding: gzip",
+                b"id,date,transaction\r\n1,2021/01/01,1\r\n",
+            ),
+        )
+
+        # When
+        part = find_part(body, CONTENT_TYPE, "file")
+
+        # Then
+        assert part.headers["content-encoding"] == "gzip"
+        assert bytes(part.content) == b"id,date,transaction\r\n1,2021/01/01,1\r\n"
+
+    def test_filename_is_not_mistaken_for_name(self):
+        # Given
+        body = multipart_body(
+            (b'Content-Disposition: form-data; name="x"; filename="file"', b"1"),
+        )
+
+        # When
+        part = find_part(body, CONTENT_TYPE, "file")
+
+        # Then
+        assert part is None
+
+    def test_part_content_is_not_copied(self):
+        # Given
+        content = b"1,2021/01/01,1\n" * 100_000
+        body = multipart_body((b'Content-Disposition: form-data; name="file"', content))
+
+        # When
+        tracemalloc.start()
+        part = find_part(body, CONTENT_TYPE, "file")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Then
+        assert part.content.obj is body
+        assert len(part.content) == len(content)
+        assert peak < len(content) / 100
+
+    def test_truncated_body(self):
+        # Given
+        body = multipart_body((b'Content-Disposition: form-data; name="file"', b"1"))
+
+        # When / Then
+        with raises(MultipartError):
+            list(iter_parts(body[:30], CONTENT_TYPE))
+
+    def test_missing_boundary(self):
+        # When / Then
+        with raises(MultipartError):
+            list(iter_parts(b"", "text/csv"))
@@ -0,0 +1,120 @@
+#! /usr/bin/python3
+from datetime import timedelta
+
+from pytest import fixture
+from sqlalchemy import select
+from src.db.db import DBClientError
+from src.email_gateway import EmailGatewayError
+from src.models import OutboxEmail, utcnow
+from src.outbox import EmailOutbox
+from src.transaction_summarizer import TransactionSummarizer
+
+
+class FakeSummarizer(TransactionSummarizer):
+    def __init__(self, failures=0, error=EmailGatewayError("SMTP hiccup")):
+        self.sent = []
+        self.failures = failures
+        self.error = error
+
+    def send_summary_email(self, to, email_subject):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.sent.append((to, email_subject))
+
+
+@fixture
+def later():
+    return utcnow() + timedelta(hours=1)
+
+
+class TestEmailOutbox:
+    def test_uploads_are_coalesced_into_one_email(self, db, later):
+        # Given
+        summarizer = FakeSummarizer()
+        outbox = EmailOutbox(summarizer=summarizer)
+        outbox.enqueue("a@example.com", "Summary")
+        outbox.enqueue("a@example.com", "Summary")
+        outbox.enqueue("b@example.com", "Summary")
+
+        # When
+        result = outbox.drain(now=later)
+
+        # Then
+        assert result.sent == 2
+        assert sorted(summarizer.sent) == [
+            ("a@example.com", "Summary"),
+            ("b@example.com", "Summary"),
+        ]
+        with db.session_local() as session:
+            statuses = session.scalars(select_statuses()).all()
+            assert statuses == ["sent"] * 3
+
+    def test_emails_are_not_sent_before_the_coalesce_window(self, db):
+        # Given
+        summarizer = FakeSummarizer()
+        outbox = EmailOutbox(summarizer=summarizer)
+        outbox.enqueue("a@example.com", "Summary")
+
+        # When
+        result = outbox.drain()
+
+        # Then
+        assert result.sent == 0
+        assert summarizer.sent == []
+
+    def test_failures_are_retried_with_backoff(self, db, later):
+        # Given
+        summarizer = FakeSummarizer(failures=1)
+        outbox = EmailOutbox(summarizer=summarizer)
+        outbox.enqueue("a@example.com", "Summary")
+
+        # When
+        first = outbox.drain(now=later)
+        too_soon = outbox.drain(now=later)
+        retry = outbox.drain(now=later + outbox.backoff)
+
+        # Then
+        assert first.retried == 1
+        assert too_soon.sent == 0
+        assert retry.sent == 1
+        assert summarizer.sent == [("a@example.com", "Summary")]
+
+    def test_db_errors_are_retried_without_stopping_the_drain(self, db, later):
+        # Given
+        error = DBClientError("There was a problem connecting to the DB")
+        summarizer = FakeSummarizer(failures=1, error=error)
+        outbox = EmailOutbox(summarizer=summarizer)
+        outbox.enqueue("a@example.com", "Summary")
+        outbox.enqueue("b@example.com", "Summary")
+
+        # When
+        result = outbox.drain(now=later)
+
+        # Then
+        assert (result.sent, result.retried) == (1, 1)
+        with db.session_local() as session:
+            assert sorted(session.scalars(select_statuses()).all()) == [
+                "pending",
+                "sent",
+            ]
+
+    def test_gives_up_after_max_attempts(self, db, later):
+        # Given
+        summarizer = FakeSummarizer(failures=100)
+        outbox = EmailOutbox(summarizer=summarizer)
+        outbox.max_attempts = 2
+        outbox.enqueue("a@example.com", "Summary")
+
+        # When
+        outbox.drain(now=later)
+        result = outbox.drain(now=later + timedelta(days=1))
+
+        # Then
+        assert result.failed == 1
+        with db.session_local() as session:
+            assert session.scalars(select_statuses()).all() == ["failed"]
+
+
+def select_statuses():
+    return select(OutboxEmail.status).order_by(OutboxEmail.id)
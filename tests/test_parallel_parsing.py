@@ -0,0 +1,103 @@
+#! /usr/bin/python3
+from csv import reader
+from datetime import date
+from pathlib import Path
+
+from pytest import raises
+from src.columnar import ColumnarParseError
+from src.models import Transaction
+from src.parallel_parsing import parse_file_parallel, split_file
+from src.transaction_seeder import MalformedInputFileError, TransactionSeeder
+
+# The sample file shipped with the repo, whose days are not zero-padded
+SAMPLE_FILE = str(Path(__file__).parent.parent / "input.csv")
+
+
+def write_csv(path, rows):
+    path.write_text("id,date,transaction\n" + "".join(f"{row}\n" for row in rows))
+    return str(path)
+
+
+class TestParallelParsing:
+    def test_split_file_is_newline_aligned(self, tmp_path):
+        # Given
+        rows = [f"{i},2021/01/{i % 28 + 1:02},{i}" for i in range(1, 500)]
+        path = write_csv(tmp_path / "input.csv", rows)
+        content = open(path, "rb").read()
+
+        # When
+        header, ranges = split_file(path, 7)
+
+        # Then
+        assert header == "id,date,transaction\n"
+        assert ranges[0][0] == len(header)
+        assert ranges[-1][1] == len(content)
+        assert all(
+            end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:])
+        )
+        assert all(content[end - 1 : end] == b"\n" for _, end in ranges)
+
+    def test_malformed_rows_map_to_file_line_numbers(self, tmp_path):
+        # Given
+        rows = [f"{i},2021/01/{i % 28 + 1:02},{i}" for i in range(1, 500)]
+        rows[400] = "401,2021/01/41,1"
+        path = write_csv(tmp_path / "input.csv", rows)
+
+        # When
+        with raises(ColumnarParseError) as e:
+            list(parse_file_parallel(path, workers=2, batch_size=50, range_bytes=512))
+
+        # Then
+        assert e.value.line_numbers == [402]
+
+    def test_parse_path_last_duplicate_wins_across_ranges(self, tmp_path, db):
+        # Given
+        rows = [f"{i},2021/01/{i % 28 + 1:02},{i}" for i in range(1, 500)]
+        rows.append("1,2022/02/02,-1")
+        path = write_csv(tmp_path / "input.csv", rows)
+        seeder = TransactionSeeder(batch_size=100)
+
+        # When
+        result = seeder.parse_path(path, workers=2)
+
+        # Then
+        assert result.inserted == 499
+        with db.session_local() as session:
+            transaction = session.get(Transaction, 1)
+            assert transaction.date == date(2022, 2, 2)
+            assert transaction.value == -1
+
+    def test_parse_path_malformed_file_writes_nothing(self, tmp_path, db):
+        # Given
+        path = write_csv(tmp_path / "input.csv", ["1,2021/01/01,1", "2,2021/01/01,x"])
+        seeder = TransactionSeeder()
+
+        # When
+        with raises(MalformedInputFileError):
+            seeder.parse_path(path, workers=2)
+
+        # Then
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
+
+    def test_parallel_parsing_accepts_the_rows_of_sequential_parsing(self, db):
+        # Given
+        with open(SAMPLE_FILE) as file:
+            rows = list(TransactionSeeder(parser="rows")._validate_rows(reader(file)))
+
+        # When
+        batches = list(
+            parse_file_parallel(SAMPLE_FILE, workers=2, batch_size=3, range_bytes=64)
+        )
+        result = TransactionSeeder().parse_path(SAMPLE_FILE, workers=2)
+
+        # Then
+        parsed = [
+            (id, day, value)
+            for batch in batches
+            for id, day, value in zip(
+                batch.ids.tolist(), batch.dates.astype(object), batch.values.tolist()
+            )
+        ]
+        assert parsed == [(id, day, value) for id, day, value, _ in rows]
+        assert result.inserted == len(rows)
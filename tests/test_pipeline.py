@@ -0,0 +1,84 @@
+#! /usr/bin/python3
+import threading
+
+from pytest import raises
+from src.pipeline import run_pipeline
+
+
+def _collect(items):
+    return list(items)
+
+
+class TestRunPipeline:
+    def test_items_are_consumed_in_order(self):
+        # When
+        results = run_pipeline(range(100), _collect, queue_size=2)
+
+        # Then
+        assert results == list(range(100))
+
+    def test_producer_is_held_back_by_a_full_queue(self):
+        # Given
+        produced = []
+
+        def items():
+            for n in range(20):
+                produced.append(n)
+                yield n
+
+        def slow_consumer(items):
+            ahead = []
+            for n in items:
+                ahead.append(len(produced) - n)
+            return max(ahead)
+
+        # When
+        result = run_pipeline(items(), slow_consumer, queue_size=3)
+
+        # Then
+        # The queue, the item being put and the one being consumed
+        assert result <= 3 + 2
+
+    def test_producer_error_stops_the_consumer(self):
+        # Given
+        def items():
+            yield 1
+            raise ValueError("malformed")
+
+        consumed = []
+
+        def consumer(items):
+            for n in items:
+                consumed.append(n)
+
+        # When
+        with raises(ValueError, match="malformed"):
+            run_pipeline(items(), consumer, queue_size=2)
+
+        # Then
+        assert consumed in ([], [1])
+
+    def test_consumer_error_stops_the_producer(self):
+        # Given
+        closed = threading.Event()
+
+        def items():
+            try:
+                n = 0
+                while True:
+                    yield n
+                    n += 1
+            finally:
+                closed.set()
+
+        def failing(items):
+            for n in items:
+                if n == 5:
+                    raise RuntimeError("DB is down")
+
+        # When
+        with raises(RuntimeError, match="DB is down"):
+            run_pipeline(items(), failing, queue_size=2)
+
+        # Then
+        assert closed.is_set()
@@ -0,0 +1,68 @@
+#! /usr/bin/python3
+import time
+
+from src.summary_cache import SummaryCache
+from src.transaction_seeder import TransactionSeeder
+from src.transaction_summarizer import (
+    MonthSummary,
+    TransactionSummarizer,
+    TransactionSummary,
+)
+
+
+def summary(count=1):
+    return TransactionSummary(months=(MonthSummary(2024, 1, count, 1, 1, 0, 0, 1),))
+
+
+class TestSummaryCache:
+    def test_ingest_invalidates_cached_summaries(self, seed_db):
+        # Given
+        cache = SummaryCache(max_size=8, ttl=60)
+        summarizer = TransactionSummarizer(cache=cache)
+        first = summarizer.summary()
+
+        # When
+        cached = summarizer.summary()
+        TransactionSeeder().parse_file(["id,date,transaction", "100,2024/01/01,+1"])
+        after_ingest = summarizer.summary()
+        bypassed = summarizer.summary(use_cache=False)
+
+        # Then
+        assert cached is first
+        assert after_ingest.count == first.count + 1
+        assert bypassed == after_ingest
+        assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+        assert cache.stats.invalidations == 1
+
+    def test_lru_and_ttl_evictions(self):
+        # Given
+        cache = SummaryCache(max_size=2, ttl=60)
+        cache.set(1, "a", summary())
+        cache.set(1, "b", summary())
+        cache.get(1, "a")
+
+        # When
+        cache.set(1, "c", summary())
+        cache.ttl = 0
+        cache.set(1, "d", summary())
+        time.sleep(0.01)
+
+        # Then
+        assert cache.get(1, "b") is None
+        assert cache.get(1, "d") is None
+        assert cache.get(1, "a") is None
+        assert cache.stats.evictions == 3
+
+    def test_shared_cache(self, tmp_path):
+        # Given
+        path = str(tmp_path / "summaries.db")
+        worker = SummaryCache(max_size=8, ttl=60, path=path)
+        other_worker = SummaryCache(max_size=8, ttl=60, path=path)
+
+        # When
+        worker.set(3, None, summary(count=5))
+
+        # Then
+        assert other_worker.get(3) == summary(count=5)
+        assert other_worker.get(4) is None
+        assert other_worker.stats.hits == 1
@@ -0,0 +1,30 @@
+#! /usr/bin/python3
+from src.models import Account
+from src.summary_dispatcher import SummaryDispatcher
+from src.transaction_seeder import TransactionSeeder
+
+
+class TestSummaryDispatcher:
+    def test_dispatch(self, db, smtp_server):
+        # Given
+        _, handler = smtp_server
+        csvfile = ["id,date,transaction,account"]
+        csvfile += [f"{i},2024/01/01,+{i},account-{i % 12}" for i in range(1, 61)]
+        TransactionSeeder().parse_file(csvfile)
+        with db.session_local() as session:
+            session.add_all(
+                Account(id=f"account-{i}", email=f"{i}@example.com") for i in range(10)
+            )
+            session.add(Account(id="account-10", email="rejected@example.com"))
+        dispatcher = SummaryDispatcher(workers=3)
+
+        # When
+        report = dispatcher.dispatch("Summary")
+
+        # Then
+        assert report.sent == 10
+        assert list(report.failed) == ["account-10"]
+        assert report.skipped == 1
+        recipients = sorted(m.rcpt_tos[0] for m in handler.messages)
+        assert recipients == sorted(f"{i}@example.com" for i in range(10))
+        assert dispatcher.summarizer.email_gateway.pool_stats.connects <= 3
@@ -0,0 +1,57 @@
+#! /usr/bin/python3
+from datetime import date
+
+from src.summary_renderer import render_summary
+from src.transaction_summarizer import MonthSummary, SummaryWindow, TransactionSummary
+
+
+class TestRenderSummary:
+    def test_render_summary(self):
+        # Given
+        summary = TransactionSummary(
+            months=(
+                MonthSummary(2021, 1, 2, 10.0, 1, -20.0, 1, -10.0),
+                MonthSummary(2022, 4, 1, 30.0, 1, 0, 0, 30.0),
+                MonthSummary(2022, 5, 2, 50.0, 1, -40.0, 1, 10.0),
+            )
+        )
+
+        # When
+        rendered = render_summary(summary)
+
+        # Then
+        assert "<strong>Number of transactions in 2022: </strong>3" in rendered.html
+        assert '<td style="text-align:center">April</td>' in rendered.html
+        assert "<strong>Total Balance: </strong>30.0" in rendered.html
+        assert "Number of transactions in 2021: 2" in rendered.plaintext
+        assert "May | 2\n" in rendered.plaintext
+        assert "Average credit amount: 30.0" in rendered.plaintext
+        assert "Average debit amount: -30.0" in rendered.plaintext
+        assert "<" not in rendered.plaintext
+
+    def test_render_empty_summary(self):
+        # When
+        rendered = render_summary(TransactionSummary())
+
+        # Then
+        assert "<table" not in rendered.html
+        assert "Total Balance: 0" in rendered.plaintext
+
+    def test_render_window_compared_with_previous_window(self):
+        # Given
+        window = SummaryWindow.last_months(1, today=date(2024, 3, 31))
+        summary = TransactionSummary(
+            months=(MonthSummary(2024, 3, 2, 50.0, 1, -40.0, 1, 10.0),)
+        )
+        previous = TransactionSummary(
+            months=(MonthSummary(2024, 2, 1, 30.0, 1, 0, 0, 30.0),)
+        )
+
+        # When
+        rendered = render_summary(summary, window=window, previous=previous)
+
+        # Then
+        assert "Transactions from 2024-03-01 to 2024-03-31" in rendered.html
+        assert "Compared with 2024-02-01 to 2024-02-29:" in rendered.plaintext
+        assert "Number of transactions: 1 (+1)" in rendered.plaintext
+        assert "Total Balance: </strong>30.0 (-20.0)" in rendered.html
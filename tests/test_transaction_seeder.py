@@ -1,8 +1,27 @@
 #! /usr/bin/python3
-from datetime import timedelta
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from csv import reader
+from datetime import date, timedelta
 
+from pytest import mark, raises
+from sqlalchemy.exc import OperationalError
+from src.copy_loader import _csv_lines, _LineStream
+from src.db.db import DBClientError
 from src.models import Transaction
-from src.transaction_seeder import TransactionSeeder
+from src.monthly_aggregates import MonthlyAggregator
+from src.transaction_seeder import MalformedInputFileError, TransactionSeeder
+
+DUPLICATES_FILE = [
+    "id,date,transaction,account",
+    "1,2024/01/01,+5,acme",
+    "2,2024/01/02,-1,acme",
+    "3,2024/02/03,+2,other",
+    "1,2024/03/01,-4,other",
+    "4,2024/03/02,+8,acme",
+    "2,2024/03/03,+6,acme",
+    "5,2024/04/04,-3,other",
+]
 
 
 class TestTransactionSeeder:
@@ -22,3 +41,346 @@ class TestTransactionSeeder:
             assert transaction_from_db.id == transaction.id
             assert transaction_from_db.date == new_date
             assert transaction_from_db.value == new_value
+
+    def test_parse_file_upserts_in_batches(self, seed_db, transactions, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=2)
+        csvfile = [
+            "id,date,transaction",
+            "1,2024/01/01,+5.5",
+            "9,2024/02/01,-3",
+            "10,2024/02/02,+7",
+        ]
+
+        # When
+        result = seeder.parse_file(csvfile)
+
+        # Then
+        assert result.inserted == 2
+        assert result.updated == 1
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 5.5
+            assert session.get(Transaction, 1).date == date(2024, 1, 1)
+            assert session.get(Transaction, 9).value == -3
+            assert session.get(Transaction, 10).value == 7
+
+    def test_parse_file_last_duplicate_wins(self, db):
+        # Given
+        seeder = TransactionSeeder()
+        csvfile = [
+            "id,date,transaction",
+            "1,2024/01/01,+5.5",
+            "1,2024/03/01,-2",
+        ]
+
+        # When
+        result = seeder.parse_file(csvfile)
+
+        # Then
+        assert result.inserted == 1
+        assert result.updated == 0
+        with db.session_local() as session:
+            transaction_from_db = session.get(Transaction, 1)
+            assert transaction_from_db.date == date(2024, 3, 1)
+            assert transaction_from_db.value == -2
+
+    def test_parse_file_malformed_row_writes_nothing(self, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=1)
+        csvfile = [
+            "id,date,transaction",
+            "1,2024/01/01,+5.5",
+            "2,2024-01-02,+1",
+        ]
+
+        # When
+        with raises(MalformedInputFileError):
+            seeder.parse_file(csvfile)
+
+        # Then
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
+
+    def test_parse_file_from_byte_chunks(self, db):
+        # Given
+        seeder = TransactionSeeder()
+        content = "id,date,transaction\r\n1,2024/01/01,+5.5\r\n2,2024/01/02,-1\r\n"
+        content = content.encode()
+        # Chunks that split lines, and the line endings themselves
+        chunks = (content[i : i + 7] for i in range(0, len(content), 7))
+
+        # When
+        result = seeder.parse_file(chunks)
+
+        # Then
+        assert result.inserted == 2
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == 5.5
+            assert session.get(Transaction, 2).date == date(2024, 1, 2)
+
+    @mark.parametrize("parser", ["rows", "columnar"])
+    def test_parse_file_rejects_invalid_utf8(self, db, parser):
+        # Given
+        seeder = TransactionSeeder(parser=parser)
+        chunks = [b"id,date,transaction\n1,2024/01/01,+5.5\n", b"2,2024/01/0\xff,-1\n"]
+
+        # When
+        with raises(MalformedInputFileError, match="UTF-8"):
+            seeder.parse_file(chunks)
+
+        # Then
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
+
+    def test_parse_path_rejects_invalid_utf8(self, db, tmp_path):
+        # Given
+        path = tmp_path / "input.csv"
+        path.write_bytes(b"id,date,transaction\n1,2024/01/01,+5.5\n2,2024/\xff,-1\n")
+
+        # When
+        with raises(MalformedInputFileError, match="UTF-8"):
+            TransactionSeeder().parse_path(str(path), workers=2)
+
+    def test_parse_file_reports_malformed_line(self, db):
+        # Given
+        seeder = TransactionSeeder()
+        csvfile = [
+            "id,date,transaction",
+            "1,2024/01/01,+5.5",
+            "2,2024/01/02,abc",
+        ]
+
+        # When
+        with raises(MalformedInputFileError) as e:
+            seeder.parse_file(csvfile)
+
+        # Then
+        assert "line 3" in str(e.value)
+
+    def test_parse_file_memory_is_bounded_by_batch_size(self, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=500)
+
+        def generate_file(rows):
+            yield b"id,date,transaction\n"
+            for id in range(1, rows + 1):
+                yield f"{id},2024/01/{id % 28 + 1:02},{id}.5\n".encode()
+
+        def peak_memory(rows):
+            tracemalloc.start()
+            seeder.parse_file(generate_file(rows))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+
+        # When
+        small_peak = peak_memory(2_000)
+        large_peak = peak_memory(20_000)
+
+        # Then
+        assert large_peak < small_peak * 2
+
+    def test_parse_file_with_accounts(self, db):
+        # Given
+        seeder = TransactionSeeder()
+        csvfile = [
+            "id,date,transaction,account",
+            "1,2024/01/01,+5.5,acme",
+            "2,2024/01/02,-1,globex",
+        ]
+
+        # When
+        seeder.parse_file(csvfile)
+        # Moves transaction 2 to another account
+        seeder.parse_file(["id,date,transaction,account", "2,2024/01/02,-1,acme"])
+        seeder.parse_file(["id,date,transaction", "3,2024/01/03,+2"])
+
+        # Then
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).account_id == "acme"
+            assert session.get(Transaction, 2).account_id == "acme"
+            assert session.get(Transaction, 3).account_id == "default"
+        assert MonthlyAggregator().check_consistency() == []
+
+    def test_parse_file_rejects_empty_account(self, db):
+        # Given
+        seeder = TransactionSeeder()
+        csvfile = ["id,date,transaction,account", "1,2024/01/01,+5.5,"]
+
+        # When
+        with raises(MalformedInputFileError) as e:
+            seeder.parse_file(csvfile)
+
+        # Then
+        assert "line 2" in str(e.value)
+
+    @mark.parametrize("value", ["inf", "-Infinity", "nan"])
+    def test_parse_file_rejects_non_finite_values(self, db, value):
+        # Given
+        seeder = TransactionSeeder()
+        csvfile = ["id,date,transaction", "1,2024/01/01,+5.5", f"2,2024/01/02,{value}"]
+
+        # When
+        with raises(MalformedInputFileError) as e:
+            seeder.parse_file(csvfile)
+
+        # Then
+        assert "line 3" in str(e.value)
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
+
+
+class TestPipelinedWrites:
+    @mark.parametrize("parser", ["rows", "columnar"])
+    @mark.parametrize("queue_size", [0, 1])
+    def test_last_duplicate_wins_whether_pipelined_or_not(self, db, parser, queue_size):
+        # Given
+        seeder = TransactionSeeder(batch_size=2, parser=parser, queue_size=queue_size)
+
+        # When
+        result = seeder.parse_file(DUPLICATES_FILE)
+
+        # Then
+        assert result.inserted == 5
+        with db.session_local() as session:
+            assert session.get(Transaction, 1).value == -4
+            assert session.get(Transaction, 2).date == date(2024, 3, 3)
+        assert MonthlyAggregator().check_consistency() == []
+
+    @mark.parametrize("copy", [False, True])
+    def test_concurrent_ingests_keep_the_aggregates_consistent(self, postgres_db, copy):
+        # Given
+        files = [
+            [
+                DUPLICATES_FILE[0],
+                *(f"{id},2024/0{n % 3 + 1}/01,{n},acme" for id in range(1, 51)),
+            ]
+            for n in range(8)
+        ]
+
+        def ingest(csvfile):
+            seeder = TransactionSeeder(dbapi=postgres_db, batch_size=10)
+            if not copy:
+                seeder.copy_loader = None
+            return seeder.parse_file(csvfile)
+
+        # When
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(ingest, files))
+
+        # Then
+        assert sum(result.inserted for result in results) == 50
+        assert MonthlyAggregator(dbapi=postgres_db).check_consistency() == []
+
+    def test_malformed_row_after_written_batches_writes_nothing(self, db):
+        # Given
+        seeder = TransactionSeeder(batch_size=1, queue_size=1)
+        csvfile = DUPLICATES_FILE + ["6,2024-05-05,+1"]
+
+        # When
+        with raises(MalformedInputFileError):
+            seeder.parse_file(csvfile)
+
+        # Then
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
+
+    def test_writer_error_stops_the_parser_and_writes_nothing(self, db, monkeypatch):
+        # Given
+        seeder = TransactionSeeder(batch_size=1, queue_size=1)
+        write_batch = TransactionSeeder._write_batch
+        parsed = []
+
+        def failing(self, session, rows, deltas):
+            if len(parsed) > 2:
+                raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+            return write_batch(self, session, rows, deltas)
+
+        def lines():
+            for line in DUPLICATES_FILE * 100:
+                parsed.append(line)
+                yield line
+
+        monkeypatch.setattr(TransactionSeeder, "_write_batch", failing)
+
+        # When
+        with raises(DBClientError):
+            seeder.parse_file(lines())
+
+        # Then
+        assert len(parsed) < len(DUPLICATES_FILE) * 100
+        with db.session_local() as session:
+            assert session.get(Transaction, 1) is None
+
+
+class TestCopyLoader:
+    def test_sqlite_falls_back_to_batched_upserts(self, db):
+        # When
+        seeder = TransactionSeeder()
+
+        # Then
+        assert seeder.copy_loader is None
+
+    def test_csv_lines_are_streamed_in_reads_of_any_size(self):
+        # Given
+        rows = [
+            (1, date(2024, 1, 1), 5.5, "acme"),
+            (2, date(2024, 2, 29), -0.1, 'quoted "id", with a comma'),
+        ]
+        stream = _LineStream(_csv_lines(rows))
+
+        # When
+        chunks = iter(lambda: stream.read(7), "")
+        text = "".join(chunks)
+
+        # Then
+        assert list(reader(text.splitlines())) == [
+            ["0", "1", "2024-01-01", "5.5", "acme"],
+            ["1", "2", "2024-02-29", "-0.1", 'quoted "id", with a comma'],
+        ]
+
+    @mark.parametrize("parser", ["rows", "columnar"])
+    def test_parse_file_loads_with_copy(self, postgres_db, parser):
+        # Given
+        seeder = TransactionSeeder(dbapi=postgres_db, parser=parser)
+        assert seeder.copy_loader is not None
+        seeder.parse_file(["id,date,transaction", "1,2024/01/01,+5.5"])
+        csvfile = [
+            "id,date,transaction,account",
+            "1,2024/02/01,-2,acme",
+            "2,2024/03/01,+3,acme",
+            "2,2024/04/01,+4,other",
+        ]
+
+        # When
+        result = seeder.parse_file(csvfile)
+
+        # Then
+        assert (result.inserted, result.updated) == (1, 1)
+        with postgres_db.session_local() as session:
+            first = session.get(Transaction, 1)
+            second = session.get(Transaction, 2)
+            assert (first.date, first.value, first.account_id) == (
+                date(2024, 2, 1),
+                -2,
+                "acme",
+            )
+            assert (second.date, second.value, second.account_id) == (
+                date(2024, 4, 1),
+                4,
+                "other",
+            )
+        assert MonthlyAggregator(dbapi=postgres_db).check_consistency() == []
+
+    def test_malformed_row_writes_nothing_with_copy(self, postgres_db):
+        # Given
+        seeder = TransactionSeeder(dbapi=postgres_db)
+        csvfile = ["id,date,transaction", "1,2024/01/01,+5.5", "2,2024-01-02,+1"]
+
+        # When
+        with raises(MalformedInputFileError):
+            seeder.parse_file(csvfile)
+
+        # Then
+        with postgres_db.session_local() as session:
+            assert session.get(Transaction, 1) is None
@@ -1,9 +1,14 @@
 #! /usr/bin/python3
 
 
+from datetime import date
+from email import message_from_bytes
+from email.policy import default
 from statistics import mean
 
-from src.transaction_summarizer import TransactionSummarizer
+from pytest import mark, raises
+from src.transaction_seeder import TransactionSeeder
+from src.transaction_summarizer import SummaryWindow, TransactionSummarizer
 
 
 class TestTransactionSummarizer:
@@ -76,3 +81,171 @@ class TestTransactionSummarizer:
 
         # Then
         assert avg_credit == 0
+
+    def test_summary(self, transactions, seed_db) -> None:
+        # Given
+        summarizer = TransactionSummarizer()
+        credits = [t.value for t in transactions if t.value > 0]
+        debits = [t.value for t in transactions if t.value < 0]
+
+        # When
+        summary = summarizer.summary()
+
+        # Then
+        assert summary.count == len(transactions)
+        assert summary.credit_sum == sum(credits)
+        assert summary.credit_count == len(credits)
+        assert summary.debit_sum == sum(debits)
+        assert summary.debit_count == len(debits)
+        assert [(m.year, m.month) for m in summary.months] == [
+            (2021, 1),
+            (2022, 4),
+            (2022, 5),
+            (2023, 7),
+        ]
+        assert summary.months[0].balance == -10
+
+    def test_summary_empty_db(self, db) -> None:
+        # Given
+        summarizer = TransactionSummarizer()
+
+        # When
+        summary = summarizer.summary()
+
+        # Then
+        assert summary.months == ()
+        assert summary.total_balance == 0
+        assert summary.transactions_by_year_month == {}
+
+    @mark.parametrize("use_aggregates", [False, True])
+    def test_summaries_by_account(self, db, use_aggregates) -> None:
+        # Given
+        TransactionSeeder().parse_file(
+            [
+                "id,date,transaction,account",
+                "1,2024/01/01,+10,acme",
+                "2,2024/01/02,-4,globex",
+                "3,2024/02/01,-6,acme",
+                "4,2024/02/02,+1,globex",
+            ]
+        )
+        summarizer = TransactionSummarizer(use_aggregates=use_aggregates)
+        summarizer.partition_size = 1
+
+        # When
+        summaries = dict(summarizer.summaries_by_account())
+
+        # Then
+        assert list(summaries) == ["acme", "globex"]
+        assert summaries["acme"] == summarizer.summary("acme")
+        assert summaries["acme"].total_balance == 4
+        assert summaries["acme"].transactions_by_year_month == {2024: {1: 1, 2: 1}}
+        assert summaries["globex"].average_debit == -4
+        assert summarizer.summary().count == 4
+
+    def test_window_summary(self, seed_db) -> None:
+        # Given
+        summarizer = TransactionSummarizer()
+        window = SummaryWindow.between(date(2022, 5, 1), date(2023, 7, 2))
+
+        # When
+        summary = summarizer.window_summary(window)
+
+        # Then
+        assert summary.current.transactions_by_year_month == {
+            2022: {5: 2},
+            2023: {7: 2},
+        }
+        assert summary.current.total_balance == 20
+        assert summary.previous is None
+
+    def test_window_summary_compared_with_previous_window(self, seed_db) -> None:
+        # Given
+        summarizer = TransactionSummarizer()
+        window = SummaryWindow.year_to_date(today=date(2022, 5, 20))
+
+        # When
+        summary = summarizer.window_summary(window, compare=True)
+
+        # Then
+        assert summary.current.transactions_by_year_month == {2022: {4: 1, 5: 1}}
+        assert summary.current.total_balance == -10
+        assert summary.previous.transactions_by_year_month == {2021: {1: 2}}
+        assert summary.previous.total_balance == -10
+
+    def test_window_summary_of_an_account(self, db) -> None:
+        # Given
+        TransactionSeeder().parse_file(
+            [
+                "id,date,transaction,account",
+                "1,2024/01/31,+10,acme",
+                "2,2024/02/01,-4,globex",
+                "3,2024/02/29,-6,acme",
+                "4,2024/03/01,+1,acme",
+            ]
+        )
+        summarizer = TransactionSummarizer()
+        window = SummaryWindow.last_months(1, today=date(2024, 3, 31))
+
+        # When
+        summary = summarizer.window_summary(window, "acme", compare=True)
+
+        # Then
+        assert summary.current.total_balance == 1
+        assert summary.previous.transactions_by_year_month == {2024: {2: 1}}
+        assert summary.previous.total_balance == -6
+
+
+class TestSummaryWindow:
+    def test_last_months(self):
+        # When
+        window = SummaryWindow.last_months(3, today=date(2024, 5, 31))
+
+        # Then
+        assert (window.start, window.end) == (date(2024, 3, 1), date(2024, 5, 31))
+        previous = window.previous()
+        assert (previous.start, previous.end) == (date(2023, 12, 1), date(2024, 2, 29))
+
+    def test_year_to_date_is_compared_with_the_same_dates_last_year(self):
+        # When
+        window = SummaryWindow.year_to_date(today=date(2024, 2, 29))
+
+        # Then
+        assert (window.start, window.end) == (date(2024, 1, 1), date(2024, 2, 29))
+        previous = window.previous()
+        assert (previous.start, previous.end) == (date(2023, 1, 1), date(2023, 2, 28))
+
+    def test_date_range_is_compared_with_the_range_right_before(self):
+        # When
+        window = SummaryWindow.parse("2024-03-01..2024-03-10")
+
+        # Then
+        previous = window.previous()
+        assert (previous.start, previous.end) == (date(2024, 2, 20), date(2024, 2, 29))
+
+    @mark.parametrize(
+        "spec", ["", "last-0-months", "2024-03-10..2024-03-01", "2024-03-01"]
+    )
+    def test_parse_rejects_invalid_windows(self, spec):
+        # When
+        with raises(ValueError):
+            SummaryWindow.parse(spec)
+
+
+class TestSendSummaryEmail:
+    def test_summary_email_of_a_window(self, seed_db, smtp_server):
+        # Given
+        _, handler = smtp_server
+        summarizer = TransactionSummarizer()
+        summarizer.email_window = "2022-05-01..2023-07-02"
+        summarizer.email_compare = True
+
+        # When
+        summarizer.send_summary_email("owner@example.com", "Summary")
+
+        # Then
+        message = message_from_bytes(handler.messages[0].content, policy=default)
+        plaintext = message.get_body(("plain",)).get_content()
+        assert "Transactions from 2022-05-01 to 2023-07-02" in plaintext
+        assert "Number of transactions in 2021" not in plaintext
+        assert "Compared with 2021-02-27 to 2022-04-30:" in plaintext